@@ -1,12 +1,37 @@
-from typing import Dict, Any
-from langchain_openai import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate
-from langchain.schema import StrOutputParser
-import json
+from typing import Dict, Any, Optional
+from langchain_core.language_models import BaseChatModel
+from agents.clients import bind_request_timeout, get_llm
+from agents.context import ContextManager, timeline
+from agents.deadline import DeadlineExceeded
+from agents.encoding import encode_object
+from agents.records import ResultRecord
+from agents.cache import CachedChain, ResponseCache
+from agents.scheduler import LLMScheduler, ScheduledChain
+from agents.routing import ModelRouter
+from agents.streaming import TokenCallback, ainvoke_chain, invoke_chain
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import StrOutputParser
 
 class AnalystAgent:
-    def __init__(self, model_name: str = "gpt-4-turbo-preview"):
-        self.llm = ChatOpenAI(model_name=model_name, temperature=0)
+    def __init__(self, model_name: str = "gpt-4-turbo-preview", llm: Optional[BaseChatModel] = None,
+                 context_manager: Optional[ContextManager] = None,
+                 cache: Optional[ResponseCache] = None,
+                 scheduler: Optional[LLMScheduler] = None,
+                 router: Optional[ModelRouter] = None):
+        # 配置了路由時由路由選擇模型，並統計該路由的延遲與成本
+        self.router = router
+        if llm is None and router is not None:
+            model_name = router.model_for("analyst")
+            llm = router.llm_for("analyst", max_retries=0 if scheduler else None)
+        # 可注入自訂的 LLM（例如測試或基準測試用的假模型），默認使用共享連接池的客戶端
+        self.llm = llm or get_llm(model_name, max_retries=0 if scheduler else None)
+        self.model_name = getattr(self.llm, "model_name", model_name)
+        self._on_end = router.tracker("analyst", self.model_name) if router else None
+        self.cache = cache
+        # 限速、重試與自適應並發由調度器統一處理
+        self.scheduler = scheduler
+        # 歷史結果按 token 預算窗口化，避免提示隨迭代次數平方增長
+        self.context = context_manager or ContextManager(model_name)
         self.chain = self._create_chain()
     
     def _create_chain(self):
@@ -26,46 +51,58 @@ class AnalystAgent:
             ("human", "{input}")
         ])
         
-        return prompt | self.llm | StrOutputParser()
+        system_prompt = prompt.messages[0].prompt.template
+        chain = prompt | bind_request_timeout(self.llm.bind) | StrOutputParser()
+        if self.scheduler is not None:
+            chain = ScheduledChain(chain, self.scheduler, system_prompt)
+        if self.cache is None:
+            return chain
+        return CachedChain(chain, self.cache, self.model_name, system_prompt)
     
-    def analyze(self, state: Dict[str, Any]) -> Dict[str, Any]:
+    def _prepare_input(self, state: Dict[str, Any]) -> Dict[str, str]:
+        """準備傳給 LLM 的輸入"""
+        # 研究與分析結果按時間順序合併為只追加的歷史（每條結果之前是監督者的分配，標明來源），
+        # 本次分配的任務放在最後，使提示前綴可被快取
+        history = timeline(state.get("task_assignments", []), state.get("research_results", []),
+                           state.get("analysis_results", []))
+        input_data = {
+            "original_task": state.get("original_task", ""),
+            "history": self.context.build_encoded(history, self.context.max_tokens * 2, self.context.keep_recent * 4),
+            "task": state.get("current_task", "")
+        }
+        return {"input": encode_object(input_data.items())}
+    
+    def _build_update(self, state: Dict[str, Any], result: str, status: str = "ok") -> Dict[str, Any]:
+        """返回狀態增量，只包含新增的結果，由工作流的 reducer 追加到歷史中"""
+        return {
+            "analysis_results": [ResultRecord("analyst", state.get("iteration", 1), result, state.get("current_task", ""), status)],
+            "current_agent": "analyst",
+            "next_agent": "supervisor"
+        }
+    
+    def analyze(self, state: Dict[str, Any], on_token: Optional[TokenCallback] = None) -> Dict[str, Any]:
         """執行分析任務"""
         try:
-            # 準備輸入信息
-            input_data = {
-                "task": state.get("current_task", ""),
-                "research_results": state.get("research_results", []),
-                "previous_analysis": state.get("analysis_results", [])
-            }
-            
             # 獲取分析結果
-            result = self.chain.invoke({"input": json.dumps(input_data, ensure_ascii=False)})
-            
-            # 返回新狀態，保持原有狀態的完整性
-            return {
-                "task_assignments": state.get("task_assignments", []),
-                "research_results": state.get("research_results", []),
-                "analysis_results": state.get("analysis_results", []) + [result],
-                "execution_times": state.get("execution_times", []),
-                "agent_sequence": state.get("agent_sequence", []),
-                "current_agent": "analyst",
-                "next_agent": "supervisor",
-                "current_task": state.get("current_task", ""),
-                "final_decision": state.get("final_decision", ""),
-                "iteration": state.get("iteration", 1)
-            }
+            result = invoke_chain(self.chain, self._prepare_input(state), on_token,
+                                  name="analyst", model_name=self.model_name, on_end=self._on_end)
+            return self._build_update(state, result)
+        except DeadlineExceeded:
+            # 時間預算用完時交給工作流處理（跳過節點或返回部分結果），不作為結果保存
+            raise
         except Exception as e:
             print(f"\nAnalyst 錯誤: {str(e)}")
             # 返回錯誤狀態，但確保工作流可以繼續
-            return {
-                "task_assignments": state.get("task_assignments", []),
-                "research_results": state.get("research_results", []),
-                "analysis_results": state.get("analysis_results", []) + [f"分析過程中發生錯誤: {str(e)}"],
-                "execution_times": state.get("execution_times", []),
-                "agent_sequence": state.get("agent_sequence", []),
-                "current_agent": "analyst",
-                "next_agent": "supervisor",
-                "current_task": state.get("current_task", ""),
-                "final_decision": state.get("final_decision", ""),
-                "iteration": state.get("iteration", 1)
-            } 
\ No newline at end of file
+            return self._build_update(state, f"分析過程中發生錯誤: {str(e)}", "error")
+    
+    async def aanalyze(self, state: Dict[str, Any], on_token: Optional[TokenCallback] = None) -> Dict[str, Any]:
+        """analyze 的非同步版本"""
+        try:
+            result = await ainvoke_chain(self.chain, self._prepare_input(state), on_token,
+                                         name="analyst", model_name=self.model_name, on_end=self._on_end)
+            return self._build_update(state, result)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            print(f"\nAnalyst 錯誤: {str(e)}")
+            return self._build_update(state, f"分析過程中發生錯誤: {str(e)}", "error")
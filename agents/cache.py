@@ -0,0 +1,279 @@
+from typing import Any, AsyncIterator, Dict, Iterator, Optional
+from collections import OrderedDict
+import json
+import threading
+import time
+import xxhash
+from agents.tokens import count_tokens
+from agents import tracing
+
+class ResponseCache:
+    """LLM 回應快取的基類，子類實現 _get / _set
+
+    由於所有智能體都以 temperature=0 運行，相同的輸入可以直接重用先前的回應。
+    命中時會累計節省的延遲與 token 數，方便評估快取的效益。
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self.saved_tokens = 0
+        self._stats_lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model_name: str, system_prompt: str, inputs: Dict[str, Any]) -> str:
+        """以模型名稱、系統提示和序列化輸入計算內容地址"""
+        payload = json.dumps(inputs, ensure_ascii=False, sort_keys=True)
+        return xxhash.xxh3_128_hexdigest("\x00".join([model_name, system_prompt, payload]).encode("utf-8"))
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._get(key)
+        with self._stats_lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.saved_seconds += entry["latency"]
+            self.saved_tokens += entry["tokens"]
+        return entry["value"]
+
+    def set(self, key: str, value: str, latency: float, tokens: int) -> None:
+        self._set(key, {"value": value, "latency": latency, "tokens": tokens})
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "saved_seconds": self.saved_seconds,
+            "saved_tokens": self.saved_tokens
+        }
+
+    def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def _set(self, key: str, entry: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+class MemoryCache(ResponseCache):
+    """進程內 LRU 快取"""
+
+    def __init__(self, max_entries: int = 1024):
+        super().__init__()
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _set(self, key: str, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+class SQLiteCache(ResponseCache):
+    """基於 SQLite 的持久化快取，支持 TTL 與總大小上限
+
+    超過 ttl 秒的條目視為未命中並刪除；總大小超過 max_bytes 時
+    按最近訪問時間淘汰最舊的條目。資料庫以 WAL 模式打開，多個進程可以同時讀寫；
+    命中時的訪問時間先記在內存中，累積 touch_batch 條或寫入時才批量更新。
+    資料庫出錯（例如鎖等待超時）時讀取視為未命中、寫入直接放棄，不影響 LLM 調用。
+    """
+
+    def __init__(self, path: str = "llm_cache.sqlite", ttl: Optional[float] = 7 * 24 * 3600,
+                 max_bytes: Optional[int] = 512 * 1024 * 1024, touch_batch: int = 256):
+        super().__init__()
+        from sqlalchemy import Column, Float, Integer, MetaData, String, Table, Text, create_engine, event
+
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.touch_batch = touch_batch
+        self._engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False, "timeout": 30})
+
+        @event.listens_for(self._engine, "connect")
+        def _configure(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.close()
+
+        metadata = MetaData()
+        self._table = Table(
+            "llm_cache", metadata,
+            Column("key", String(32), primary_key=True),
+            Column("value", Text, nullable=False),
+            Column("latency", Float, nullable=False),
+            Column("tokens", Integer, nullable=False),
+            Column("size", Integer, nullable=False),
+            Column("created_at", Float, nullable=False),
+            Column("accessed_at", Float, nullable=False, index=True)
+        )
+        metadata.create_all(self._engine)
+        # 總大小由觸發器維護在單行表中，寫入時不必每次 SUM(size)，多個進程看到的也是同一個值
+        with self._engine.begin() as conn:
+            conn.exec_driver_sql("CREATE TABLE IF NOT EXISTS llm_cache_size (id INTEGER PRIMARY KEY CHECK (id = 0), "
+                                 "total INTEGER NOT NULL)")
+            conn.exec_driver_sql("INSERT OR IGNORE INTO llm_cache_size (id, total) "
+                                 "SELECT 0, COALESCE(SUM(size), 0) FROM llm_cache")
+            conn.exec_driver_sql("CREATE TRIGGER IF NOT EXISTS llm_cache_size_insert AFTER INSERT ON llm_cache "
+                                 "BEGIN UPDATE llm_cache_size SET total = total + NEW.size WHERE id = 0; END")
+            conn.exec_driver_sql("CREATE TRIGGER IF NOT EXISTS llm_cache_size_delete AFTER DELETE ON llm_cache "
+                                 "BEGIN UPDATE llm_cache_size SET total = total - OLD.size WHERE id = 0; END")
+            conn.exec_driver_sql("CREATE TRIGGER IF NOT EXISTS llm_cache_size_update AFTER UPDATE OF size ON llm_cache "
+                                 "BEGIN UPDATE llm_cache_size SET total = total + NEW.size - OLD.size WHERE id = 0; END")
+        self._lock = threading.Lock()
+        self._touched: Dict[str, float] = {}
+
+    def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        from sqlalchemy import delete, select
+        from sqlalchemy.exc import OperationalError
+
+        table = self._table
+        now = time.time()
+        try:
+            with self._engine.connect() as conn:
+                row = conn.execute(select(table.c.value, table.c.latency, table.c.tokens, table.c.created_at)
+                                   .where(table.c.key == key)).first()
+                if row is None:
+                    return None
+                if self.ttl is not None and now - row.created_at > self.ttl:
+                    conn.execute(delete(table).where(table.c.key == key))
+                    conn.commit()
+                    return None
+        except OperationalError as e:
+            print(f"讀取快取失敗，視為未命中: {e.orig}")
+            return None
+        with self._lock:
+            self._touched[key] = now
+            flush = len(self._touched) >= self.touch_batch
+        if flush:
+            self._flush_touched()
+        return {"value": row.value, "latency": row.latency, "tokens": row.tokens}
+
+    def _take_touched(self) -> Dict[str, float]:
+        with self._lock:
+            touched, self._touched = self._touched, {}
+        return touched
+
+    def _flush_touched(self, conn: Any = None) -> None:
+        """把累積的訪問時間批量寫回資料庫"""
+        from sqlalchemy import bindparam, update
+        from sqlalchemy.exc import OperationalError
+
+        touched = self._take_touched()
+        if not touched:
+            return
+        table = self._table
+        stmt = update(table).where(table.c.key == bindparam("k")).values(accessed_at=bindparam("t"))
+        params = [{"k": key, "t": at} for key, at in touched.items()]
+        if conn is not None:
+            conn.execute(stmt, params)
+            return
+        try:
+            with self._engine.begin() as conn:
+                conn.execute(stmt, params)
+        except OperationalError as e:
+            print(f"更新快取訪問時間失敗: {e.orig}")
+
+    def _set(self, key: str, entry: Dict[str, Any]) -> None:
+        from sqlalchemy.exc import OperationalError
+
+        try:
+            self._write(key, entry)
+        except OperationalError as e:
+            print(f"寫入快取失敗，略過: {e.orig}")
+
+    def _write(self, key: str, entry: Dict[str, Any]) -> None:
+        from sqlalchemy import delete, select
+        from sqlalchemy.dialects.sqlite import insert
+
+        table = self._table
+        now = time.time()
+        values = dict(key=key, value=entry["value"], latency=entry["latency"], tokens=entry["tokens"],
+                      size=len(entry["value"].encode("utf-8")), created_at=now, accessed_at=now)
+        with self._engine.begin() as conn:
+            stmt = insert(table).values(**values)
+            conn.execute(stmt.on_conflict_do_update(index_elements=[table.c.key], set_=values))
+            self._flush_touched(conn)
+            if self.max_bytes is None:
+                return
+            total = conn.exec_driver_sql("SELECT total FROM llm_cache_size WHERE id = 0").scalar()
+            if total <= self.max_bytes:
+                return
+            # 按最近訪問時間從舊到新淘汰，直到低於上限
+            for row in conn.execute(select(table.c.key, table.c.size).order_by(table.c.accessed_at)).all():
+                if total <= self.max_bytes:
+                    break
+                conn.execute(delete(table).where(table.c.key == row.key))
+                total -= row.size
+
+class CachedChain:
+    """包裝 prompt | llm | parser 鏈，以內容地址快取其輸出"""
+
+    def __init__(self, chain: Any, cache: ResponseCache, model_name: str, system_prompt: str):
+        self.chain = chain
+        self.cache = cache
+        self.model_name = model_name
+        self.system_prompt = system_prompt
+
+    def _lookup(self, inputs: Dict[str, Any]):
+        key = self.cache.make_key(self.model_name, self.system_prompt, inputs)
+        cached = self.cache.get(key)
+        tracing.annotate(cache_hit=cached is not None)
+        return key, cached
+
+    def _store(self, key: str, inputs: Dict[str, Any], result: str, latency: float) -> None:
+        tokens = count_tokens(json.dumps(inputs, ensure_ascii=False), self.model_name) + count_tokens(result, self.model_name)
+        self.cache.set(key, result, latency, tokens)
+
+    def invoke(self, inputs: Dict[str, Any], config: Optional[Dict[str, Any]] = None) -> str:
+        key, cached = self._lookup(inputs)
+        if cached is not None:
+            return cached
+        start = time.perf_counter()
+        result = self.chain.invoke(inputs, config)
+        self._store(key, inputs, result, time.perf_counter() - start)
+        return result
+
+    async def ainvoke(self, inputs: Dict[str, Any], config: Optional[Dict[str, Any]] = None) -> str:
+        key, cached = self._lookup(inputs)
+        if cached is not None:
+            return cached
+        start = time.perf_counter()
+        result = await self.chain.ainvoke(inputs, config)
+        self._store(key, inputs, result, time.perf_counter() - start)
+        return result
+
+    def stream(self, inputs: Dict[str, Any], config: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+        key, cached = self._lookup(inputs)
+        if cached is not None:
+            yield cached
+            return
+        start = time.perf_counter()
+        chunks = []
+        for chunk in self.chain.stream(inputs, config):
+            chunks.append(chunk)
+            yield chunk
+        # 只有完整輸出才寫入快取
+        self._store(key, inputs, "".join(chunks), time.perf_counter() - start)
+
+    async def astream(self, inputs: Dict[str, Any], config: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        key, cached = self._lookup(inputs)
+        if cached is not None:
+            yield cached
+            return
+        start = time.perf_counter()
+        chunks = []
+        async for chunk in self.chain.astream(inputs, config):
+            chunks.append(chunk)
+            yield chunk
+        self._store(key, inputs, "".join(chunks), time.perf_counter() - start)
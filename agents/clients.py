@@ -0,0 +1,107 @@
+from typing import Any, Callable, Dict, Optional, Tuple
+import threading
+from agents.deadline import remaining
+
+# 進程內共享的 HTTP 連接池設定，可透過 configure_http_pool() 調整
+_pool_config: Dict[str, Any] = {
+    "max_connections": 100,
+    "max_keepalive_connections": 20,
+    "keepalive_expiry": 30.0,
+    "http2": False,  # 需要安裝 h2 套件
+    "timeout": 120.0
+}
+_http_client = None
+_async_http_client = None
+_llms: Dict[Tuple[str, float, Optional[int]], Any] = {}
+_lock = threading.Lock()
+
+def configure_http_pool(**options: Any) -> None:
+    """調整共享連接池參數，需在第一次創建 LLM 之前調用"""
+    unknown = set(options) - set(_pool_config)
+    if unknown:
+        raise ValueError(f"未知的連接池參數: {', '.join(sorted(unknown))}")
+    with _lock:
+        if _http_client is not None or _async_http_client is not None:
+            raise RuntimeError("連接池已創建，請在創建 LLM 之前調用 configure_http_pool()")
+        _pool_config.update(options)
+
+def _limits():
+    import httpx
+    return httpx.Limits(
+        max_connections=_pool_config["max_connections"],
+        max_keepalive_connections=_pool_config["max_keepalive_connections"],
+        keepalive_expiry=_pool_config["keepalive_expiry"]
+    )
+
+def get_http_client():
+    """返回進程內共享的同步 httpx 客戶端"""
+    global _http_client
+    with _lock:
+        if _http_client is None:
+            import httpx
+            _http_client = httpx.Client(limits=_limits(), http2=_pool_config["http2"],
+                                        timeout=_pool_config["timeout"])
+        return _http_client
+
+def get_async_http_client():
+    """返回進程內共享的非同步 httpx 客戶端
+
+    httpx 的非同步連接綁定在創建它的事件循環上，同一進程應只在一個事件循環中使用。
+    """
+    global _async_http_client
+    with _lock:
+        if _async_http_client is None:
+            import httpx
+            _async_http_client = httpx.AsyncClient(limits=_limits(), http2=_pool_config["http2"],
+                                                   timeout=_pool_config["timeout"])
+        return _async_http_client
+
+def get_llm(model_name: str = "gpt-4-turbo-preview", temperature: float = 0,
+            max_retries: Optional[int] = None) -> Any:
+    """返回共享的 ChatOpenAI 實例，相同模型與溫度只創建一次，並共用同一個連接池
+
+    由 LLMScheduler 負責重試時應傳入 max_retries=0，避免 openai 客戶端自行重試而隱藏 429。
+    """
+    key = (model_name, temperature, max_retries)
+    llm = _llms.get(key)
+    if llm is not None:
+        return llm
+    from langchain_openai import ChatOpenAI
+    http_client = get_http_client()
+    async_http_client = get_async_http_client()
+    with _lock:
+        if key not in _llms:
+            options = {} if max_retries is None else {"max_retries": max_retries}
+            _llms[key] = ChatOpenAI(model_name=model_name, temperature=temperature,
+                                    http_client=http_client, http_async_client=async_http_client, **options)
+        return _llms[key]
+
+def bind_request_timeout(build: Callable[..., Any]) -> Any:
+    """返回每次調用時以截止時間的剩餘秒數作為請求超時的 Runnable
+
+    build(**kwargs) 返回綁定了 kwargs 的模型（例如 llm.bind 或 with_structured_output），
+    kwargs 中的 timeout 會傳給 openai 的請求，使截止時間過後在背景執行的請求也會結束；
+    沒有截止時間時使用 build() 的結果。
+    """
+    from langchain_core.runnables import RunnableLambda
+    default = build()
+
+    def select(_: Any) -> Any:
+        timeout = remaining()
+        return default if timeout is None else build(timeout=max(timeout, 0.01))
+
+    async def aselect(value: Any) -> Any:
+        return select(value)
+
+    return RunnableLambda(select, afunc=aselect, name="request_timeout")
+
+def reset_clients() -> None:
+    """關閉並清除共享的客戶端（主要用於測試或切換事件循環）"""
+    global _http_client, _async_http_client
+    with _lock:
+        if _http_client is not None:
+            _http_client.close()
+        _http_client = None
+        # 非同步客戶端需在其事件循環中關閉，這裡只釋放引用
+        _async_http_client = None
+        _llms.clear()
@@ -0,0 +1,148 @@
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+from collections import OrderedDict
+import itertools
+import json
+import threading
+from agents.encoding import RawJSON, encode_array, encode_string, string_body
+from agents.records import ResultRecord
+from agents.tokens import count_tokens
+
+# 快取的一條結果：(原始項, 文本, token 數, 摘要, 摘要 token 數, 原文的 JSON 編碼, 摘要行編碼後去掉引號的部分)
+_Entry = Tuple[Any, str, int, str, int, str, str]
+
+class ContextManager:
+    """為各 agent 構建有 token 預算的歷史上下文
+
+    最近 keep_recent 條結果原樣保留，較早的結果以摘要替代，
+    超出預算時從最舊的摘要開始省略。每條結果的摘要與 token 數
+    只計算一次並快取，因此每次迭代只需處理新增的部分。build_encoded 以快取的 JSON 片段拼接上下文，
+    舊結果不會在每次調用時重新編碼。
+    轉為摘要與省略的條數都按 prefix_step 的倍數增加（整批進行），使上下文在多次調用間
+    只在末尾追加，服務商的提示前綴快取得以命中；設為 1 則每次調用都逐條調整。
+    """
+
+    def __init__(self, model_name: str = "gpt-4-turbo-preview", max_tokens: int = 3000,
+                 keep_recent: int = 2, summary_chars: int = 200,
+                 summarizer: Optional[Callable[[str], str]] = None, cache_size: int = 4096,
+                 prefix_step: int = 8):
+        self.model_name = model_name
+        self.max_tokens = max_tokens
+        self.keep_recent = keep_recent
+        self.prefix_step = max(prefix_step, 1)
+        self.summary_chars = summary_chars
+        # 可選的自訂摘要函數（例如調用 LLM），每條結果只會調用一次
+        self.summarizer = summarizer
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[Any, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _default_summary(self, text: str) -> str:
+        """抽取式摘要：壓縮空白後截取前 summary_chars 個字符"""
+        text = " ".join(text.split())
+        if len(text) <= self.summary_chars:
+            return text
+        return text[:self.summary_chars] + "…"
+
+    def _entry(self, item: Any) -> _Entry:
+        """取得 (原始項, 文本, token 數, 摘要, 摘要 token 數, 編碼, 摘要編碼)，結果會被快取"""
+        # 字符串以內容為鍵；其他對象以 id 為鍵並保留引用，避免 id 被重用
+        key = item if isinstance(item, str) else id(item)
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and (isinstance(item, str) or entry[0] is item):
+                self._cache.move_to_end(key)
+                return entry
+
+        if isinstance(item, str):
+            text = item
+        elif isinstance(item, ResultRecord):
+            text = item.content
+        else:
+            text = json.dumps(item, ensure_ascii=False)
+        # 結果記錄在上下文中只保留內容，編碼為字符串；其他對象原樣保留，其編碼就是上面的 JSON 文本
+        fragment = encode_string(text) if isinstance(item, (str, ResultRecord)) else text
+        summary = self.summarizer(text) if self.summarizer else self._default_summary(text)
+        entry = (item, text, count_tokens(text, self.model_name), summary, count_tokens(summary, self.model_name),
+                 fragment, string_body(f"- {summary}"))
+
+        with self._lock:
+            self._cache[key] = entry
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return entry
+
+    def count(self, item: Any) -> int:
+        """返回單條結果的 token 數（已快取）"""
+        return self._entry(item)[2]
+
+    def _select(self, items: Sequence[Any], budget: Optional[int],
+                keep_recent: Optional[int]) -> Tuple[int, List[_Entry], List[_Entry]]:
+        """返回 (省略的條數, 以摘要保留的結果, 原樣保留的最近結果)"""
+        budget = budget or self.max_tokens
+        split = max(len(items) - (self.keep_recent if keep_recent is None else keep_recent), 0)
+        # 摘要邊界按步長對齊：兩次對齊之間新增的結果保持原樣，已發送的內容不會被改寫；
+        # 多保留的原文超出預算時退回逐條摘要
+        aligned = split // self.prefix_step * self.prefix_step
+        if aligned < split and sum(self._entry(item)[2] for item in items[aligned:]) <= budget:
+            split = aligned
+        older = items[:split]
+        # 最近的結果總是原樣保留
+        recent = [self._entry(item) for item in items[split:]]
+        used = sum(entry[2] for entry in recent)
+
+        # 從新到舊加入摘要，直到預算用完
+        entries = [self._entry(item) for item in older]
+        omitted = 0
+        for index in range(len(entries) - 1, -1, -1):
+            if used + entries[index][4] > budget:
+                omitted = index + 1
+                break
+            used += entries[index][4]
+        if omitted:
+            # 按步長整批省略，避免每次調用都改變上下文的開頭
+            omitted = min(-(-omitted // self.prefix_step) * self.prefix_step, len(entries))
+        return omitted, entries[omitted:], recent
+
+    def build(self, items: Sequence[Any], budget: Optional[int] = None,
+              keep_recent: Optional[int] = None) -> List[Any]:
+        """構建不超過 token 預算的上下文列表"""
+        omitted, summarized, recent = self._select(items, budget, keep_recent)
+        context: List[Any] = []
+        if omitted:
+            context.append(f"（已省略更早的 {omitted} 條結果）")
+        if summarized:
+            context.append("早期結果摘要：\n" + "\n".join(f"- {entry[3]}" for entry in summarized))
+        # 結果記錄只把內容交給模型
+        return context + [entry[1] if isinstance(entry[0], ResultRecord) else entry[0] for entry in recent]
+
+    def build_encoded(self, items: Sequence[Any], budget: Optional[int] = None,
+                      keep_recent: Optional[int] = None) -> RawJSON:
+        """與 build 相同的上下文，直接返回 JSON 數組：由每條結果快取的編碼片段拼接而成
+
+        結果等於 json.dumps(build(...), ensure_ascii=False)。
+        """
+        omitted, summarized, recent = self._select(items, budget, keep_recent)
+        fragments: List[str] = []
+        if omitted:
+            fragments.append(encode_string(f"（已省略更早的 {omitted} 條結果）"))
+        if summarized:
+            # JSON 字符串的轉義逐字符進行，各段轉義後的內容可以直接拼接
+            fragments.append('"' + string_body("早期結果摘要：\n") + "\\n".join(entry[6] for entry in summarized) + '"')
+        fragments.extend(entry[5] for entry in recent)
+        return encode_array(fragments)
+
+def timeline(assignments: Sequence[Any], *results: Sequence[Any]) -> List[Any]:
+    """按時間順序排列歷史：第 j 次任務分配之後緊接第 j 組 worker 結果
+
+    各結果列表按迭代編號合併，同一迭代的結果（例如並行研究的多個分支）為一組。
+    這樣的歷史只會在末尾追加，各次調用的提示前綴保持一致。
+    """
+    records = sorted(itertools.chain(*results), key=lambda record: getattr(record, "iteration", 0))
+    groups = [list(group) for _, group in itertools.groupby(records, key=lambda record: getattr(record, "iteration", 0))]
+    items: List[Any] = []
+    for index in range(max(len(assignments), len(groups))):
+        if index < len(assignments):
+            items.append(assignments[index])
+        if index < len(groups):
+            items.extend(groups[index])
+    return items
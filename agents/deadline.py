@@ -0,0 +1,95 @@
+from typing import Awaitable, Callable, Iterator, Optional, Tuple, TypeVar
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+import asyncio
+import threading
+import time
+
+T = TypeVar("T")
+
+# 當前的截止時間（time.time() 的讀數）與其來源：整次運行為 "run"，節點軟預算為節點名
+_deadline: ContextVar[Optional[Tuple[float, str]]] = ContextVar("deadline", default=None)
+# call_with_deadline 的背景線程中可讀取的取消事件，調用方放棄後用於停止重試等後續工作
+_cancel: ContextVar[Optional[threading.Event]] = ContextVar("deadline_cancel", default=None)
+
+class DeadlineExceeded(Exception):
+    """時間預算用完，scope 表示用完的是整次運行（"run"）還是某個節點的預算"""
+
+    def __init__(self, scope: str):
+        super().__init__(f"超出時間預算（{scope}）")
+        self.scope = scope
+
+@contextmanager
+def deadline_scope(deadline: Optional[float], scope: str = "run") -> Iterator[None]:
+    """在範圍內設置截止時間；外層的截止時間更早時保留外層的"""
+    current = _deadline.get()
+    if deadline is None or (current is not None and current[0] <= deadline):
+        yield
+        return
+    token = _deadline.set((deadline, scope))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+def remaining() -> Optional[float]:
+    """返回剩餘秒數（可能為負），沒有截止時間時返回 None"""
+    current = _deadline.get()
+    return None if current is None else current[0] - time.time()
+
+def check() -> None:
+    """截止時間已過時拋出 DeadlineExceeded"""
+    current = _deadline.get()
+    if current is not None and current[0] <= time.time():
+        raise DeadlineExceeded(current[1])
+
+def cancel_event() -> Optional[threading.Event]:
+    """返回當前 call_with_deadline 調用的取消事件，不在其背景線程中時返回 None"""
+    return _cancel.get()
+
+def _run_cancellable(fn: Callable[[Optional[threading.Event]], T], cancel: threading.Event) -> T:
+    _cancel.set(cancel)
+    return fn(cancel)
+
+def call_with_deadline(fn: Callable[[Optional[threading.Event]], T]) -> T:
+    """在截止時間內同步調用 fn，沒有截止時間時直接在當前線程調用 fn(None)
+
+    fn 在獨立線程中執行並收到一個取消事件；超時後立即拋出 DeadlineExceeded 並設置該事件，
+    流式調用應在收到下一段文本時檢查事件並關閉流，以取消進行中的請求。
+    同步的非流式請求無法中斷，會在背景執行到請求超時為止（見 agents.clients.bind_request_timeout），
+    但不再阻塞調用方；該線程中的 cancel_event() 返回同一事件，LLMScheduler 據此停止重試。
+    """
+    current = _deadline.get()
+    if current is None:
+        return fn(None)
+    deadline, scope = current
+    if deadline <= time.time():
+        raise DeadlineExceeded(scope)
+    cancel = threading.Event()
+    future: "Future[T]" = Future()
+    context = copy_context()
+
+    def run() -> None:
+        try:
+            future.set_result(context.run(_run_cancellable, fn, cancel))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name="deadline-call", daemon=True).start()
+    try:
+        return future.result(timeout=max(deadline - time.time(), 0))
+    except FutureTimeoutError:
+        cancel.set()
+        raise DeadlineExceeded(scope) from None
+
+async def await_with_deadline(awaitable: Awaitable[T]) -> T:
+    """call_with_deadline 的非同步版本：超時時取消進行中的協程（連同其 HTTP 請求）"""
+    current = _deadline.get()
+    if current is None:
+        return await awaitable
+    deadline, scope = current
+    try:
+        return await asyncio.wait_for(awaitable, max(deadline - time.time(), 0))
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded(scope) from None
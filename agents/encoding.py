@@ -0,0 +1,37 @@
+from typing import Any, Iterable, Tuple
+import json
+import orjson
+from agents.records import json_default
+
+# 拼接 agent 輸入所用的 JSON 編碼：輸出與 json.dumps(..., ensure_ascii=False) 逐字節相同，
+# 因此回應快取的鍵與回放模型的錄製提示都不受影響
+
+class RawJSON(str):
+    """已編碼好的 JSON 片段，encode_object 會原樣拼接"""
+    __slots__ = ()
+
+def encode_string(text: str) -> str:
+    """以 orjson 編碼字符串；orjson 不接受單獨的代理字符，此時退回 json 模組"""
+    try:
+        return orjson.dumps(text).decode("utf-8")
+    except TypeError:
+        return json.dumps(text, ensure_ascii=False)
+
+def encode_value(value: Any) -> str:
+    if isinstance(value, RawJSON):
+        return value
+    if isinstance(value, str):
+        return encode_string(value)
+    # 非字符串（例如監督者的任務分配）保持 json.dumps 的默認分隔符，由調用方快取編碼結果
+    return json.dumps(value, ensure_ascii=False, default=json_default)
+
+def string_body(text: str) -> str:
+    """字符串編碼後去掉兩端引號的部分，可以直接拼接成更長的 JSON 字符串"""
+    return encode_string(text)[1:-1]
+
+def encode_array(fragments: Iterable[str]) -> RawJSON:
+    return RawJSON("[" + ", ".join(fragments) + "]")
+
+def encode_object(fields: Iterable[Tuple[str, Any]]) -> str:
+    """按順序拼接 {"鍵": 值, ...}；值為 RawJSON 時不再重新編碼"""
+    return "{" + ", ".join(f"{encode_string(key)}: {encode_value(value)}" for key, value in fields) + "}"
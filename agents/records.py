@@ -0,0 +1,45 @@
+from typing import Any, List, Optional
+from dataclasses import asdict, dataclass, is_dataclass
+
+# 狀態中的歷史記錄使用 __slots__ 數據類：比 dict 更省內存，
+# 且可被檢查點的序列化器（JsonPlusSerializer）直接編碼與還原
+
+@dataclass(slots=True)
+class ResultRecord:
+    """research_results / analysis_results 中的一條結果"""
+    agent: str
+    iteration: int
+    content: str
+    task: str = ""
+    # "ok"；調用出錯時為 "error"，被節點預算跳過時為 "skipped"，這兩類記錄不是可用的結果
+    status: str = "ok"
+
+    def __str__(self) -> str:
+        return self.content
+
+    @property
+    def ok(self) -> bool:
+        return self.status == "ok"
+
+@dataclass(slots=True)
+class BranchRecord:
+    """並行研究中單個分支的執行時間"""
+    branch: int
+    task: str
+    start_time: str
+    execution_time: float
+
+@dataclass(slots=True)
+class StepRecord:
+    """execution_times 中的一個步驟，execution_time 以秒為單位"""
+    iteration: int
+    agent: str
+    start_time: str
+    execution_time: float
+    branches: Optional[List[BranchRecord]] = None
+
+def json_default(obj: Any) -> Any:
+    """供 json.dumps(default=...) 使用，把記錄類型轉為 dict"""
+    if is_dataclass(obj) and not isinstance(obj, type):
+        return asdict(obj)
+    raise TypeError(f"Object of type {obj.__class__.__name__} is not JSON serializable")
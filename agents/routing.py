@@ -0,0 +1,152 @@
+from typing import Any, Callable, Dict, Optional, Tuple
+from collections import deque
+import json
+import os
+import threading
+from agents.clients import get_llm
+from agents.tracing import Span
+
+DEFAULT_MODEL = "gpt-4-turbo-preview"
+
+# 每 1K token 的美元價格（輸入, 輸出），可在路由配置的 "prices" 中覆蓋或補充
+DEFAULT_PRICES: Dict[str, Tuple[float, float]] = {
+    "gpt-4-turbo-preview": (0.01, 0.03),
+    "gpt-4-turbo": (0.01, 0.03),
+    "gpt-4o": (0.0025, 0.01),
+    "gpt-4o-mini": (0.00015, 0.0006),
+    "gpt-3.5-turbo": (0.0005, 0.0015)
+}
+
+# 監督者的路由回合使用小模型，只有決策無效或信心不足時才升級到大模型
+TIERED_ROUTES: Dict[str, str] = {
+    "supervisor": "gpt-4o-mini",
+    "supervisor.escalation": DEFAULT_MODEL,
+    "researcher": DEFAULT_MODEL,
+    "analyst": DEFAULT_MODEL
+}
+
+class ModelRouter:
+    """按 agent 角色與決策類型選擇模型，並統計每條路由的延遲與成本
+
+    路由名稱為角色（"supervisor"、"researcher"、"analyst"），或「角色.決策類型」
+    （例如 "supervisor.escalation"）；未配置的決策類型退回到角色，再退回到 default_model。
+    llms 以模型名稱為鍵注入自訂模型（例如基準測試的假模型），未提供時使用共享客戶端。
+    routes 與 default_model 都未提供時使用內置的分層配置 TIERED_ROUTES。
+    """
+
+    def __init__(self, routes: Optional[Dict[str, str]] = None, default_model: Optional[str] = None,
+                 prices: Optional[Dict[str, Tuple[float, float]]] = None,
+                 llms: Optional[Dict[str, Any]] = None,
+                 min_confidence: float = 0.6, max_samples: int = 10000):
+        if routes is None:
+            routes = TIERED_ROUTES if default_model is None else {}
+        self.routes = dict(routes)
+        self.default_model = default_model or DEFAULT_MODEL
+        self.prices = {**DEFAULT_PRICES, **{k: tuple(v) for k, v in (prices or {}).items()}}
+        self.llms = llms or {}
+        # 監督者決策的 confidence 低於此值時升級
+        self.min_confidence = min_confidence
+        self._max_samples = max_samples
+        self._stats: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_dict(cls, config: Dict[str, Any]) -> "ModelRouter":
+        routes = config.get("routes")
+        # "preset": "tiered" 以內置的分層配置為基礎，routes 中的項目覆蓋同名路由
+        if config.get("preset") == "tiered":
+            routes = {**TIERED_ROUTES, **(routes or {})}
+        elif config.get("preset") is not None:
+            raise ValueError(f"未知的路由預設: {config['preset']}")
+        return cls(routes=routes, default_model=config.get("default"),
+                   prices=config.get("prices"), min_confidence=config.get("min_confidence", 0.6))
+
+    @classmethod
+    def from_file(cls, path: str) -> "ModelRouter":
+        with open(path, encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+    def has_route(self, route: str) -> bool:
+        return route in self.routes
+
+    def model_for(self, route: str) -> str:
+        if route in self.routes:
+            return self.routes[route]
+        return self.routes.get(route.split(".")[0], self.default_model)
+
+    def llm_for(self, route: str, max_retries: Optional[int] = None) -> Any:
+        model = self.model_for(route)
+        if model in self.llms:
+            return self.llms[model]
+        return get_llm(model, max_retries=max_retries)
+
+    def cost(self, model: str, prompt_tokens: int, completion_tokens: int) -> float:
+        prompt_price, completion_price = self.prices.get(model, (0.0, 0.0))
+        return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+    def record(self, route: str, model: str, seconds: float, prompt_tokens: int = 0,
+               completion_tokens: int = 0, cache_hit: bool = False) -> None:
+        with self._lock:
+            stats = self._stats.get((route, model))
+            if stats is None:
+                stats = self._stats[(route, model)] = {
+                    "calls": 0, "cache_hits": 0, "seconds": 0.0, "prompt_tokens": 0, "completion_tokens": 0,
+                    "latencies": deque(maxlen=self._max_samples)
+                }
+            stats["calls"] += 1
+            stats["cache_hits"] += int(cache_hit)
+            stats["seconds"] += seconds
+            stats["prompt_tokens"] += prompt_tokens
+            stats["completion_tokens"] += completion_tokens
+            stats["latencies"].append(seconds)
+
+    def tracker(self, route: str, model: str) -> Callable[[Span], None]:
+        """返回傳給 invoke_chain 的 on_end 回調，從完成的 llm span 讀取延遲與 token 用量"""
+        def on_end(span: Span) -> None:
+            span.attributes["route"] = route
+            self.record(route, model, span.duration, span.attributes.get("prompt_tokens", 0),
+                        span.attributes.get("completion_tokens", 0), bool(span.attributes.get("cache_hit")))
+        return on_end
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """返回每條路由（按 "路由/模型"）的調用次數、延遲分佈、token 用量與估算成本"""
+        result = {}
+        with self._lock:
+            items = [(key, dict(stats), list(stats["latencies"])) for key, stats in self._stats.items()]
+        for (route, model), stats, latencies in items:
+            latencies.sort()
+
+            def pick(pct: float) -> float:
+                return latencies[max(0, min(len(latencies) - 1, int(round(pct / 100 * len(latencies))) - 1))]
+
+            result[f"{route}/{model}"] = {
+                "route": route,
+                "model": model,
+                "calls": stats["calls"],
+                "cache_hits": stats["cache_hits"],
+                "seconds": stats["seconds"],
+                "mean": stats["seconds"] / stats["calls"],
+                "p50": pick(50),
+                "p95": pick(95),
+                "prompt_tokens": stats["prompt_tokens"],
+                "completion_tokens": stats["completion_tokens"],
+                "cost": self.cost(model, stats["prompt_tokens"], stats["completion_tokens"])
+            }
+        return result
+
+    def total_cost(self) -> float:
+        return sum(item["cost"] for item in self.stats().values())
+
+def load_router(path: Optional[str] = None) -> Optional[ModelRouter]:
+    """從 JSON 配置文件載入路由，未指定時讀取 MODEL_ROUTES 環境變量；兩者皆無時返回 None（所有角色使用同一模型）
+
+    配置格式：{"default": "...", "routes": {"supervisor": "...", ...}, "prices": {"模型": [輸入, 輸出]}, "min_confidence": 0.6}
+    只有 default 時所有角色使用該模型；"preset": "tiered" 在內置的分層配置上疊加 routes。
+    MODEL_ROUTES 也可以設為 "tiered" 以使用內置的分層配置。
+    """
+    path = path or os.getenv("MODEL_ROUTES")
+    if not path:
+        return None
+    if path == "tiered":
+        return ModelRouter()
+    return ModelRouter.from_file(path)
@@ -0,0 +1,309 @@
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, Optional, Tuple
+from collections import deque
+import asyncio
+import json
+import threading
+import time
+from tenacity import (AsyncRetrying, Retrying, retry_if_exception, stop_after_attempt, stop_when_event_set,
+                      wait_random_exponential)
+from agents.deadline import DeadlineExceeded, cancel_event, check
+from agents.tokens import count_tokens
+from agents import tracing
+
+def is_retryable(error: BaseException) -> bool:
+    """429 與 5xx 以及連接/超時錯誤可以重試"""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    return type(error).__name__ in ("APIConnectionError", "APITimeoutError")
+
+def is_rate_limited(error: BaseException) -> bool:
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status == 429
+
+class TokenBucket:
+    """令牌桶，按每分鐘速率補充，採用預留方式計算需要等待的時間"""
+
+    def __init__(self, per_minute: float, burst_seconds: float = 10.0):
+        self.rate = per_minute / 60.0
+        # 只允許約 burst_seconds 秒的突發量，避免在服務端的滑動窗口內超限
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        """預留 amount 個令牌，返回需要等待的秒數"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # 單次請求超過桶容量時按容量計，避免永遠等待
+            self._tokens -= min(amount, self.capacity)
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def adjust(self, amount: float) -> None:
+        """以實際用量修正預留量（正數為補扣，負數為退還）"""
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens - amount)
+
+class LLMScheduler:
+    """位於 agent 鏈與模型之間的調度器
+
+    - 以令牌桶同時限制每分鐘請求數（RPM）與 token 數（TPM）
+    - 遇到 429/5xx 時以帶抖動的指數退避重試
+    - 以 AIMD 調整並發上限：成功時加性增加，遇到 429 時乘性減少
+    """
+
+    def __init__(self, requests_per_minute: Optional[float] = 500, tokens_per_minute: Optional[float] = 150000,
+                 initial_concurrency: int = 8, min_concurrency: int = 1, max_concurrency: int = 64,
+                 decrease_factor: float = 0.5, max_attempts: int = 6, backoff_base: float = 1.0,
+                 backoff_max: float = 60.0, completion_tokens_estimate: int = 800,
+                 decrease_cooldown: float = 1.0, model_name: str = "gpt-4-turbo-preview"):
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.decrease_factor = decrease_factor
+        # 同一波 429 只減少一次並發上限
+        self.decrease_cooldown = decrease_cooldown
+        self._last_decrease = 0.0
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.completion_tokens_estimate = completion_tokens_estimate
+        self.model_name = model_name
+
+        self._limit = float(initial_concurrency)
+        self._inflight = 0
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._async_waiters: Deque[Tuple[asyncio.AbstractEventLoop, "asyncio.Future[None]"]] = deque()
+        self.metrics = {"requests": 0, "retries": 0, "rate_limited": 0, "errors": 0, "throttle_seconds": 0.0}
+
+    # 並發控制
+    def _try_acquire_locked(self) -> bool:
+        if self._inflight < max(int(self._limit), self.min_concurrency):
+            self._inflight += 1
+            return True
+        return False
+
+    def _wake_locked(self) -> None:
+        self._cond.notify_all()
+        free = max(int(self._limit), self.min_concurrency) - self._inflight
+        while free > 0 and self._async_waiters:
+            loop, future = self._async_waiters.popleft()
+            if future.done():
+                continue
+            loop.call_soon_threadsafe(lambda f=future: f.done() or f.set_result(None))
+            free -= 1
+
+    def _acquire_slot(self) -> None:
+        with self._cond:
+            while not self._try_acquire_locked():
+                self._cond.wait()
+
+    async def _aacquire_slot(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                if self._try_acquire_locked():
+                    return
+                future = loop.create_future()
+                self._async_waiters.append((loop, future))
+            await future
+
+    def _release_slot(self) -> None:
+        with self._cond:
+            self._inflight -= 1
+            self._wake_locked()
+
+    # AIMD
+    def _on_success(self) -> None:
+        with self._cond:
+            self._limit = min(self.max_concurrency, self._limit + 1.0 / max(self._limit, 1.0))
+            self._wake_locked()
+
+    def _on_failure(self, error: BaseException) -> None:
+        with self._lock:
+            self.metrics["errors"] += 1
+            if is_rate_limited(error):
+                self.metrics["rate_limited"] += 1
+                now = time.monotonic()
+                if now - self._last_decrease >= self.decrease_cooldown:
+                    self._last_decrease = now
+                    self._limit = max(self.min_concurrency, self._limit * self.decrease_factor)
+
+    # 速率限制
+    def _throttle_delay(self, tokens: int) -> float:
+        delay = 0.0
+        if self.request_bucket is not None:
+            delay = max(delay, self.request_bucket.reserve(1))
+        if self.token_bucket is not None:
+            delay = max(delay, self.token_bucket.reserve(tokens))
+        if delay:
+            with self._lock:
+                self.metrics["throttle_seconds"] += delay
+            tracing.add("queue_wait", delay)
+        return delay
+
+    def estimate_tokens(self, text: str) -> int:
+        return count_tokens(text, self.model_name) + self.completion_tokens_estimate
+
+    def settle(self, estimated: int, output: str) -> None:
+        if self.token_bucket is not None:
+            actual = estimated - self.completion_tokens_estimate + count_tokens(output, self.model_name)
+            self.token_bucket.adjust(actual - estimated)
+
+    def _retrying_kwargs(self) -> Dict[str, Any]:
+        def before_sleep(retry_state) -> None:
+            with self._lock:
+                self.metrics["retries"] += 1
+            tracing.add("retries")
+        return {
+            "retry": retry_if_exception(is_retryable),
+            "wait": wait_random_exponential(multiplier=self.backoff_base, max=self.backoff_max),
+            "stop": stop_after_attempt(self.max_attempts),
+            "before_sleep": before_sleep,
+            "reraise": True
+        }
+
+    def call(self, fn, estimated_tokens: int) -> Any:
+        """在速率與並發限制下同步調用 fn，必要時重試
+
+        截止時間已過時不再發起新的嘗試；在 call_with_deadline 的背景線程中，調用方放棄後
+        （取消事件被設置）退避與限速的等待會被立即喚醒並停止重試，不再佔用並發槽。
+        """
+        cancel = cancel_event()
+        sleep = time.sleep if cancel is None else cancel.wait
+        kwargs = self._retrying_kwargs()
+        if cancel is not None:
+            kwargs["stop"] = kwargs["stop"] | stop_when_event_set(cancel)
+        for attempt in Retrying(sleep=sleep, **kwargs):
+            with attempt:
+                check()
+                delay = self._throttle_delay(estimated_tokens)
+                if delay:
+                    sleep(delay)
+                    check()
+                waited = time.perf_counter()
+                self._acquire_slot()
+                tracing.add("queue_wait", time.perf_counter() - waited)
+                try:
+                    # 等待並發槽期間截止時間可能已過
+                    check()
+                    with self._lock:
+                        self.metrics["requests"] += 1
+                    result = fn()
+                except DeadlineExceeded:
+                    raise
+                except Exception as e:
+                    self._on_failure(e)
+                    raise
+                finally:
+                    self._release_slot()
+                self._on_success()
+                return result
+
+    async def acall(self, fn, estimated_tokens: int) -> Any:
+        """call 的非同步版本，fn 返回協程"""
+        async for attempt in AsyncRetrying(**self._retrying_kwargs()):
+            with attempt:
+                check()
+                delay = self._throttle_delay(estimated_tokens)
+                if delay:
+                    await asyncio.sleep(delay)
+                waited = time.perf_counter()
+                await self._aacquire_slot()
+                tracing.add("queue_wait", time.perf_counter() - waited)
+                try:
+                    with self._lock:
+                        self.metrics["requests"] += 1
+                    result = await fn()
+                except Exception as e:
+                    self._on_failure(e)
+                    raise
+                finally:
+                    self._release_slot()
+                self._on_success()
+                return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.metrics)
+            stats["concurrency_limit"] = self._limit
+            stats["inflight"] = self._inflight
+        return stats
+
+def build_scheduler(requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None,
+                    max_concurrency: Optional[int] = None) -> Optional[LLMScheduler]:
+    """按命令行的限額創建調度器，三者皆未指定時返回 None（不限速，由 openai 客戶端自行重試）
+
+    未指定的限額不限制；max_concurrency 同時是 AIMD 並發上限的最大值。
+    """
+    if requests_per_minute is None and tokens_per_minute is None and max_concurrency is None:
+        return None
+    concurrency = max_concurrency or 64
+    return LLMScheduler(requests_per_minute=requests_per_minute, tokens_per_minute=tokens_per_minute,
+                        initial_concurrency=min(8, concurrency), max_concurrency=concurrency)
+
+class ScheduledChain:
+    """包裝 prompt | llm | parser 鏈，使每次調用都經過 LLMScheduler"""
+
+    def __init__(self, chain: Any, scheduler: LLMScheduler, system_prompt: str):
+        self.chain = chain
+        self.scheduler = scheduler
+        self.system_tokens = count_tokens(system_prompt, scheduler.model_name)
+
+    def _estimate(self, inputs: Dict[str, Any]) -> int:
+        return self.system_tokens + self.scheduler.estimate_tokens(json.dumps(inputs, ensure_ascii=False))
+
+    def invoke(self, inputs: Dict[str, Any], config: Optional[Dict[str, Any]] = None) -> Any:
+        estimated = self._estimate(inputs)
+        result = self.scheduler.call(lambda: self.chain.invoke(inputs, config), estimated)
+        self.scheduler.settle(estimated, result if isinstance(result, str) else "")
+        return result
+
+    async def ainvoke(self, inputs: Dict[str, Any], config: Optional[Dict[str, Any]] = None) -> Any:
+        estimated = self._estimate(inputs)
+        result = await self.scheduler.acall(lambda: self.chain.ainvoke(inputs, config), estimated)
+        self.scheduler.settle(estimated, result if isinstance(result, str) else "")
+        return result
+
+    def stream(self, inputs: Dict[str, Any], config: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+        # 流式輸出在收到第一段之前出錯時才可重試，因此先在調度器內取得第一段；
+        # 並發槽只佔用到收到第一段為止
+        estimated = self._estimate(inputs)
+        def first_chunk():
+            iterator = iter(self.chain.stream(inputs, config))
+            return iterator, next(iterator, None)
+        iterator, chunk = self.scheduler.call(first_chunk, estimated)
+        chunks = []
+        while chunk is not None:
+            chunks.append(chunk)
+            yield chunk
+            chunk = next(iterator, None)
+        self.scheduler.settle(estimated, "".join(chunks))
+
+    async def astream(self, inputs: Dict[str, Any], config: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        estimated = self._estimate(inputs)
+        async def first_chunk():
+            iterator = self.chain.astream(inputs, config).__aiter__()
+            try:
+                return iterator, await iterator.__anext__()
+            except StopAsyncIteration:
+                return iterator, None
+        iterator, chunk = await self.scheduler.acall(first_chunk, estimated)
+        chunks = []
+        while chunk is not None:
+            chunks.append(chunk)
+            yield chunk
+            try:
+                chunk = await iterator.__anext__()
+            except StopAsyncIteration:
+                chunk = None
+        self.scheduler.settle(estimated, "".join(chunks))
@@ -0,0 +1,139 @@
+from typing import Dict, List, Optional, Tuple
+from collections import Counter, OrderedDict
+import heapq
+import math
+import re
+import threading
+import xxhash
+
+# 英文與數字按單詞切分，中日韓文字按字切分後組成二元組
+_WORD = re.compile(r"[A-Za-z0-9_]+|[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af]+")
+_CJK = re.compile(r"[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af]")
+
+def tokenize(text: str) -> List[str]:
+    """把文本切分為詞：英文按單詞（小寫），中文按相鄰兩字"""
+    tokens = []
+    for word in _WORD.findall(text):
+        if _CJK.match(word):
+            tokens.extend(word[i:i + 2] for i in range(max(len(word) - 1, 1)))
+        else:
+            tokens.append(word.lower())
+    return tokens
+
+def shingles(text: str, k: int = 3) -> set:
+    """字符 k-gram 集合（忽略空白），用於估算文本的 Jaccard 相似度"""
+    text = " ".join(text.split())
+    if len(text) <= k:
+        return {text} if text else set()
+    return {text[i:i + k] for i in range(len(text) - k + 1)}
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+class MinHasher:
+    """MinHash 簽名：以 num_perm 個哈希函數的最小值估算兩個 shingle 集合的 Jaccard 相似度
+
+    簽名按文本內容快取（LRU），同一段文本在多次比較中只計算一次。長文本只取基礎哈希最小的
+    max_shingles 個 shingle（所有文本使用同一個哈希順序，取樣是協調的），把計算量限制在
+    max_shingles * num_perm 次以內；max_shingles 為 None 時使用全部 shingle。
+    """
+
+    def __init__(self, num_perm: int = 64, k: int = 3, seed: int = 1, cache_size: int = 1024,
+                 max_shingles: Optional[int] = 256):
+        self.num_perm = num_perm
+        self.k = k
+        self.max_shingles = max_shingles
+        # 與 datasketch 相同的通用哈希族：(a * x + b) mod p
+        state = seed
+        self._params = []
+        for _ in range(num_perm):
+            state = xxhash.xxh64_intdigest(state.to_bytes(8, "little"))
+            a = state % (_MERSENNE_PRIME - 1) + 1
+            state = xxhash.xxh64_intdigest(state.to_bytes(8, "little"))
+            self._params.append((a, state % _MERSENNE_PRIME))
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[int, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def signature(self, text: str) -> tuple:
+        key = xxhash.xxh3_64_intdigest(text.encode("utf-8"))
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return cached
+        hashes = {xxhash.xxh32_intdigest(s.encode("utf-8")) for s in shingles(text, self.k)}
+        if self.max_shingles is not None and len(hashes) > self.max_shingles:
+            hashes = heapq.nsmallest(self.max_shingles, hashes)
+        if not hashes:
+            signature = (_MAX_HASH,) * self.num_perm
+        else:
+            signature = tuple(min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes)
+                              for a, b in self._params)
+        with self._lock:
+            self._cache[key] = signature
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return signature
+
+    def similarity(self, a: str, b: str) -> float:
+        if a == b:
+            return 1.0
+        sig_a, sig_b = self.signature(a), self.signature(b)
+        return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / self.num_perm
+
+class TfidfIndex:
+    """增量維護文檔頻率的 TF-IDF 向量器，以稀疏 dict 表示向量並計算餘弦相似度
+
+    IDF 表在文檔增減後第一次使用時重新計算，之後的查詢直接讀取。
+    """
+
+    def __init__(self):
+        self.document_count = 0
+        self.document_frequency: Counter = Counter()
+        self._idf: Optional[Tuple[Dict[str, float], float]] = None
+        self._lock = threading.Lock()
+
+    def add(self, text: str) -> None:
+        """把文檔計入 IDF 統計"""
+        with self._lock:
+            self.document_count += 1
+            self.document_frequency.update(set(tokenize(text)))
+            self._idf = None
+
+    def remove(self, text: str) -> None:
+        """從 IDF 統計中移除文檔（用於淘汰）"""
+        with self._lock:
+            self.document_count = max(self.document_count - 1, 0)
+            self.document_frequency.subtract(set(tokenize(text)))
+            self.document_frequency += Counter()  # 刪除計數為 0 的詞
+            self._idf = None
+
+    def idf(self) -> Tuple[Dict[str, float], float]:
+        """返回 (已知詞的 IDF, 未見過的詞的 IDF)"""
+        with self._lock:
+            if self._idf is None:
+                n = self.document_count
+                # 平滑 IDF，未見過的詞也有正權重
+                self._idf = ({term: math.log((1 + n) / (1 + df)) + 1 for term, df in self.document_frequency.items()},
+                             math.log(1 + n) + 1)
+            return self._idf
+
+    def weigh(self, counts: Dict[str, int]) -> Dict[str, float]:
+        """以詞頻（例如快取的 Counter(tokenize(text))）構建歸一化的向量"""
+        idf, unseen = self.idf()
+        vector = {term: count * idf.get(term, unseen) for term, count in counts.items()}
+        norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+        return {term: weight / norm for term, weight in vector.items()} if norm else {}
+
+    def vector(self, text: str) -> Dict[str, float]:
+        return self.weigh(Counter(tokenize(text)))
+
+    @staticmethod
+    def cosine(a: Dict[str, float], b: Dict[str, float]) -> float:
+        if len(a) > len(b):
+            a, b = b, a
+        return sum(weight * b.get(term, 0.0) for term, weight in a.items())
+
+    def similarity(self, a: str, b: str) -> float:
+        return self.cosine(self.vector(a), self.vector(b))
@@ -0,0 +1,119 @@
+from typing import Any, Callable, Dict, List, Optional
+from contextlib import closing
+from langchain_core.callbacks import BaseCallbackHandler
+from agents.deadline import await_with_deadline, call_with_deadline
+from agents.tokens import PrefixTracker, count_tokens
+from agents.tracing import Span, get_tracer
+import threading
+import time
+
+TokenCallback = Callable[[str], None]
+
+# 進程內共享：同一模型與 agent 的提示在不同運行之間也會命中服務商的前綴快取
+prefix_tracker = PrefixTracker()
+
+class TokenUsageHandler(BaseCallbackHandler):
+    """把一次 LLM 調用的 token 用量寫入對應的 span
+
+    優先使用服務商返回的 usage，缺失時（例如流式輸出）以 tiktoken 估算。
+    cached_tokens 為服務商回報的提示快取命中 token 數；prefix_tokens 為按提示前綴估計的可快取 token 數。
+    """
+
+    def __init__(self, span: Span, model_name: Optional[str] = None):
+        self.span = span
+        self.model_name = model_name
+        self._estimated_prompt = 0
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], **kwargs: Any) -> None:
+        self._estimated_prompt = sum(count_tokens(str(m.content), self.model_name) for batch in messages for m in batch)
+        prompt = "".join(f"<{m.type}>{m.content}" for batch in messages for m in batch)
+        shared, cacheable = prefix_tracker.observe(self.span.name, prompt, self.model_name)
+        self.span.attributes["shared_prefix_tokens"] = shared
+        self.span.attributes["prefix_tokens"] = cacheable
+
+    def on_llm_end(self, response: Any, **kwargs: Any) -> None:
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if usage:
+            prompt, completion = usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+        else:
+            prompt = self._estimated_prompt
+            completion = sum(count_tokens(g.text, self.model_name) for batch in response.generations for g in batch)
+        self.span.attributes["prompt_tokens"] = self.span.attributes.get("prompt_tokens", 0) + prompt
+        self.span.attributes["completion_tokens"] = self.span.attributes.get("completion_tokens", 0) + completion
+        cached = _cached_tokens(usage, response)
+        if cached is not None:
+            self.span.attributes["cached_tokens"] = self.span.attributes.get("cached_tokens", 0) + cached
+
+def _cached_tokens(usage: Dict[str, Any], response: Any) -> Optional[int]:
+    """讀取服務商回報的提示快取命中數：OpenAI 的 prompt_tokens_details 或 langchain 的 usage_metadata"""
+    details = usage.get("prompt_tokens_details") or {}
+    if details.get("cached_tokens") is not None:
+        return details["cached_tokens"]
+    for batch in response.generations:
+        for generation in batch:
+            metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+            cache_read = (metadata.get("input_token_details") or {}).get("cache_read")
+            if cache_read is not None:
+                return cache_read
+    return None
+
+def _input_bytes(inputs: Dict[str, Any]) -> int:
+    return sum(len(str(value).encode("utf-8")) for value in inputs.values())
+
+def invoke_chain(chain: Any, inputs: Dict[str, Any], on_token: Optional[TokenCallback] = None,
+                 name: str = "llm", model_name: Optional[str] = None,
+                 on_end: Optional[Callable[[Span], None]] = None) -> str:
+    """調用鏈；提供 on_token 時改為流式輸出，每收到一段文本即回調
+
+    每次調用記錄為一個 llm span，包含 token 用量、提示前綴快取、輸入輸出字節數以及快取/重試信息，
+    流式輸出時還記錄收到第一段文本的時間（first_token，秒）；
+    調用成功後以完成的 span 調用 on_end（例如按路由統計延遲與成本）。
+    當前上下文設置了截止時間（agents.deadline.deadline_scope）時，超時會取消調用並拋出 DeadlineExceeded。
+    """
+    with get_tracer().span(name, "llm", input_bytes=_input_bytes(inputs), streamed=on_token is not None) as span:
+        config = {"callbacks": [TokenUsageHandler(span, model_name)]}
+
+        def call(cancel: Optional[threading.Event]) -> str:
+            if on_token is None:
+                return chain.invoke(inputs, config)
+            chunks = []
+            with closing(chain.stream(inputs, config)) as stream:
+                for chunk in stream:
+                    if cancel is not None and cancel.is_set():
+                        # 調用方已因超時放棄：關閉流以取消進行中的請求
+                        break
+                    if not chunks:
+                        span.attributes["first_token"] = time.perf_counter() - span.start
+                    chunks.append(chunk)
+                    on_token(chunk)
+            return "".join(chunks)
+
+        result = call_with_deadline(call)
+        span.attributes["output_bytes"] = len(result.encode("utf-8"))
+    if on_end is not None:
+        on_end(span)
+    return result
+
+async def ainvoke_chain(chain: Any, inputs: Dict[str, Any], on_token: Optional[TokenCallback] = None,
+                        name: str = "llm", model_name: Optional[str] = None,
+                        on_end: Optional[Callable[[Span], None]] = None) -> str:
+    """invoke_chain 的非同步版本"""
+    with get_tracer().span(name, "llm", input_bytes=_input_bytes(inputs), streamed=on_token is not None) as span:
+        config = {"callbacks": [TokenUsageHandler(span, model_name)]}
+
+        async def call() -> str:
+            if on_token is None:
+                return await chain.ainvoke(inputs, config)
+            chunks = []
+            async for chunk in chain.astream(inputs, config):
+                if not chunks:
+                    span.attributes["first_token"] = time.perf_counter() - span.start
+                chunks.append(chunk)
+                on_token(chunk)
+            return "".join(chunks)
+
+        result = await await_with_deadline(call())
+        span.attributes["output_bytes"] = len(result.encode("utf-8"))
+    if on_end is not None:
+        on_end(span)
+    return result
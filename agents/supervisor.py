@@ -1,15 +1,104 @@
-from typing import Dict, Any
-from langchain_openai import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate
-from langchain.schema import StrOutputParser
+from typing import Dict, Any, List, Literal, Optional, Tuple
+from langchain_core.language_models import BaseChatModel
+from agents.clients import bind_request_timeout, get_llm
+from agents.context import ContextManager, timeline
+from agents.encoding import encode_object
+from agents.cache import CachedChain, ResponseCache
+from agents.scheduler import LLMScheduler, ScheduledChain
+from agents.routing import ModelRouter
+from agents.streaming import TokenCallback, ainvoke_chain, invoke_chain
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnableLambda
+from pydantic import BaseModel, Field, StrictBool, ValidationError, model_validator
 import json
+import re
+import threading
+
+class SupervisorDecision(BaseModel):
+    """監督者決策的結構化格式"""
+    next_agent: Literal["researcher", "analyst", "end"] = Field(description="下一個執行的Agent")
+    task: str = Field(description="具體任務描述")
+    is_complete: StrictBool = Field(description="任務是否已完成")
+    final_decision: str = Field(default="", description="如果完成，提供最終決策")
+    subtasks: List[str] = Field(default_factory=list, description="可選：互相獨立、可並行研究的子任務")
+    confidence: float = Field(default=1.0, ge=0, le=1, description="對本次決策的信心，0 到 1")
+
+    @model_validator(mode="after")
+    def _check_final_decision(self) -> "SupervisorDecision":
+        if self.is_complete and not self.final_decision:
+            raise ValueError("當 is_complete 為 true 時，必須提供 final_decision")
+        return self
+
+_FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL)
+
+def repair_json(text: str) -> Optional[str]:
+    """本地修復常見的格式問題：去除 markdown 代碼塊並提取第一個 JSON 對象"""
+    fenced = _FENCE_RE.search(text)
+    if fenced:
+        text = fenced.group(1)
+    decoder = json.JSONDecoder()
+    start = text.find("{")
+    while start != -1:
+        try:
+            obj, _ = decoder.raw_decode(text, start)
+            return json.dumps(obj, ensure_ascii=False)
+        except json.JSONDecodeError:
+            start = text.find("{", start + 1)
+    return None
+
+def _structured_to_text(result: Dict[str, Any]) -> str:
+    """把 with_structured_output(include_raw=True) 的輸出轉回 JSON 文本，交由統一的解析流程處理"""
+    if result.get("parsed") is not None:
+        return result["parsed"].model_dump_json()
+    raw = result.get("raw")
+    if raw is not None and getattr(raw, "tool_calls", None):
+        return json.dumps(raw.tool_calls[0]["args"], ensure_ascii=False)
+    return getattr(raw, "content", "") or ""
 
 class SupervisorAgent:
-    def __init__(self, model_name: str = "gpt-4-turbo-preview"):
-        self.llm = ChatOpenAI(model_name=model_name, temperature=0)
-        self.chain = self._create_chain()
+    def __init__(self, model_name: str = "gpt-4-turbo-preview", llm: Optional[BaseChatModel] = None,
+                 context_manager: Optional[ContextManager] = None,
+                 cache: Optional[ResponseCache] = None,
+                 scheduler: Optional[LLMScheduler] = None,
+                 use_structured_output: bool = True, max_decision_retries: int = 1,
+                 router: Optional[ModelRouter] = None):
+        # 配置了路由時，路由回合使用 "supervisor" 路由的模型（通常是小模型）
+        self.router = router
+        # 直接注入 LLM 時只按路由統計，不再由路由選擇模型或升級
+        routed = llm is None and router is not None
+        if routed:
+            model_name = router.model_for("supervisor")
+            llm = router.llm_for("supervisor", max_retries=0 if scheduler else None)
+        # 可注入自訂的 LLM（例如測試或基準測試用的假模型），默認使用共享連接池的客戶端
+        self.llm = llm or get_llm(model_name, max_retries=0 if scheduler else None)
+        self.model_name = getattr(self.llm, "model_name", model_name)
+        self.cache = cache
+        # 限速、重試與自適應並發由調度器統一處理
+        self.scheduler = scheduler
+        # 歷史結果按 token 預算窗口化，避免提示隨迭代次數平方增長
+        self.context = context_manager or ContextManager(model_name)
+        self.use_structured_output = use_structured_output
+        # 本地修復失敗後最多再向 LLM 重試的次數
+        self.max_decision_retries = max_decision_retries
+        self.metrics = {"decisions": 0, "parse_failures": 0, "repaired": 0, "retries": 0, "failed": 0,
+                        "escalations": 0, "low_confidence": 0}
+        self._metrics_lock = threading.Lock()
+        self.chain, self.text_chain = self._create_chain(self.llm, self.model_name)
+        # 每一層為 (路由, 模型名稱, 結構化鏈, 文本鏈, on_end)，前一層決策無效或信心不足時升級到下一層
+        self.tiers = [("supervisor", self.model_name, self.chain, self.text_chain,
+                       router.tracker("supervisor", self.model_name) if router else None)]
+        if routed and router.has_route("supervisor.escalation"):
+            escalation_model = router.model_for("supervisor.escalation")
+            if escalation_model != router.model_for("supervisor"):
+                escalation_llm = router.llm_for("supervisor.escalation", max_retries=0 if scheduler else None)
+                escalation_model = getattr(escalation_llm, "model_name", escalation_model)
+                self.tiers.append(("supervisor.escalation", escalation_model,
+                                   *self._create_chain(escalation_llm, escalation_model),
+                                   router.tracker("supervisor.escalation", escalation_model)))
     
-    def _create_chain(self):
+    def _create_chain(self, llm: BaseChatModel, model_name: str) -> Tuple[Any, Any]:
+        """返回 (決策鏈, 文本鏈)"""
         prompt = ChatPromptTemplate.from_messages([
             ("system", """你是一個Agent監督者，負責協調和管理其他Agent的工作。
             你的職責包括：
@@ -29,7 +118,9 @@ class SupervisorAgent:
                 "next_agent": "researcher" | "analyst" | "end",
                 "task": "具體任務描述",
                 "is_complete": true/false,
-                "final_decision": "如果完成，提供最終決策"
+                "final_decision": "如果完成，提供最終決策",
+                "subtasks": ["可選：互相獨立的子任務1", "子任務2"],
+                "confidence": 0.0 到 1.0 之間的數字
             }}
             
             注意：
@@ -38,6 +129,9 @@ class SupervisorAgent:
             3. is_complete 必須是 true 或 false
             4. 如果 is_complete 為 true，必須提供 final_decision
             5. task 必須是具體的任務描述
+            6. subtasks 為可選字段：當 next_agent 為 "researcher" 且任務範圍較廣時，
+               可將研究拆分為多個互相獨立的子任務，它們會被並行研究並合併結果
+            7. confidence 為你對本次決策的信心，不確定時請如實給出較低的值
             
             示例輸出：
             對於新任務：
@@ -58,64 +152,169 @@ class SupervisorAgent:
             ("human", "{input}")
         ])
         
-        return prompt | self.llm | StrOutputParser()
+        system_prompt = prompt.messages[0].prompt.template
+        # 文本鏈用於流式輸出，以及模型不支持工具調用時
+        text_chain = prompt | bind_request_timeout(llm.bind) | StrOutputParser()
+        chain = text_chain
+        model_key = model_name
+        if self.use_structured_output:
+            try:
+                structured_llm = bind_request_timeout(lambda **kwargs: llm.with_structured_output(
+                    SupervisorDecision, method="function_calling", include_raw=True, **kwargs))
+                chain = prompt | structured_llm | RunnableLambda(_structured_to_text)
+                model_key = f"{model_name}:structured"
+            except NotImplementedError:
+                pass
+        if self.scheduler is not None:
+            structured = chain is not text_chain
+            text_chain = ScheduledChain(text_chain, self.scheduler, system_prompt)
+            chain = ScheduledChain(chain, self.scheduler, system_prompt) if structured else text_chain
+        if self.cache is None:
+            return chain, text_chain
+        return (CachedChain(chain, self.cache, model_key, system_prompt),
+                CachedChain(text_chain, self.cache, model_name, system_prompt))
     
-    def evaluate_and_assign(self, state: Dict[str, Any]) -> Dict[str, Any]:
-        """評估當前狀態並決定下一步行動"""
-        # 準備輸入信息
+    def _prepare_input(self, state: Dict[str, Any], parse_error: Optional[str] = None) -> Dict[str, str]:
+        """準備傳給 LLM 的輸入
+
+        按「原始任務 → 只追加的歷史 → 本次變化的內容」排列，系統提示之後的前綴在各次調用間逐字節相同，
+        可以命中服務商的提示前綴快取。
+        """
+        history = timeline(state.get("task_assignments", []), state.get("research_results", []),
+                           state.get("analysis_results", []))
         input_data = {
-            "current_task": state.get("current_task", ""),
-            "task_assignments": state.get("task_assignments", []),
-            "research_results": state.get("research_results", []),
-            "analysis_results": state.get("analysis_results", [])
+            "original_task": state.get("original_task", ""),
+            # 原先三個列表各有一份預算；時間線中分配與結果交錯，保留的最近條數相應加倍
+            "history": self.context.build_encoded(history, self.context.max_tokens * 3, self.context.keep_recent * 4),
+            "current_task": state.get("current_task", "")
         }
+        if parse_error:
+            input_data["previous_error"] = f"上一次的輸出不是有效的決策（{parse_error}），請嚴格按照 JSON 格式返回"
+        return {"input": encode_object(input_data.items())}
+    
+    def _record(self, key: str) -> None:
+        with self._metrics_lock:
+            self.metrics[key] += 1
+    
+    def decision_stats(self) -> Dict[str, Any]:
+        """返回決策解析的統計數據，包括解析失敗率與本地修復率"""
+        with self._metrics_lock:
+            stats = dict(self.metrics)
+        stats["parse_failure_rate"] = stats["parse_failures"] / stats["decisions"] if stats["decisions"] else 0.0
+        stats["repair_rate"] = stats["repaired"] / stats["parse_failures"] if stats["parse_failures"] else 0.0
+        stats["escalation_rate"] = stats["escalations"] / stats["decisions"] if stats["decisions"] else 0.0
+        return stats
+    
+    def evaluate_and_assign(self, state: Dict[str, Any], on_token: Optional[TokenCallback] = None) -> Dict[str, Any]:
+        """評估當前狀態並決定下一步行動
+
+        配置了升級路由時，小模型的決策無效或信心不足會直接升級到下一層模型，重試只在最後一層進行。
+        """
+        parsed, error = None, None
+        for level, (_, model_name, chain, text_chain, on_end) in enumerate(self.tiers):
+            if level:
+                self._record("escalations")
+            chain = text_chain if on_token else chain
+            retries = self.max_decision_retries if level == len(self.tiers) - 1 else 0
+            error = None
+            for attempt in range(retries + 1):
+                if attempt:
+                    self._record("retries")
+                # 獲取監督者的決策
+                decision = invoke_chain(chain, self._prepare_input(state, error), on_token,
+                                        name="supervisor", model_name=model_name, on_end=on_end)
+                candidate, error = self._decode(decision)
+                if candidate is not None:
+                    parsed = candidate
+                    break
+            if parsed is not None and not self._needs_escalation(parsed):
+                break
+        if parsed is None:
+            return self._build_failure(error, state)
+        return self._build_result(parsed, state)
+    
+    async def aevaluate_and_assign(self, state: Dict[str, Any], on_token: Optional[TokenCallback] = None) -> Dict[str, Any]:
+        """evaluate_and_assign 的非同步版本"""
+        parsed, error = None, None
+        for level, (_, model_name, chain, text_chain, on_end) in enumerate(self.tiers):
+            if level:
+                self._record("escalations")
+            chain = text_chain if on_token else chain
+            retries = self.max_decision_retries if level == len(self.tiers) - 1 else 0
+            error = None
+            for attempt in range(retries + 1):
+                if attempt:
+                    self._record("retries")
+                decision = await ainvoke_chain(chain, self._prepare_input(state, error), on_token,
+                                               name="supervisor", model_name=model_name, on_end=on_end)
+                candidate, error = self._decode(decision)
+                if candidate is not None:
+                    parsed = candidate
+                    break
+            if parsed is not None and not self._needs_escalation(parsed):
+                break
+        if parsed is None:
+            return self._build_failure(error, state)
+        return self._build_result(parsed, state)
+    
+    def _needs_escalation(self, decision: SupervisorDecision) -> bool:
+        if self.router is None or decision.confidence >= self.router.min_confidence:
+            return False
+        self._record("low_confidence")
+        return True
+    
+    def _decode(self, decision: str) -> Tuple[Optional[SupervisorDecision], Optional[str]]:
+        """以 pydantic 驗證決策，失敗時先嘗試本地修復，返回 (決策, 錯誤信息)"""
+        self._record("decisions")
+        try:
+            return SupervisorDecision.model_validate_json(decision), None
+        except ValidationError as e:
+            error = e
+        self._record("parse_failures")
         
-        # 獲取監督者的決策
-        decision = self.chain.invoke({"input": json.dumps(input_data, ensure_ascii=False)})
+        repaired = repair_json(decision)
+        if repaired is not None:
+            try:
+                parsed = SupervisorDecision.model_validate_json(repaired)
+                self._record("repaired")
+                return parsed, None
+            except ValidationError as e:
+                error = e
+        # 只保留簡短的錯誤描述，用於重試提示
+        return None, "; ".join(err["msg"] for err in error.errors())
+    
+    def _build_result(self, decision: SupervisorDecision, state: Dict[str, Any]) -> Dict[str, Any]:
+        """把驗證後的決策轉為狀態更新"""
+        subtasks = decision.subtasks if decision.next_agent == "researcher" else []
         
-        try:
-            # 解析決策
-            decision_data = json.loads(decision)
-            
-            # 驗證決策格式
-            if not isinstance(decision_data, dict):
-                raise ValueError("決策必須是 JSON 對象")
-            
-            required_fields = ["next_agent", "task", "is_complete"]
-            for field in required_fields:
-                if field not in decision_data:
-                    raise ValueError(f"缺少必要字段: {field}")
-            
-            if decision_data["next_agent"] not in ["researcher", "analyst", "end"]:
-                raise ValueError("next_agent 必須是 researcher、analyst 或 end")
-            
-            if not isinstance(decision_data["is_complete"], bool):
-                raise ValueError("is_complete 必須是布爾值")
-            
-            if decision_data["is_complete"] and not decision_data.get("final_decision"):
-                raise ValueError("當 is_complete 為 true 時，必須提供 final_decision")
-            
-            # 返回新狀態
-            return {
-                "task_assignments": [{
-                    "iteration": len(state.get("task_assignments", [])) + 1,
-                    "agent": decision_data["next_agent"],
-                    "task": decision_data["task"]
-                }],
-                "next_agent": decision_data["next_agent"],
-                "current_task": decision_data["task"],
-                "final_decision": decision_data.get("final_decision", ""),
-                "current_agent": "supervisor"
-            }
-            
-        except (json.JSONDecodeError, ValueError) as e:
-            # 如果解析失敗，返回錯誤信息
-            error_msg = f"監督者決策解析失敗: {str(e)}"
-            print(f"\n錯誤: {error_msg}")
-            return {
-                "task_assignments": [],
-                "next_agent": "end",
-                "current_task": state.get("current_task", ""),
-                "final_decision": error_msg,
-                "current_agent": "supervisor"
-            } 
\ No newline at end of file
+        assignment = {
+            "iteration": len(state.get("task_assignments", [])) + 1,
+            "agent": decision.next_agent,
+            "task": decision.task
+        }
+        if subtasks:
+            assignment["subtasks"] = subtasks
+        
+        # 返回新狀態
+        return {
+            "task_assignments": [assignment],
+            "next_agent": decision.next_agent,
+            "current_task": decision.task,
+            "final_decision": decision.final_decision,
+            "subtasks": subtasks,
+            "current_agent": "supervisor"
+        }
+    
+    def _build_failure(self, error: Optional[str], state: Dict[str, Any]) -> Dict[str, Any]:
+        """解析與重試均失敗時返回錯誤信息"""
+        self._record("failed")
+        error_msg = f"監督者決策解析失敗: {error}"
+        print(f"\n錯誤: {error_msg}")
+        return {
+            "task_assignments": [],
+            "next_agent": "end",
+            "current_task": state.get("current_task", ""),
+            "final_decision": error_msg,
+            "subtasks": [],
+            "current_agent": "supervisor"
+        }
@@ -0,0 +1,77 @@
+from typing import Deque, Dict, Optional, Tuple
+from collections import defaultdict, deque
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+_encodings = {}
+_lock = threading.Lock()
+
+def _get_encoding(model_name: str):
+    """取得模型對應的 tiktoken 編碼，無法加載時返回 None"""
+    with _lock:
+        if model_name not in _encodings:
+            try:
+                import tiktoken
+                try:
+                    encoding = tiktoken.encoding_for_model(model_name)
+                except KeyError:
+                    encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                # 離線環境可能無法下載編碼文件，退回字符估算
+                logger.warning(f"無法加載 tiktoken 編碼，改用字符數估算: {str(e)}")
+                encoding = None
+            _encodings[model_name] = encoding
+        return _encodings[model_name]
+
+def count_tokens(text: str, model_name: Optional[str] = None) -> int:
+    """計算文本的 token 數量"""
+    if not text:
+        return 0
+    encoding = _get_encoding(model_name or "gpt-4-turbo-preview")
+    if encoding is None:
+        # 粗略估算：中文約每字一個 token，英文約每 4 個字符一個 token
+        ascii_chars = sum(1 for c in text if ord(c) < 128)
+        return (len(text) - ascii_chars) + ascii_chars // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+# OpenAI 的提示快取：提示至少 1024 個 token 時，按 128 個 token 的塊匹配最長的已快取前綴
+CACHE_MIN_TOKENS = 1024
+CACHE_BLOCK_TOKENS = 128
+
+def common_prefix_length(a: str, b: str) -> int:
+    """返回兩個字符串最長公共前綴的長度（二分查找，切片比較在 C 中完成）"""
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[:mid] == b[:mid]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+class PrefixTracker:
+    """估計每次調用中可以命中服務商提示快取的前綴 token 數
+
+    按 key（模型與 agent）保留最近 history 次調用的提示，新提示與其中任一條的最長公共前綴
+    達到 min_tokens 時，按 block_tokens 向下取整作為可快取的部分。服務商沒有返回
+    cached_tokens 時（例如流式輸出或其他服務商），可用來檢查提示佈局是否穩定。
+    """
+
+    def __init__(self, history: int = 8, min_tokens: int = CACHE_MIN_TOKENS, block_tokens: int = CACHE_BLOCK_TOKENS):
+        self.min_tokens = min_tokens
+        self.block_tokens = block_tokens
+        self._prompts: Dict[Tuple[str, str], Deque[str]] = defaultdict(lambda: deque(maxlen=history))
+        self._lock = threading.Lock()
+
+    def observe(self, key: str, prompt: str, model_name: Optional[str] = None) -> Tuple[int, int]:
+        """記錄一次提示，返回 (與之前的提示共享的前綴 token 數, 估計可快取的 token 數)"""
+        with self._lock:
+            previous = list(self._prompts[(model_name or "", key)])
+            self._prompts[(model_name or "", key)].append(prompt)
+        length = max((common_prefix_length(prompt, other) for other in previous), default=0)
+        shared = count_tokens(prompt[:length], model_name)
+        if shared < self.min_tokens:
+            return shared, 0
+        return shared, shared // self.block_tokens * self.block_tokens
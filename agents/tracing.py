@@ -0,0 +1,175 @@
+from typing import Any, Deque, Dict, Iterator, List, Optional
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+import json
+import os
+import threading
+import time
+
+class Span:
+    """一段計時記錄，時間均為 time.perf_counter() 的秒數"""
+    __slots__ = ("name", "category", "trace_id", "span_id", "parent_id", "thread_id", "start", "end", "attributes")
+
+    def __init__(self, name: str, category: str, trace_id: str, span_id: str, parent_id: Optional[str],
+                 attributes: Dict[str, Any]):
+        self.name = name
+        self.category = category
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.thread_id = threading.get_ident()
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.attributes = attributes
+
+    @property
+    def duration(self) -> float:
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+class Tracer:
+    """記錄節點與 LLM 調用的 span，並維護每個名稱的延遲分佈
+
+    span 保存在有上限的隊列中，可匯出為 Chrome trace 或 OpenTelemetry JSON。
+    """
+
+    def __init__(self, max_spans: int = 100000, max_samples: int = 10000):
+        self.spans: Deque[Span] = deque(maxlen=max_spans)
+        self._samples: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=max_samples))
+        self._lock = threading.Lock()
+        # perf_counter 與牆上時間的對應，用於匯出絕對時間戳
+        self._epoch = time.time() - time.perf_counter()
+
+    @contextmanager
+    def span(self, name: str, category: str = "node", **attributes: Any) -> Iterator[Span]:
+        parent = _current_span.get()
+        span = Span(name, category,
+                    trace_id=parent.trace_id if parent else os.urandom(16).hex(),
+                    span_id=os.urandom(8).hex(),
+                    parent_id=parent.span_id if parent else None,
+                    attributes=attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.attributes["error"] = type(e).__name__
+            raise
+        finally:
+            span.end = time.perf_counter()
+            _current_span.reset(token)
+            with self._lock:
+                self.spans.append(span)
+                self._samples[f"{category}.{name}"].append(span.end - span.start)
+
+    def percentiles(self) -> Dict[str, Dict[str, float]]:
+        """返回每個 span 名稱的次數、平均值與 p50/p95/p99（秒）"""
+        with self._lock:
+            samples = {key: sorted(values) for key, values in self._samples.items()}
+        result = {}
+        for key, values in samples.items():
+            if not values:
+                continue
+            def pick(pct: float) -> float:
+                return values[min(len(values) - 1, max(0, int(round(pct / 100 * len(values))) - 1))]
+            result[key] = {
+                "count": len(values),
+                "mean": sum(values) / len(values),
+                "p50": pick(50),
+                "p95": pick(95),
+                "p99": pick(99)
+            }
+        return result
+
+    def totals(self, category: str = "llm") -> Dict[str, float]:
+        """匯總某類 span 的數值屬性，例如 token 用量、重試次數與排隊時間"""
+        totals: Dict[str, float] = defaultdict(float)
+        for span in self._snapshot():
+            if span.category != category:
+                continue
+            totals["count"] += 1
+            for key, value in span.attributes.items():
+                if isinstance(value, bool):
+                    totals[key] += int(value)
+                elif isinstance(value, (int, float)):
+                    totals[key] += value
+        return dict(totals)
+
+    def _snapshot(self) -> List[Span]:
+        with self._lock:
+            return list(self.spans)
+
+    def export_chrome_trace(self, path: str) -> None:
+        """匯出 Chrome trace 格式（可在 chrome://tracing 或 Perfetto 中打開）"""
+        events = []
+        for span in self._snapshot():
+            events.append({
+                "name": span.name,
+                "cat": span.category,
+                "ph": "X",
+                "ts": (self._epoch + span.start) * 1e6,
+                "dur": span.duration * 1e6,
+                "pid": os.getpid(),
+                "tid": span.thread_id,
+                "args": dict(span.attributes, trace_id=span.trace_id)
+            })
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+
+    def export_otel_json(self, path: str, service_name: str = "multi-agent-supervisor") -> None:
+        """匯出 OpenTelemetry OTLP/JSON 格式的 span"""
+        def attribute(key: str, value: Any) -> Dict[str, Any]:
+            if isinstance(value, bool):
+                return {"key": key, "value": {"boolValue": value}}
+            if isinstance(value, int):
+                return {"key": key, "value": {"intValue": str(value)}}
+            if isinstance(value, float):
+                return {"key": key, "value": {"doubleValue": value}}
+            return {"key": key, "value": {"stringValue": str(value)}}
+
+        spans = []
+        for span in self._snapshot():
+            spans.append({
+                "traceId": span.trace_id,
+                "spanId": span.span_id,
+                "parentSpanId": span.parent_id or "",
+                "name": span.name,
+                "kind": 1,
+                "startTimeUnixNano": str(int((self._epoch + span.start) * 1e9)),
+                "endTimeUnixNano": str(int((self._epoch + span.start + span.duration) * 1e9)),
+                "attributes": [attribute("category", span.category)] +
+                              [attribute(k, v) for k, v in span.attributes.items()]
+            })
+        payload = {"resourceSpans": [{
+            "resource": {"attributes": [attribute("service.name", service_name)]},
+            "scopeSpans": [{"scope": {"name": "tracing"}, "spans": spans}]
+        }]}
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False)
+
+    def dump_percentiles(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.percentiles(), f, ensure_ascii=False, indent=2)
+
+_tracer = Tracer()
+
+def get_tracer() -> Tracer:
+    return _tracer
+
+def set_tracer(tracer: Tracer) -> None:
+    """替換進程內的全局 tracer（例如每次批量運行使用新的實例）"""
+    global _tracer
+    _tracer = tracer
+
+def annotate(**attributes: Any) -> None:
+    """為當前 span 設置屬性，沒有當前 span 時忽略"""
+    span = _current_span.get()
+    if span is not None:
+        span.attributes.update(attributes)
+
+def add(key: str, amount: float = 1) -> None:
+    """累加當前 span 的數值屬性，例如重試次數或排隊時間"""
+    span = _current_span.get()
+    if span is not None:
+        span.attributes[key] = span.attributes.get(key, 0) + amount
@@ -0,0 +1,249 @@
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+import io
+import os
+import struct
+import threading
+import time
+import xxhash
+from agents.records import json_default
+
+# 索引文件頭：魔數 + 編碼格式
+_MAGIC = b"MASARC1\x00"
+_HEADER = struct.Struct("<8sB7x")
+# 每次運行一條固定長度的索引：run_id 哈希、幀偏移、壓縮長度、解壓長度、步驟數、寫入時間
+_ENTRY = struct.Struct("<QQIIII")
+_LENGTH = struct.Struct("<I")
+_CODECS = {"msgpack": 0, "json": 1}
+
+def _codec(name: str) -> Tuple[Callable[[Any], bytes], Callable[[bytes], Any]]:
+    if name == "msgpack":
+        import ormsgpack
+        return (lambda obj: ormsgpack.packb(obj, default=json_default,
+                                            option=ormsgpack.OPT_NON_STR_KEYS)), ormsgpack.unpackb
+    if name == "json":
+        import orjson
+        return (lambda obj: orjson.dumps(obj, default=json_default,
+                                         option=orjson.OPT_NON_STR_KEYS)), orjson.loads
+    raise ValueError(f"未知的編碼格式: {name}")
+
+def _run_key(run_id: str) -> int:
+    return xxhash.xxh3_64_intdigest(run_id.encode("utf-8"))
+
+def steps_from_events(events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """把 run_with_events / stream_workflow 的事件轉為步驟記錄（忽略 token 事件）"""
+    recorder = StepRecorder()
+    for event in events:
+        recorder(event)
+    return recorder.steps
+
+class StepRecorder:
+    """作為工作流的事件 sink，把每個節點的 state_delta 收集為步驟記錄"""
+
+    def __init__(self, forward: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.steps: List[Dict[str, Any]] = []
+        self._forward = forward
+        self._current: Dict[str, Any] = {}
+
+    def __call__(self, event: Dict[str, Any]) -> None:
+        kind = event["type"]
+        if kind == "node_start":
+            self._current = {"node": event["node"], "iteration": event["iteration"]}
+        elif kind == "node_end":
+            self._current["execution_time"] = event["execution_time"]
+        elif kind == "state_delta":
+            self.steps.append({"step": len(self.steps), **self._current, "delta": event["delta"]})
+            self._current = {}
+        if self._forward is not None:
+            self._forward(event)
+
+class RunArchive:
+    """只追加的運行歸檔：每次運行的步驟增量與最終狀態寫成一個 zstd 幀
+
+    幀內每條記錄為 4 字節長度 + 編碼後的內容（ormsgpack 或 orjson），依次為
+    {"run_id", "meta"}、各步驟記錄、{"final": 最終狀態}。索引文件（path + ".idx"）
+    為每次運行記錄一條固定長度的條目，查詢單次運行或步驟時只解壓對應的幀。
+    多個進程不應寫入同一個歸檔，並行批量執行時每個進程使用各自的文件。
+    """
+
+    def __init__(self, path: str, codec: str = "msgpack", level: int = 3):
+        import zstandard
+
+        self.path = path
+        self.index_path = path + ".idx"
+        self.level = level
+        self._lock = threading.Lock()
+        self._index: Optional[Dict[int, List[Tuple[int, int, int, int, int]]]] = None
+        self._index_size = 0
+        # stats() 的累計值與已計入的索引字節數：本進程寫入時直接累加，其他進程追加的條目在下次調用時補讀
+        self._totals = {"runs": 0, "steps": 0, "compressed_bytes": 0, "raw_bytes": 0}
+        self._totals_size = _HEADER.size
+        self._compressor = zstandard.ZstdCompressor(level=level)
+        self._decompressor = zstandard.ZstdDecompressor()
+        if os.path.exists(self.index_path) and os.path.getsize(self.index_path) >= _HEADER.size:
+            with open(self.index_path, "rb") as f:
+                magic, codec_id = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != _MAGIC:
+                raise ValueError(f"無效的歸檔索引文件: {self.index_path}")
+            codec = next(name for name, value in _CODECS.items() if value == codec_id)
+        else:
+            with open(self.index_path, "wb") as f:
+                f.write(_HEADER.pack(_MAGIC, _CODECS[codec]))
+        self.codec = codec
+        self._encode, self._decode = _codec(codec)
+
+    # 寫入
+
+    def _frame(self, records: List[Any]) -> Tuple[bytes, int]:
+        buffer = io.BytesIO()
+        for record in records:
+            payload = self._encode(record)
+            buffer.write(_LENGTH.pack(len(payload)))
+            buffer.write(payload)
+        raw = buffer.getvalue()
+        return self._compressor.compress(raw), len(raw)
+
+    def write_run(self, run_id: str, steps: List[Dict[str, Any]], final_state: Optional[Dict[str, Any]],
+                  meta: Optional[Dict[str, Any]] = None) -> None:
+        """追加一次運行；相同 run_id 再次寫入時，查詢返回最新的一次"""
+        frame, raw_size = self._frame([{"run_id": run_id, "meta": meta or {}}, *steps, {"final": final_state}])
+        with self._lock:
+            with open(self.path, "ab") as f:
+                offset = f.tell()
+                f.write(frame)
+            entry = (_run_key(run_id), offset, len(frame), raw_size, len(steps), int(time.time()))
+            # 數據先於索引寫入，中斷時最多留下一個沒有索引的幀
+            with open(self.index_path, "ab") as f:
+                position = f.tell()
+                f.write(_ENTRY.pack(*entry))
+            if position == self._totals_size:
+                self._count(entry)
+                self._totals_size += _ENTRY.size
+            if self._index is not None:
+                self._index.setdefault(entry[0], []).append(entry[1:])
+                self._index_size = os.path.getsize(self.index_path)
+
+    # 讀取
+
+    def _load_index(self) -> Dict[int, List[Tuple[int, int, int, int, int]]]:
+        # 只讀取上次之後新增的索引條目，其他進程追加的運行也能被查到
+        size = os.path.getsize(self.index_path)
+        with self._lock:
+            if self._index is None:
+                self._index, self._index_size = {}, _HEADER.size
+            if size > self._index_size:
+                with open(self.index_path, "rb") as f:
+                    f.seek(self._index_size)
+                    data = f.read(size - self._index_size)
+                usable = len(data) - len(data) % _ENTRY.size
+                for key, *entry in _ENTRY.iter_unpack(data[:usable]):
+                    self._index.setdefault(key, []).append(tuple(entry))
+                self._index_size += usable
+            return self._index
+
+    def _entries(self) -> Iterator[Tuple[int, int, int, int, int, int]]:
+        """按寫入順序遍歷索引條目"""
+        with open(self.index_path, "rb") as f:
+            f.seek(_HEADER.size)
+            while True:
+                chunk = f.read(_ENTRY.size * 4096)
+                if not chunk:
+                    return
+                yield from _ENTRY.iter_unpack(chunk[:len(chunk) - len(chunk) % _ENTRY.size])
+
+    def _records(self, offset: int, length: int) -> Iterator[Any]:
+        """流式解壓一個幀並逐條解碼記錄"""
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            frame = f.read(length)
+        # 只把該幀交給解壓器，避免讀到後面的幀；解壓與解碼仍逐條進行
+        with self._decompressor.stream_reader(io.BytesIO(frame)) as reader:
+            while True:
+                header = reader.read(_LENGTH.size)
+                if len(header) < _LENGTH.size:
+                    return
+                yield self._decode(reader.read(_LENGTH.unpack(header)[0]))
+
+    def _locate(self, run_id: str) -> Optional[Tuple[int, int]]:
+        # 哈希衝突時從最新的條目開始核對幀中的 run_id
+        for offset, length, *_ in reversed(self._load_index().get(_run_key(run_id), [])):
+            if next(self._records(offset, length))["run_id"] == run_id:
+                return offset, length
+        return None
+
+    def __contains__(self, run_id: str) -> bool:
+        return self._locate(run_id) is not None
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self._load_index().values())
+
+    def iter_steps(self, run_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """惰性遍歷某次運行的步驟記錄；不指定 run_id 時按寫入順序遍歷整個歸檔的步驟（帶 run_id 字段）"""
+        if run_id is not None:
+            location = self._locate(run_id)
+            if location is None:
+                return
+            yield from (record for record in self._records(*location) if "step" in record)
+            return
+        for _, offset, length, *_ in self._entries():
+            records = self._records(offset, length)
+            current = next(records)["run_id"]
+            for record in records:
+                if "step" in record:
+                    yield {"run_id": current, **record}
+
+    def get_step(self, run_id: str, step: int) -> Optional[Dict[str, Any]]:
+        return next((record for record in self.iter_steps(run_id) if record["step"] == step), None)
+
+    def get_run(self, run_id: str) -> Optional[Dict[str, Any]]:
+        """返回 {"run_id", "meta", "steps", "final"}，不存在時返回 None"""
+        location = self._locate(run_id)
+        if location is None:
+            return None
+        records = self._records(*location)
+        run = {**next(records), "steps": []}
+        for record in records:
+            if "final" in record:
+                run["final"] = record["final"]
+            else:
+                run["steps"].append(record)
+        return run
+
+    def final_state(self, run_id: str) -> Optional[Dict[str, Any]]:
+        run = self.get_run(run_id)
+        return run["final"] if run is not None else None
+
+    def iter_runs(self, include_steps: bool = True) -> Iterator[Dict[str, Any]]:
+        """按寫入順序惰性遍歷所有運行，每次只解壓一個幀"""
+        for _, offset, length, *_ in self._entries():
+            records = self._records(offset, length)
+            run = {**next(records), "steps": []}
+            for record in records:
+                if "final" in record:
+                    run["final"] = record["final"]
+                elif include_steps:
+                    run["steps"].append(record)
+            yield run
+
+    def _count(self, entry: Tuple[int, int, int, int, int, int]) -> None:
+        _, _, length, raw_size, step_count, _ = entry
+        self._totals["runs"] += 1
+        self._totals["steps"] += step_count
+        self._totals["compressed_bytes"] += length
+        self._totals["raw_bytes"] += raw_size
+
+    def stats(self) -> Dict[str, Any]:
+        """累計統計；只讀取上次之後由其他進程追加的索引條目，成本不隨歸檔大小增長"""
+        size = os.path.getsize(self.index_path)
+        with self._lock:
+            if size > self._totals_size:
+                with open(self.index_path, "rb") as f:
+                    f.seek(self._totals_size)
+                    data = f.read(size - self._totals_size)
+                usable = len(data) - len(data) % _ENTRY.size
+                for entry in _ENTRY.iter_unpack(data[:usable]):
+                    self._count(entry)
+                self._totals_size += usable
+            stats: Dict[str, Any] = dict(self._totals)
+        stats["ratio"] = stats["raw_bytes"] / stats["compressed_bytes"] if stats["compressed_bytes"] else 0.0
+        stats["index_bytes"] = size
+        return stats
@@ -0,0 +1,427 @@
+from typing import TYPE_CHECKING, Dict, Any, Iterator, Optional, Set, Tuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from agents.cache import ResponseCache, SQLiteCache
+from agents.records import json_default
+from agents.routing import ModelRouter, load_router
+from agents.scheduler import LLMScheduler, build_scheduler
+from agents.tracing import get_tracer
+from archive import RunArchive, StepRecorder
+from budgets import NodeBudgets
+from checkpoint import CheckpointStore
+from research_store import ResearchStore
+from sharding import ShardPool, merge_worker_stats
+from speculation import Speculator
+from dotenv import load_dotenv
+import argparse
+import csv
+import functools
+import json
+import logging
+import os
+import signal
+import time
+from workflow import get_async_workflow, get_workflow, create_initial_state, run_with_events
+
+if TYPE_CHECKING:
+    from langchain_core.language_models import BaseChatModel
+
+# 加載環境變量
+load_dotenv()
+
+# 設置日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def iter_tasks(path: str, id_field: str = "id", task_field: str = "task") -> Iterator[Tuple[str, str]]:
+    """逐行讀取 JSONL 或 CSV 任務文件，返回 (任務ID, 任務描述)"""
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.lower().endswith(".csv"):
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        for line_no, row in enumerate(rows, 1):
+            task = row.get(task_field)
+            if not task:
+                logger.warning(f"第 {line_no} 行缺少 {task_field} 字段，已跳過")
+                continue
+            yield str(row.get(id_field) or line_no), task
+
+def load_completed_ids(path: str) -> Set[str]:
+    """讀取輸出文件中已完成的任務ID，用於斷點續跑"""
+    completed = set()
+    if not os.path.exists(path):
+        return completed
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                completed.add(json.loads(line)["task_id"])
+            except (json.JSONDecodeError, KeyError):
+                # 最後一行可能因中斷而不完整
+                continue
+    return completed
+
+def percentile(values: list, pct: float) -> float:
+    """最近秩法計算百分位數"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+def run_batch(input_path: str, output_path: str, workers: int = 4,
+              id_field: str = "id", task_field: str = "task",
+              llm: Optional["BaseChatModel"] = None,
+              cache: Optional[ResponseCache] = None,
+              checkpointer: Optional[CheckpointStore] = None,
+              router: Optional[ModelRouter] = None,
+              speculation: Optional[Speculator] = None,
+              archive: Optional[RunArchive] = None,
+              research_store: Optional[ResearchStore] = None,
+              budgets: Optional[NodeBudgets] = None,
+              scheduler: Optional[LLMScheduler] = None) -> Dict[str, Any]:
+    """以有界線程池批量執行任務，每完成一個任務立即寫入輸出文件
+
+    指定 archive 時，每個任務的步驟增量與最終狀態同時寫入壓縮的運行歸檔；
+    指定 research_store 時，相似任務之間共享研究結果；指定 budgets 時按節點預算跳過或降級慢的節點；
+    指定 scheduler 時所有 LLM 調用經過同一個調度器限速與重試。
+    """
+    completed = load_completed_ids(output_path)
+    if completed:
+        print(f"發現 {len(completed)} 個已完成任務，將跳過")
+
+    workflow = get_workflow(llm=llm, cache=cache, checkpointer=checkpointer, scheduler=scheduler, router=router,
+                            speculation=speculation, research_store=research_store, budgets=budgets)
+
+    def run_one(task_id: str, task: str) -> Dict[str, Any]:
+        start = time.perf_counter()
+        # 以任務ID作為運行ID，中斷的任務可從最後完成的步驟繼續
+        if archive is None:
+            final_state = workflow(create_initial_state(task), task_id)
+        else:
+            recorder = StepRecorder()
+            final_state = run_with_events(workflow, create_initial_state(task), recorder, task_id)
+            archive.write_run(task_id, recorder.steps, final_state, {"task": task})
+        return {
+            "task_id": task_id,
+            "task": task,
+            "latency": time.perf_counter() - start,
+            "state": final_state
+        }
+
+    latencies = []
+    failed = 0
+    skipped = 0
+    # tracer 是進程級的，LLM 調用數以本次批量開始前的計數為基準
+    calls_before = get_tracer().totals("llm").get("count", 0)
+    start_time = time.perf_counter()
+
+    with open(output_path, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+
+        def drain(return_when) -> None:
+            nonlocal failed
+            done, _ = wait(pending, return_when=return_when)
+            for future in done:
+                task_id = pending.pop(future)
+                try:
+                    record = future.result()
+                except Exception as e:
+                    failed += 1
+                    logger.error(f"任務 {task_id} 執行錯誤: {str(e)}", exc_info=True)
+                    continue
+                out.write(json.dumps(record, ensure_ascii=False, default=json_default) + "\n")
+                out.flush()
+                if checkpointer is not None:
+                    # 結果已寫入輸出文件，不再需要該任務的檢查點
+                    checkpointer.delete(task_id)
+                latencies.append(record["latency"])
+
+        for task_id, task in iter_tasks(input_path, id_field, task_field):
+            if task_id in completed:
+                skipped += 1
+                continue
+            # 限制在途任務數量，避免一次性讀入整個任務文件
+            if len(pending) >= workers * 2:
+                drain(FIRST_COMPLETED)
+            pending[pool.submit(run_one, task_id, task)] = task_id
+            completed.add(task_id)
+
+        while pending:
+            drain(FIRST_COMPLETED)
+
+    elapsed = time.perf_counter() - start_time
+    llm_usage = get_tracer().totals("llm")
+    return {
+        "completed": len(latencies),
+        "failed": failed,
+        "skipped": skipped,
+        "elapsed": elapsed,
+        "throughput": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        "p50_latency": percentile(latencies, 50),
+        "p95_latency": percentile(latencies, 95),
+        # 每次 LLM 調用（含快取命中）記錄一個 llm span：並行分支、決策重試與升級都會計入，
+        # 重用的研究結果與被跳過的節點則不會
+        "llm_calls": int(llm_usage.get("count", 0) - calls_before),
+        "cache": cache.stats() if cache is not None else None,
+        "decisions": workflow.agents["supervisor"].decision_stats(),
+        # 進程內 tracer 的每節點 / 每次 LLM 調用延遲分佈與用量匯總
+        "latency_by_span": get_tracer().percentiles(),
+        "llm_usage": llm_usage,
+        "routes": router.stats() if router is not None else None,
+        "speculation": speculation.stats() if speculation is not None else None,
+        "archive": archive.stats() if archive is not None else None,
+        "research_store": research_store.stats() if research_store is not None else None,
+        "budgets": budgets.stats() if budgets is not None else None,
+        "scheduler": scheduler.stats() if scheduler is not None else None
+    }
+
+def build_shard_workflow(options: Dict[str, Any]) -> Any:
+    """在工作進程中按命令行選項構建非同步工作流（快取與檢查點各進程分別打開同一個 SQLite 文件）"""
+    store = options.get("research_store")
+    budget = options.get("speculation_budget")
+    node_budgets = options.get("node_budgets")
+    return get_async_workflow(
+        cache=SQLiteCache(options["cache"]) if options.get("cache") else None,
+        checkpointer=CheckpointStore(options["checkpoints"]) if options.get("checkpoints") else None,
+        scheduler=build_scheduler(*options["limits"]) if options.get("limits") else None,
+        router=load_router(options.get("routes")),
+        speculation=Speculator(budget=budget) if budget is not None else None,
+        research_store=ResearchStore(*store) if store else None,
+        budgets=NodeBudgets(node_budgets) if node_budgets else None)
+
+def run_sharded_batch(input_path: str, output_path: str, pool: ShardPool, shard_size: int = 16,
+                      id_field: str = "id", task_field: str = "task",
+                      checkpointer: Optional[CheckpointStore] = None) -> Dict[str, Any]:
+    """把任務按 shard_size 分片，交給多進程的 ShardPool 執行
+
+    工作進程返回已序列化的輸出行，主進程只負責讀取任務、寫入結果與匯總統計。
+    每個進程的決策統計與 LLM 用量為累計值，以各進程最後一次返回的數據合併。
+    """
+    completed = load_completed_ids(output_path)
+    if completed:
+        print(f"發現 {len(completed)} 個已完成任務，將跳過")
+
+    latencies = []
+    failed = 0
+    skipped = 0
+    snapshots: Dict[int, Dict[str, Any]] = {}
+    start_time = time.perf_counter()
+
+    with open(output_path, "a", encoding="utf-8") as out:
+        pending = {}
+
+        def drain() -> None:
+            nonlocal failed
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                shard = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # 工作進程異常退出時整個分片失敗，重新執行批量任務即可續跑
+                    failed += len(shard)
+                    logger.error(f"分片 {shard[0][0]}..{shard[-1][0]} 執行錯誤: {str(e)}", exc_info=True)
+                    continue
+                for task_id, error in result["failed"]:
+                    failed += 1
+                    logger.error(f"任務 {task_id} 執行錯誤: {error}")
+                for task_id, line, latency in result["records"]:
+                    out.write(line + "\n")
+                    if checkpointer is not None:
+                        checkpointer.delete(task_id)
+                    latencies.append(latency)
+                out.flush()
+                snapshots[result["pid"]] = result
+
+        shard = []
+        for task_id, task in iter_tasks(input_path, id_field, task_field):
+            if task_id in completed:
+                skipped += 1
+                continue
+            completed.add(task_id)
+            shard.append((task_id, task))
+            if len(shard) < shard_size:
+                continue
+            # 每個進程最多排隊兩個分片，避免一次性讀入整個任務文件
+            while len(pending) >= pool.workers * 2:
+                drain()
+            pending[pool.submit(shard)] = shard
+            shard = []
+        if shard:
+            pending[pool.submit(shard)] = shard
+
+        while pending:
+            drain()
+
+    elapsed = time.perf_counter() - start_time
+    merged = merge_worker_stats(snapshots)
+    return {
+        "completed": len(latencies),
+        "failed": failed,
+        "skipped": skipped,
+        "elapsed": elapsed,
+        "throughput": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        "p50_latency": percentile(latencies, 50),
+        "p95_latency": percentile(latencies, 95),
+        # 各工作進程 tracer 的 llm span 計數之和
+        "llm_calls": int(merged["llm_usage"].get("count", 0)),
+        "decisions": merged["decisions"],
+        "llm_usage": merged["llm_usage"],
+        "processes": {"workers": pool.workers, "used": len(snapshots), **pool.metrics}
+    }
+
+def print_report(stats: Dict[str, Any]) -> None:
+    print("\n" + "="*50)
+    print("批量執行報告".center(50))
+    print("="*50)
+    print(f"完成任務數: {stats['completed']}")
+    print(f"失敗任務數: {stats['failed']}")
+    print(f"跳過任務數: {stats['skipped']}")
+    print(f"總執行時間: {stats['elapsed']:.2f}秒")
+    print(f"吞吐量: {stats['throughput']:.2f} 任務/秒")
+    print(f"p50 延遲: {stats['p50_latency']:.2f}秒")
+    print(f"p95 延遲: {stats['p95_latency']:.2f}秒")
+    print(f"LLM 調用總數: {stats['llm_calls']}")
+    if stats.get("cache"):
+        cache = stats["cache"]
+        print(f"快取命中: {cache['hits']} / 未命中: {cache['misses']} (命中率 {cache['hit_rate']:.1%})")
+        print(f"快取節省: {cache['saved_seconds']:.2f}秒, {cache['saved_tokens']} tokens")
+    if stats.get("decisions"):
+        decisions = stats["decisions"]
+        print(f"決策解析失敗率: {decisions['parse_failure_rate']:.1%} (本地修復率 {decisions['repair_rate']:.1%}, "
+              f"LLM 重試 {decisions['retries']} 次, 最終失敗 {decisions['failed']} 次)")
+        if decisions.get("escalations"):
+            print(f"升級到大模型: {decisions['escalations']} 次 ({decisions['escalation_rate']:.1%}, "
+                  f"信心不足 {decisions['low_confidence']} 次)")
+    if stats.get("llm_usage"):
+        usage = stats["llm_usage"]
+        print(f"Token 用量: 提示 {int(usage.get('prompt_tokens', 0))} / 完成 {int(usage.get('completion_tokens', 0))}, "
+              f"重試 {int(usage.get('retries', 0))} 次, 排隊 {usage.get('queue_wait', 0.0):.2f}秒")
+        if usage.get("prompt_tokens"):
+            # cached_tokens 由服務商回報；prefix_tokens 為按提示前綴估計的可快取 token 數
+            print(f"提示前綴快取: 命中 {int(usage.get('cached_tokens', 0))} tokens, "
+                  f"估計可快取 {int(usage.get('prefix_tokens', 0))} tokens "
+                  f"({usage.get('prefix_tokens', 0) / usage['prompt_tokens']:.1%})")
+    if stats.get("processes"):
+        processes = stats["processes"]
+        print(f"工作進程: {processes['workers']} 個 (共使用 {processes['used']} 個, 分片 {processes['shards']} 個, "
+              f"調整 {processes['resizes']} 次)")
+    if stats.get("speculation"):
+        speculation = stats["speculation"]
+        print(f"推測執行: {speculation['speculations']} 次, 命中率 {speculation['hit_rate']:.1%}, "
+              f"節省 {speculation['saved_seconds']:.2f}秒, 浪費調用 {speculation['wasted_calls']} 次")
+    if stats.get("research_store"):
+        store = stats["research_store"]
+        print(f"研究重用: {store['reused'] + store['condensed']} / {store['lookups']} 次 (重用率 {store['reuse_rate']:.1%}, "
+              f"其中精簡 {store['condensed']} 次), 估計節省 {store['saved_seconds']:.2f}秒, 存儲 {store['entries']} 條")
+    if stats.get("scheduler"):
+        scheduler = stats["scheduler"]
+        print(f"調度器: 請求 {scheduler['requests']} 次, 重試 {scheduler['retries']} 次, 限流 429 {scheduler['rate_limited']} 次, "
+              f"限速等待 {scheduler['throttle_seconds']:.2f}秒, 並發上限 {scheduler['concurrency_limit']:.1f}")
+    if stats.get("budgets"):
+        budgets = stats["budgets"]
+        print(f"節點預算: 降級 {budgets['downgraded']} 次, 跳過 {budgets['skipped']} 次, 超出預算 {budgets['timeouts']} 次")
+    if stats.get("archive"):
+        archive = stats["archive"]
+        print(f"運行歸檔: {archive['runs']} 次運行, {archive['steps']} 個步驟, "
+              f"{archive['compressed_bytes'] / 1024:.1f} KB（壓縮比 {archive['ratio']:.1f}x）")
+    if stats.get("routes"):
+        print("\n【模型路由】")
+        for name, route in sorted(stats["routes"].items()):
+            print(f"{name}: {route['calls']} 次, 共 {route['seconds']:.2f}秒 (p50={route['p50']:.2f}秒 "
+                  f"p95={route['p95']:.2f}秒), 成本 ${route['cost']:.4f}")
+    if stats.get("latency_by_span"):
+        print("\n【延遲分佈】")
+        for name, summary in sorted(stats["latency_by_span"].items()):
+            print(f"{name}: n={summary['count']} p50={summary['p50']:.2f}秒 "
+                  f"p95={summary['p95']:.2f}秒 p99={summary['p99']:.2f}秒")
+
+def main():
+    parser = argparse.ArgumentParser(description="批量執行多Agent分析任務")
+    parser.add_argument("input", help="任務文件（.jsonl 或 .csv）")
+    parser.add_argument("-o", "--output", required=True, help="結果輸出文件（.jsonl），已存在時會斷點續跑")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="並發工作線程數")
+    parser.add_argument("-p", "--processes", type=int, default=0,
+                        help="多進程分片執行的工作進程數，每個進程內以 --workers 個並發任務執行非同步工作流；0 表示單進程線程池")
+    parser.add_argument("--shard-size", type=int, default=16, help="多進程模式下每個分片的任務數")
+    parser.add_argument("--id-field", default="id", help="任務ID字段名")
+    parser.add_argument("--task-field", default="task", help="任務描述字段名")
+    parser.add_argument("--cache", help="SQLite 回應快取文件路徑，不指定則不使用快取")
+    parser.add_argument("--checkpoints", help="SQLite 檢查點文件路徑，中斷的任務可從最後完成的步驟繼續")
+    parser.add_argument("--routes", help="模型路由配置（JSON 文件，或 \"tiered\" 使用內置分層配置），默認讀取 MODEL_ROUTES")
+    parser.add_argument("--speculate", action="store_true", help="監督者決策時推測執行預測的下一個 agent")
+    parser.add_argument("--speculation-budget", type=float, default=0.25, help="浪費的推測調用佔 worker 調用的上限")
+    parser.add_argument("--share-research", action="store_true", help="在相似任務之間共享研究結果（TF-IDF 最近鄰）")
+    parser.add_argument("--reuse-threshold", type=float, default=0.8, help="直接重用研究結果所需的最低相似度")
+    parser.add_argument("--condense-threshold", type=float, help="精簡後重用所需的最低相似度，不指定則不精簡重用")
+    parser.add_argument("--store-size", type=int, default=1000, help="共享研究存儲保留的最大結果數")
+    parser.add_argument("--store-ttl", type=float, help="共享研究結果的有效期（秒）")
+    parser.add_argument("--node-budget", action="append", default=[], metavar="節點=秒數",
+                        help="節點的軟時間預算，可重複指定，例如 --node-budget analyst=60")
+    parser.add_argument("--rpm", type=float, help="每分鐘 LLM 請求數上限，指定任一限額時啟用調度器（限速、退避重試與自適應並發）")
+    parser.add_argument("--tpm", type=float, help="每分鐘 token 數上限")
+    parser.add_argument("--max-concurrency", type=int, help="同時進行的 LLM 請求數上限")
+    parser.add_argument("--archive", help="運行歸檔文件路徑（zstd 壓縮，附帶 .idx 索引），保存每個任務的步驟增量與最終狀態")
+    parser.add_argument("--archive-codec", choices=["msgpack", "json"], default="msgpack", help="歸檔記錄的編碼格式（新建歸檔時生效）")
+    parser.add_argument("--trace", help="匯出 Chrome trace（.json），可在 chrome://tracing 或 Perfetto 中查看")
+    parser.add_argument("--otel", help="匯出 OpenTelemetry OTLP/JSON 格式的 span 文件")
+    parser.add_argument("--metrics", help="匯出每節點延遲分佈（p50/p95/p99）的 JSON 文件")
+    args = parser.parse_args()
+
+    # 檢查 API key
+    if not os.getenv("OPENAI_API_KEY"):
+        raise ValueError("請在 .env 文件中設置 OPENAI_API_KEY 環境變量")
+
+    checkpointer = CheckpointStore(args.checkpoints) if args.checkpoints else None
+    budgets = NodeBudgets.parse(args.node_budget) if args.node_budget else None
+    if args.processes > 0:
+        if args.archive or args.trace or args.otel or args.metrics:
+            # 歸檔文件只能由一個進程寫入，span 也只記錄在各工作進程內
+            parser.error("--archive、--trace、--otel 與 --metrics 只能在單進程模式下使用")
+        limits = None
+        if args.rpm or args.tpm or args.max_concurrency:
+            # 每個工作進程各有一個調度器，限額按進程數平分
+            limits = (args.rpm / args.processes if args.rpm else None,
+                      args.tpm / args.processes if args.tpm else None,
+                      max(1, args.max_concurrency // args.processes) if args.max_concurrency else None)
+        options = {
+            "cache": args.cache,
+            "checkpoints": args.checkpoints,
+            "routes": args.routes,
+            "speculation_budget": args.speculation_budget if args.speculate else None,
+            # 研究存儲在每個工作進程內分別維護
+            "research_store": (args.reuse_threshold, args.condense_threshold, args.store_size,
+                               args.store_ttl) if args.share_research else None,
+            "node_budgets": budgets.budgets if budgets is not None else None,
+            "limits": limits
+        }
+        with ShardPool(args.processes, args.workers, functools.partial(build_shard_workflow, options)) as pool:
+            # 運行中以 SIGUSR1 / SIGUSR2 增加或減少一個工作進程，在下一次提交分片時生效
+            if hasattr(signal, "SIGUSR1"):
+                signal.signal(signal.SIGUSR1, lambda *_: pool.request_resize(pool.workers + 1))
+                signal.signal(signal.SIGUSR2, lambda *_: pool.request_resize(pool.workers - 1))
+            stats = run_sharded_batch(args.input, args.output, pool, args.shard_size,
+                                      args.id_field, args.task_field, checkpointer)
+        print_report(stats)
+        return
+
+    cache = SQLiteCache(args.cache) if args.cache else None
+    stats = run_batch(args.input, args.output, args.workers, args.id_field, args.task_field,
+                      cache=cache, checkpointer=checkpointer, router=load_router(args.routes),
+                      speculation=Speculator(budget=args.speculation_budget) if args.speculate else None,
+                      archive=RunArchive(args.archive, args.archive_codec) if args.archive else None,
+                      research_store=ResearchStore(args.reuse_threshold, args.condense_threshold, args.store_size,
+                                                   args.store_ttl) if args.share_research else None,
+                      budgets=budgets, scheduler=build_scheduler(args.rpm, args.tpm, args.max_concurrency))
+    print_report(stats)
+
+    tracer = get_tracer()
+    if args.trace:
+        tracer.export_chrome_trace(args.trace)
+    if args.otel:
+        tracer.export_otel_json(args.otel)
+    if args.metrics:
+        tracer.dump_percentiles(args.metrics)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""運行歸檔基準測試：比較 JSONL 與壓縮歸檔（msgpack / json 編碼）的大小、寫入、掃描與單次查詢耗時
+
+先以回放模型執行錄製的任務得到真實的步驟增量與最終狀態，再以不同的運行ID重複寫入 --runs 次。
+JSONL 每行一個 {"run_id", "meta", "steps", "final"}，查詢時只能逐行掃描；歸檔通過索引定位單個幀。
+用法：python -m benchmarks.archive_size [--runs 2000] [--lookups 200] [--level 3]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+from agents.records import json_default
+from archive import RunArchive, StepRecorder
+from benchmarks.replay_llm import ReplayChatModel
+from workflow import create_initial_state, create_workflow, run_with_events
+
+TASKS = ["分析一家咖啡店的每日營運成本", "評估公司是否應該將業務遷移到雲端"]
+
+
+def sample_runs() -> List[Dict[str, Any]]:
+    workflow = create_workflow(llm=ReplayChatModel(latency=0))
+    runs = []
+    for task in TASKS:
+        recorder = StepRecorder()
+        final_state = run_with_events(workflow, create_initial_state(task), recorder)
+        runs.append({"meta": {"task": task}, "steps": recorder.steps, "final": final_state})
+    return runs
+
+
+def timed(fn: Callable[[], Any]) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def jsonl_lookup(path: str, run_id: str) -> Optional[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if record["run_id"] == run_id:
+                return record
+    return None
+
+
+def bench_jsonl(path: str, runs: List[Dict[str, Any]], count: int, lookup_ids: List[str]) -> Dict[str, float]:
+    def write() -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            for i in range(count):
+                record = {"run_id": f"run-{i}", **runs[i % len(runs)]}
+                f.write(json.dumps(record, ensure_ascii=False, default=json_default) + "\n")
+
+    def scan() -> None:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                json.loads(line)["final"]
+
+    write_time = timed(write)
+    return {
+        "bytes": os.path.getsize(path),
+        "write": write_time,
+        "scan": timed(scan),
+        "lookup": timed(lambda: [jsonl_lookup(path, run_id) for run_id in lookup_ids]) / len(lookup_ids)
+    }
+
+
+def bench_archive(path: str, codec: str, level: int, runs: List[Dict[str, Any]], count: int,
+                  lookup_ids: List[str]) -> Dict[str, float]:
+    archive = RunArchive(path, codec, level)
+
+    def write() -> None:
+        for i in range(count):
+            run = runs[i % len(runs)]
+            archive.write_run(f"run-{i}", run["steps"], run["final"], run["meta"])
+
+    def scan() -> None:
+        for run in RunArchive(path).iter_runs(include_steps=False):
+            run["final"]
+
+    write_time = timed(write)
+    # 新實例從索引文件讀取，查詢時間包含首次加載索引
+    reader = RunArchive(path)
+    stats = reader.stats()
+    return {
+        "bytes": stats["compressed_bytes"] + stats["index_bytes"],
+        "write": write_time,
+        "scan": timed(scan),
+        "lookup": timed(lambda: [reader.get_run(run_id) for run_id in lookup_ids]) / len(lookup_ids)
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="運行歸檔基準測試")
+    parser.add_argument("--runs", type=int, default=2000, help="寫入的運行數")
+    parser.add_argument("--lookups", type=int, default=200, help="隨機查詢的次數")
+    parser.add_argument("--level", type=int, default=3, help="zstd 壓縮等級")
+    args = parser.parse_args()
+
+    runs = sample_runs()
+    rng = random.Random(0)
+    lookup_ids = [f"run-{rng.randrange(args.runs)}" for _ in range(args.lookups)]
+    directory = tempfile.mkdtemp(prefix="archive_bench_")
+    try:
+        results = {
+            "jsonl": bench_jsonl(os.path.join(directory, "runs.jsonl"), runs, args.runs, lookup_ids),
+            "archive/msgpack": bench_archive(os.path.join(directory, "runs_msgpack.zst"), "msgpack", args.level,
+                                             runs, args.runs, lookup_ids),
+            "archive/json": bench_archive(os.path.join(directory, "runs_json.zst"), "json", args.level,
+                                          runs, args.runs, lookup_ids)
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    baseline = results["jsonl"]
+    print(f"運行數: {args.runs}，每次運行 {sum(len(run['steps']) for run in runs) / len(runs):.0f} 個步驟\n")
+    print(f"{'格式':<18}{'大小(MB)':>10}{'寫入(秒)':>10}{'全量掃描(秒)':>14}{'單次查詢(毫秒)':>16}")
+    for name, result in results.items():
+        print(f"{name:<18}{result['bytes'] / 1e6:>10.2f}{result['write']:>10.2f}{result['scan']:>14.2f}"
+              f"{result['lookup'] * 1000:>16.2f}")
+    for name in ("archive/msgpack", "archive/json"):
+        result = results[name]
+        print(f"\n{name}: 大小為 JSONL 的 {result['bytes'] / baseline['bytes']:.1%}，"
+              f"掃描快 {baseline['scan'] / result['scan']:.1f} 倍，查詢快 {baseline['lookup'] / result['lookup']:.0f} 倍")
+
+
+if __name__ == "__main__":
+    main()
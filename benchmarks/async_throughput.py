@@ -0,0 +1,51 @@
+"""非同步工作流吞吐量基準測試
+
+用法：python -m benchmarks.async_throughput [--latency 0.05] [--tasks 200]
+"""
+import argparse
+import asyncio
+import time
+from benchmarks.fake_llm import FakeChatModel
+from workflow import create_workflow, create_async_workflow, create_initial_state
+
+
+async def run_async(workflow, tasks: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_one(i: int):
+        async with semaphore:
+            return await workflow(create_initial_state(f"任務 {i}"))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_one(i) for i in range(tasks)))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="非同步工作流吞吐量基準測試")
+    parser.add_argument("--latency", type=float, default=0.05, help="假 LLM 每次調用延遲（秒）")
+    parser.add_argument("--tasks", type=int, default=200, help="每個並發級別執行的任務數")
+    parser.add_argument("--levels", type=str, default="1,10,50,100,200", help="並發級別，以逗號分隔")
+    args = parser.parse_args()
+
+    llm = FakeChatModel(latency=args.latency)
+
+    # 同步基線：逐一執行
+    sync_workflow = create_workflow(llm=llm)
+    sync_tasks = min(args.tasks, 10)
+    start = time.perf_counter()
+    for i in range(sync_tasks):
+        sync_workflow(create_initial_state(f"任務 {i}"))
+    elapsed = time.perf_counter() - start
+    print(f"{'模式':<10}{'並發':>8}{'任務數':>8}{'耗時(秒)':>12}{'任務/秒':>12}")
+    print(f"{'sync':<10}{1:>8}{sync_tasks:>8}{elapsed:>12.2f}{sync_tasks / elapsed:>12.2f}")
+
+    async_workflow = create_async_workflow(llm=llm)
+    for level in (int(x) for x in args.levels.split(",")):
+        tasks = max(args.tasks, level) if level > 1 else min(args.tasks, 10)
+        elapsed = asyncio.run(run_async(async_workflow, tasks, level))
+        print(f"{'async':<10}{level:>8}{tasks:>8}{elapsed:>12.2f}{tasks / elapsed:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""檢查點寫入開銷基準測試
+
+用法：python -m benchmarks.checkpoint_overhead [--runs 50] [--result-size 4000]
+"""
+import argparse
+import os
+import tempfile
+import time
+from agents.records import ResultRecord
+from benchmarks.fake_llm import FakeChatModel
+from checkpoint import CheckpointStore
+from workflow import create_workflow, create_initial_state
+
+
+def run_workflows(workflow, runs: int, use_run_id: bool) -> tuple:
+    steps = 0
+    start = time.perf_counter()
+    for i in range(runs):
+        state = workflow(create_initial_state(f"任務 {i}"), f"run-{i}" if use_run_id else None)
+        steps += len(state["agent_sequence"])
+    return time.perf_counter() - start, steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description="檢查點寫入開銷基準測試")
+    parser.add_argument("--runs", type=int, default=50, help="執行的工作流次數")
+    parser.add_argument("--result-size", type=int, default=4000, help="每條研究/分析結果的字符數")
+    args = parser.parse_args()
+
+    llm = FakeChatModel(latency=0, response_size=args.result_size)
+    with tempfile.TemporaryDirectory() as tmp:
+        store = CheckpointStore(os.path.join(tmp, "checkpoints.sqlite"))
+
+        baseline, steps = run_workflows(create_workflow(llm=llm), args.runs, False)
+        checkpointed, _ = run_workflows(create_workflow(llm=llm, checkpointer=store), args.runs, True)
+        overhead = (checkpointed - baseline) / steps * 1000
+        print(f"步驟數: {steps}")
+        print(f"無檢查點: {baseline:.3f}秒 ({baseline / steps * 1000:.3f} 毫秒/步)")
+        print(f"有檢查點: {checkpointed:.3f}秒 ({checkpointed / steps * 1000:.3f} 毫秒/步)")
+        print(f"檢查點開銷: {overhead:.3f} 毫秒/步")
+
+        # 單獨測量不同狀態大小下 save() 的耗時
+        state = create_initial_state("任務")
+        print(f"\n{'歷史條數':>8}{'save 毫秒':>12}")
+        for count in (1, 5, 10, 20):
+            state["research_results"] = [ResultRecord("researcher", i, "資" * args.result_size) for i in range(count)]
+            state["analysis_results"] = [ResultRecord("analyst", i, "析" * args.result_size) for i in range(count)]
+            state["agent_sequence"] = ["supervisor"] * count
+            state["iteration"] = count
+            start = time.perf_counter()
+            for _ in range(20):
+                store.save("micro", state)
+            print(f"{count:>8}{(time.perf_counter() - start) / 20 * 1000:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""收斂檢測回放：在已記錄的運行上重放每一步，統計提前結束可節省的 LLM 調用數
+
+輸入為 batch.py 的輸出文件（每行包含最終 state）；不指定時生成一組分析逐漸收斂的合成運行。
+用法：python -m benchmarks.convergence_replay [--input results.jsonl] [--runs 200] [--thresholds 0.8 0.9 0.95]
+"""
+import argparse
+import json
+import random
+from typing import Any, Dict, List, Tuple
+from agents.records import ResultRecord, StepRecord
+from convergence import ConvergenceDetector
+
+SUBJECTS = ["咖啡店", "團隊", "系統", "客戶", "供應鏈", "市場", "成本結構", "用戶體驗"]
+VERBS = ["需要優化", "正在擴張", "面臨壓力", "可以提升", "應該重新評估", "逐步穩定"]
+OBJECTS = ["人工成本", "原料採購", "營銷預算", "服務流程", "數據安全", "庫存周轉", "定價策略"]
+
+
+def _sentence(rng: random.Random) -> str:
+    return rng.choice(SUBJECTS) + rng.choice(VERBS) + rng.choice(OBJECTS) + "，" + rng.choice(OBJECTS) + rng.choice(VERBS) + "。"
+
+
+def synthetic_run(rng: random.Random, max_iterations: int = 10) -> Dict[str, Any]:
+    """模擬一次跑滿 max_iterations 的運行：每輪分析只改寫部分句子，改寫比例因運行而異"""
+    sentences = [_sentence(rng) for _ in range(12)]
+    drift = rng.choice([0.6, 0.3, 0.15, 0.05])
+    state = {"task_assignments": [], "research_results": [], "analysis_results": [], "execution_times": []}
+    pattern = ["supervisor", "researcher", "supervisor", "analyst"]
+    for iteration in range(1, max_iterations + 1):
+        agent = pattern[(iteration - 1) % len(pattern)]
+        if agent == "supervisor":
+            target = pattern[iteration % len(pattern)]
+            task = "收集相關信息" if target == "researcher" else "分析研究結果並完善報告"
+            state["task_assignments"].append({"iteration": len(state["task_assignments"]) + 1, "agent": target, "task": task})
+        elif agent == "researcher":
+            state["research_results"].append(ResultRecord("researcher", iteration, "".join(_sentence(rng) for _ in range(8))))
+        else:
+            sentences = [_sentence(rng) if rng.random() < drift else s for s in sentences]
+            state["analysis_results"].append(ResultRecord("analyst", iteration, "".join(sentences)))
+        state["execution_times"].append(StepRecord(iteration, agent, "00:00:00", 0.0))
+    return state
+
+
+def load_runs(path: str) -> List[Dict[str, Any]]:
+    runs = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            state = json.loads(line)["state"]
+            for key in ("research_results", "analysis_results"):
+                state[key] = [ResultRecord(**r) if isinstance(r, dict) else ResultRecord("", 0, str(r))
+                              for r in state[key]]
+            state["execution_times"] = [StepRecord(**{k: v for k, v in s.items() if k != "branches"},
+                                                   branches=s.get("branches")) for s in state["execution_times"]]
+            runs.append(state)
+    return runs
+
+
+def replay(state: Dict[str, Any], detector: ConvergenceDetector) -> Tuple[int, int]:
+    """逐步重建狀態並檢查收斂，返回 (記錄中的 LLM 調用數, 提前結束時的調用數)"""
+    def calls(step: StepRecord) -> int:
+        return len(step.branches) if step.branches else 1
+
+    total = sum(calls(step) for step in state["execution_times"])
+    partial = {"task_assignments": [], "research_results": [], "analysis_results": []}
+    assignments = iter(state["task_assignments"])
+    used = 0
+    for step in state["execution_times"]:
+        used += calls(step)
+        if step.agent == "supervisor":
+            assignment = next(assignments, None)
+            if assignment is not None:
+                partial["task_assignments"].append(assignment)
+        else:
+            key = "research_results" if step.agent == "researcher" else "analysis_results"
+            partial[key].extend(r for r in state[key] if r.iteration == step.iteration)
+        if detector.check(partial) is not None:
+            break
+    return total, used
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="收斂檢測回放")
+    parser.add_argument("--input", help="batch.py 輸出的結果文件（.jsonl）")
+    parser.add_argument("--runs", type=int, default=200, help="未指定輸入時生成的合成運行數")
+    parser.add_argument("--seed", type=int, default=0, help="合成運行的隨機種子")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.8, 0.85, 0.9, 0.95])
+    args = parser.parse_args()
+
+    if args.input:
+        runs = load_runs(args.input)
+    else:
+        rng = random.Random(args.seed)
+        runs = [synthetic_run(rng) for _ in range(args.runs)]
+
+    print(f"運行數: {len(runs)}")
+    print(f"{'方法':<8}{'閾值':>6}{'提前結束':>10}{'原調用數':>10}{'收斂後調用數':>14}{'節省':>8}")
+    for method in ("minhash", "tfidf"):
+        for threshold in args.thresholds:
+            detector = ConvergenceDetector(threshold=threshold, method=method)
+            total = used = stopped = 0
+            for state in runs:
+                run_total, run_used = replay(state, detector)
+                total += run_total
+                used += run_used
+                stopped += run_used < run_total
+            saved = (total - used) / total if total else 0.0
+            print(f"{method:<8}{threshold:>6.2f}{stopped:>10}{total:>10}{used:>14}{saved:>8.1%}")
+
+
+if __name__ == "__main__":
+    main()
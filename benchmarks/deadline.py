@@ -0,0 +1,98 @@
+"""截止時間與節點預算基準測試：卡住的 LLM 調用不再讓運行超出 max_execution_time
+
+第一部分讓分析師的調用卡住 --hang 秒，分別以同步、流式與非同步方式執行，
+比較運行的實際耗時與截止時間，並顯示以研究結果作為部分決策。
+第二部分的分析師使用慢模型，比較不設預算（由硬截止時間結束）、超出預算時跳過、
+以及剩餘時間不足時降級到快模型（路由中的 "analyst.fallback"）三種配置。
+用法：python -m benchmarks.deadline [--deadline 1.0] [--hang 5] [--slow 3]
+"""
+import argparse
+import asyncio
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+from agents.routing import ModelRouter
+from benchmarks.fake_llm import FakeChatModel
+from budgets import NodeBudgets
+from workflow import astream_workflow, create_async_workflow, create_initial_state, create_workflow, stream_workflow
+
+TASK = "分析一家咖啡店的每日營運成本"
+
+
+def initial_state(deadline: float) -> Dict[str, Any]:
+    state = create_initial_state(TASK)
+    state["max_execution_time"] = deadline
+    return state
+
+
+def run_sync(llm: Any, deadline: float) -> Dict[str, Any]:
+    return create_workflow(llm=llm)(initial_state(deadline))
+
+
+def run_stream(llm: Any, deadline: float) -> Dict[str, Any]:
+    state = initial_state(deadline)
+    for event in stream_workflow(create_workflow(llm=llm), state):
+        pass
+    return state
+
+
+def run_async(llm: Any, deadline: float) -> Dict[str, Any]:
+    async def run() -> Dict[str, Any]:
+        state = initial_state(deadline)
+        async for event in astream_workflow(create_async_workflow(llm=llm), state):
+            pass
+        return state
+    return asyncio.run(run())
+
+
+def timed(fn: Callable[[], Dict[str, Any]]) -> Tuple[float, Dict[str, Any]]:
+    start = time.perf_counter()
+    state = fn()
+    return time.perf_counter() - start, state
+
+
+def budget_config(slow: float, deadline: float, budgets: Optional[NodeBudgets],
+                  fallback: bool) -> Tuple[float, Dict[str, Any]]:
+    routes = {"supervisor": "fast", "researcher": "fast", "analyst": "slow"}
+    if fallback:
+        routes["analyst.fallback"] = "fast"
+    router = ModelRouter(routes=routes, llms={"slow": FakeChatModel(latency=slow),
+                                              "fast": FakeChatModel(latency=0.05)})
+    workflow = create_workflow(router=router, budgets=budgets)
+    return timed(lambda: workflow(initial_state(deadline)))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="截止時間與節點預算基準測試")
+    parser.add_argument("--deadline", type=float, default=1.0, help="第一部分的 max_execution_time（秒）")
+    parser.add_argument("--hang", type=float, default=5.0, help="卡住的分析師調用的延遲（秒）")
+    parser.add_argument("--slow", type=float, default=3.0, help="第二部分慢模型的延遲（秒）")
+    args = parser.parse_args()
+
+    hung = FakeChatModel(latency=0.05, chunk_latency=0.01, role_latency={"analyst": args.hang})
+    results = {}
+    for name, run in (("同步", run_sync), ("流式", run_stream), ("非同步", run_async)):
+        results[name] = timed(lambda: run(hung, args.deadline))
+
+    budget_deadline = args.slow / 2
+    configs = {
+        "不設預算": budget_config(args.slow, budget_deadline, None, False),
+        "超出預算時跳過": budget_config(args.slow, budget_deadline,
+                                   NodeBudgets({"analyst": budget_deadline * 0.6}), False),
+        "不足預算時降級": budget_config(args.slow, budget_deadline,
+                                   NodeBudgets({"analyst": budget_deadline * 2}), True)
+    }
+
+    print(f"\n分析師調用卡住 {args.hang:.0f} 秒，截止時間 {args.deadline:.1f} 秒：")
+    for name, (elapsed, state) in results.items():
+        partial = state["final_decision"].partition("當前決策：")[2]
+        print(f"  {name:<4} 耗時 {elapsed:5.2f} 秒（超出截止時間 {max(elapsed - args.deadline, 0) * 1000:5.0f} ms），"
+              f"部分結果 {len(partial)} 字：{partial[:24]!r}")
+    print(f"\n分析師使用 {args.slow:.0f} 秒延遲的慢模型，截止時間 {budget_deadline:.1f} 秒：")
+    for name, (elapsed, state) in configs.items():
+        analyses = [str(r) for r in state["analysis_results"] if r.ok]
+        print(f"  {name:<8} 耗時 {elapsed:5.2f} 秒，有效分析 {len(analyses)} 條，"
+              f"迭代 {state['iteration']} 次，決策：{state['final_decision'][:30]!r}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""基準測試用的本地假 LLM，不需要 OpenAI API 密鑰"""
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+import asyncio
+import itertools
+import json
+import time
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, SystemMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+
+class FakeChatModel(BaseChatModel):
+    """依據系統提示判斷角色並返回固定回應的假模型
+
+    監督者依序分派 researcher -> analyst -> end，
+    每次調用都會等待 latency 秒以模擬網絡延遲。
+    """
+
+    latency: float = 0.05
+    response_size: int = 200
+    fan_out: int = 0  # 大於 1 時監督者會將研究拆分為多個子任務
+    chunk_size: int = 16  # 流式輸出時每段的字符數
+    chunk_latency: float = 0.0  # 流式輸出時每段之間的延遲（秒）
+    endless: bool = False  # 為 True 時監督者輪流分派研究與分析且永不結束，由 max_iterations 截止
+    role_latency: Dict[str, float] = {}  # 按角色覆蓋延遲（秒），例如 {"analyst": 30} 模擬卡住的調用
+    _counter: Any = PrivateAttr(default_factory=itertools.count)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _latency(self, messages: List[BaseMessage]) -> float:
+        if not self.role_latency:
+            return self.latency
+        system = next((m.content for m in messages if isinstance(m, SystemMessage)), "")
+        role = "supervisor" if "監督者" in system else "researcher" if "研究員" in system else "analyst"
+        return self.role_latency.get(role, self.latency)
+
+    def _respond(self, messages: List[BaseMessage]) -> str:
+        system = next((m.content for m in messages if isinstance(m, SystemMessage)), "")
+        human = messages[-1].content
+        if "監督者" in system:
+            data = json.loads(human)
+            # 歷史中的 dict 是監督者之前的任務分配，每次分配的 worker 都已執行完畢
+            assignments = [a for a in data.get("history") or [] if isinstance(a, dict)]
+            agents = {a.get("agent") for a in assignments}
+            if self.endless:
+                agent = "analyst" if assignments and assignments[-1].get("agent") == "researcher" else "researcher"
+                decision = {"next_agent": agent, "task": "繼續收集與分析", "is_complete": False, "final_decision": ""}
+            elif "researcher" not in agents:
+                decision = {"next_agent": "researcher", "task": "收集相關信息", "is_complete": False, "final_decision": ""}
+                if self.fan_out > 1:
+                    decision["subtasks"] = [f"收集第 {i} 方面的信息" for i in range(1, self.fan_out + 1)]
+            elif "analyst" not in agents:
+                decision = {"next_agent": "analyst", "task": "分析研究結果", "is_complete": False, "final_decision": ""}
+            else:
+                decision = {"next_agent": "end", "task": "完成最終分析報告", "is_complete": True, "final_decision": "完成"}
+            return json.dumps(decision, ensure_ascii=False)
+        # 無限模式下為每次回應加上序號，避免觸發「連續三次結果相同」的停止條件
+        prefix = f"{next(self._counter)} " if self.endless else ""
+        if "研究員" in system:
+            return prefix + "研究結果：" + "資" * self.response_size
+        return prefix + "分析結果：" + "析" * self.response_size
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        time.sleep(self._latency(messages))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._respond(messages)))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self._latency(messages))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._respond(messages)))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self._latency(messages))
+        text = self._respond(messages)
+        for i in range(0, len(text), self.chunk_size):
+            if i and self.chunk_latency:
+                time.sleep(self.chunk_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=text[i:i + self.chunk_size]))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self._latency(messages))
+        text = self._respond(messages)
+        for i in range(0, len(text), self.chunk_size):
+            if i and self.chunk_latency:
+                await asyncio.sleep(self.chunk_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=text[i:i + self.chunk_size]))
@@ -0,0 +1,104 @@
+"""本地假 OpenAI 服務，用於在不產生費用的情況下測試限速與重試
+
+實現 /v1/chat/completions（非流式），依據 FakeChatModel 的規則產生回應，
+並可按每分鐘請求上限返回 429、按比例注入 5xx 錯誤。
+"""
+from typing import Any, Dict, Optional
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import collections
+import json
+import random
+import threading
+import time
+from langchain_core.messages import HumanMessage, SystemMessage
+from benchmarks.fake_llm import FakeChatModel
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # 默認的 backlog 只有 5，並發請求較多時會被拒絕連接
+    request_queue_size = 256
+
+
+class FakeOpenAIServer:
+    def __init__(self, requests_per_minute: Optional[int] = 60, error_rate: float = 0.0,
+                 latency: float = 0.05, port: int = 0):
+        self.requests_per_minute = requests_per_minute
+        self.error_rate = error_rate
+        self.latency = latency
+        self.responder = FakeChatModel(latency=0)
+        self.counts = collections.Counter()
+        self._window = collections.deque()
+        self._lock = threading.Lock()
+        self._server = _Server(("127.0.0.1", port), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+    def __enter__(self) -> "FakeOpenAIServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _admit(self) -> int:
+        """返回本次請求的狀態碼：超過每分鐘上限為 429，按比例注入 500"""
+        with self._lock:
+            now = time.monotonic()
+            while self._window and now - self._window[0] > 60:
+                self._window.popleft()
+            if self.requests_per_minute is not None and len(self._window) >= self.requests_per_minute:
+                self.counts["429"] += 1
+                return 429
+            if random.random() < self.error_rate:
+                self.counts["500"] += 1
+                return 500
+            self._window.append(now)
+            self.counts["200"] += 1
+            return 200
+
+    def _completion(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        messages = [SystemMessage(content=m["content"]) if m["role"] == "system" else HumanMessage(content=m["content"])
+                    for m in body["messages"] if m.get("content")]
+        text = self.responder._respond(messages)
+        message: Dict[str, Any] = {"role": "assistant", "content": text}
+        if body.get("tools"):
+            # 結構化輸出透過工具調用返回
+            name = body["tools"][0]["function"]["name"]
+            message = {"role": "assistant", "content": None, "tool_calls": [
+                {"id": "call_0", "type": "function", "function": {"name": name, "arguments": text}}]}
+        return {
+            "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 100, "completion_tokens": len(text), "total_tokens": 100 + len(text)}
+        }
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args: Any) -> None:
+                pass
+
+            def do_POST(self) -> None:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                status = server._admit()
+                time.sleep(server.latency)
+                if status == 200:
+                    payload = server._completion(body)
+                else:
+                    payload = {"error": {"message": "rate limit exceeded" if status == 429 else "server error",
+                                         "type": "rate_limit_error" if status == 429 else "server_error"}}
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
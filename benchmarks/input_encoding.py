@@ -0,0 +1,89 @@
+"""agent 輸入編碼微基準測試：比較每次調用以 json.dumps 重新編碼整個歷史，與拼接快取的 orjson 編碼片段
+
+以假模型執行一次 10 次迭代的工作流，把每條結果替換為數千字符、包含換行與引號的文本，
+再按 agent_sequence 重建每次調用時的狀態，分別以兩種方式準備輸入並檢查結果逐字節相同。
+用法：python -m benchmarks.input_encoding [--iterations 10] [--result-chars 4000] [--repeat 200]
+"""
+import argparse
+import json
+import time
+from typing import Any, Callable, Dict, List, Tuple
+from agents.context import timeline
+from agents.records import ResultRecord
+from benchmarks.fake_llm import FakeChatModel
+from benchmarks.prompt_prefix import call_states
+from workflow import create_initial_state, create_workflow
+
+PARAGRAPH = ("## 第 {n} 部分：營運成本\n"
+             "根據 2024 年的行業報告，\"租金\" 約佔月營收的 15%-20%，人力成本約 25%-30%。\n"
+             "- 咖啡豆：每公斤 NT$600～900，每杯約 18g\n"
+             "- 牛奶與耗材：每杯約 NT$12\t（含杯蓋、吸管）\n"
+             "Reference: https://example.com/report?id={n}&lang=zh-TW\n")
+
+
+def sample_text(index: int, chars: int) -> str:
+    text, n = "", 0
+    while len(text) < chars:
+        n += 1
+        text += PARAGRAPH.format(n=index * 100 + n)
+    return text[:chars]
+
+
+def legacy_input(name: str, agent: Any, state: Dict[str, Any]) -> str:
+    # 改動前的做法：每次調用都以 json.dumps 重新編碼整個上下文
+    context = agent.context
+    if name == "researcher":
+        data = {"original_task": state["original_task"],
+                "previous_research": context.build(state["research_results"]),
+                "task": state["current_task"]}
+        return json.dumps(data, ensure_ascii=False)
+    history = timeline(state["task_assignments"], state["research_results"], state["analysis_results"])
+    scale = 3 if name == "supervisor" else 2
+    data = {"original_task": state["original_task"],
+            "history": context.build(history, context.max_tokens * scale, context.keep_recent * 4),
+            "current_task" if name == "supervisor" else "task": state["current_task"]}
+    return json.dumps(data, ensure_ascii=False)
+
+
+def measure(calls: List[Tuple[str, Dict[str, Any]]], repeat: int, prepare: Callable[[str, Dict[str, Any]], str]) -> float:
+    """返回每次調用的平均微秒數"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for name, state in calls:
+            prepare(name, state)
+    return (time.perf_counter() - start) / (repeat * len(calls)) * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="agent 輸入編碼微基準測試")
+    parser.add_argument("--iterations", type=int, default=10, help="工作流的迭代次數")
+    parser.add_argument("--result-chars", type=int, default=4000, help="每條結果的字符數")
+    parser.add_argument("--repeat", type=int, default=200, help="重複次數")
+    args = parser.parse_args()
+
+    workflow = create_workflow(llm=FakeChatModel(latency=0, endless=True, response_size=10))
+    state = create_initial_state("分析一家咖啡店的每日營運成本")
+    state["max_iterations"] = args.iterations
+    state = workflow(state)
+    # 以新的記錄替換（上下文快取以記錄對象為鍵，原地修改內容會讀到舊的快取）
+    for field in ("research_results", "analysis_results"):
+        state[field] = [ResultRecord(r.agent, r.iteration, sample_text(r.iteration, args.result_chars), r.task)
+                        for r in state[field]]
+    calls = call_states(state)
+    agents = workflow.agents
+
+    total_bytes = 0
+    for name, call_state in calls:
+        encoded = agents[name]._prepare_input(call_state)["input"]
+        assert encoded == legacy_input(name, agents[name], call_state), f"{name} 的輸入與 json.dumps 不一致"
+        total_bytes += len(encoded.encode("utf-8"))
+
+    legacy = measure(calls, args.repeat, lambda name, s: legacy_input(name, agents[name], s))
+    cached = measure(calls, args.repeat, lambda name, s: agents[name]._prepare_input(s)["input"])
+    print(f"調用次數: {len(calls)}，平均輸入 {total_bytes / len(calls) / 1024:.1f} KB（逐字節一致）")
+    print(f"json.dumps 重新編碼: {legacy:9.1f} 微秒/次")
+    print(f"快取片段拼接:        {cached:9.1f} 微秒/次（{legacy / cached:.1f}x）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""模型分層路由基準測試：比較所有角色都使用大模型與監督者使用小模型（失敗或信心不足時升級）
+
+以回放模型模擬兩個模型：大模型使用錄製的延遲，小模型延遲按 --small-speed 縮短，
+並以 --invalid-rate / --low-confidence-rate 的比例產生無效或低信心的監督者決策以觸發升級。
+用法：python -m benchmarks.model_routing [--tasks 20] [--speed 20] [--invalid-rate 0.05] [--low-confidence-rate 0.1]
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import Any, Dict, List
+from pydantic import PrivateAttr
+from agents.routing import DEFAULT_MODEL, ModelRouter
+from benchmarks.replay_llm import ReplayChatModel, message_role
+from workflow import create_async_workflow, create_initial_state
+
+SMALL_MODEL = "gpt-4o-mini"
+TASKS = ["分析一家咖啡店的每日營運成本", "評估公司是否應該將業務遷移到雲端"]
+
+
+class FlakyReplayModel(ReplayChatModel):
+    """按比例把監督者的回放決策替換為無效輸出，或把 confidence 改低"""
+
+    invalid_rate: float = 0.0
+    low_confidence_rate: float = 0.0
+    _flaky_random: random.Random = PrivateAttr(default=None)
+
+    def model_post_init(self, __context: Any) -> None:
+        super().model_post_init(__context)
+        self._flaky_random = random.Random(self.seed + 1)
+
+    def _lookup(self, messages: List[Any]) -> Dict[str, Any]:
+        entry = super()._lookup(messages)
+        if message_role(messages) != "supervisor":
+            return entry
+        with self._lock:
+            roll = self._flaky_random.random()
+        if roll < self.invalid_rate:
+            return {**entry, "response": "我認為下一步應該交給研究員繼續收集信息。"}
+        if roll < self.invalid_rate + self.low_confidence_rate:
+            decision = json.loads(entry["response"])
+            decision["confidence"] = 0.3
+            return {**entry, "response": json.dumps(decision, ensure_ascii=False)}
+        return entry
+
+
+async def run_config(router: ModelRouter, tasks: int) -> Dict[str, Any]:
+    workflow = create_async_workflow(router=router)
+    durations = []
+
+    async def run_one(i: int) -> None:
+        start = time.perf_counter()
+        await workflow(create_initial_state(TASKS[i % len(TASKS)]))
+        durations.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(run_one(i) for i in range(tasks)))
+    return {
+        "mean_run": sum(durations) / len(durations),
+        "routes": router.stats(),
+        "cost": router.total_cost(),
+        "decisions": workflow.agents["supervisor"].decision_stats()
+    }
+
+
+def print_result(label: str, result: Dict[str, Any], speed: float) -> None:
+    print(f"\n【{label}】平均端到端時間: {result['mean_run'] * speed:.2f}秒（按錄製延遲換算），總成本 ${result['cost']:.4f}")
+    for name, route in sorted(result["routes"].items()):
+        print(f"  {name:<45} {route['calls']:>4} 次  平均 {route['mean'] * speed:>6.2f}秒  "
+              f"p95 {route['p95'] * speed:>6.2f}秒  ${route['cost']:.4f}")
+    decisions = result["decisions"]
+    if decisions["escalations"]:
+        print(f"  升級 {decisions['escalations']} 次（{decisions['escalation_rate']:.1%}），"
+              f"其中信心不足 {decisions['low_confidence']} 次")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="模型分層路由基準測試")
+    parser.add_argument("--tasks", type=int, default=20, help="每種配置執行的任務數")
+    parser.add_argument("--speed", type=float, default=20, help="回放加速倍數（錄製延遲除以此值）")
+    parser.add_argument("--small-speed", type=float, default=4, help="小模型相對大模型的速度倍數")
+    parser.add_argument("--invalid-rate", type=float, default=0.05, help="小模型返回無效決策的比例")
+    parser.add_argument("--low-confidence-rate", type=float, default=0.1, help="小模型返回低信心決策的比例")
+    args = parser.parse_args()
+
+    large = ReplayChatModel(latency_scale=1 / args.speed)
+    small = FlakyReplayModel(latency_scale=1 / (args.speed * args.small_speed),
+                             invalid_rate=args.invalid_rate, low_confidence_rate=args.low_confidence_rate)
+    single = ModelRouter(routes={"supervisor": DEFAULT_MODEL, "researcher": DEFAULT_MODEL, "analyst": DEFAULT_MODEL},
+                         llms={DEFAULT_MODEL: large})
+    tiered = ModelRouter(llms={DEFAULT_MODEL: large, SMALL_MODEL: small})
+
+    baseline = asyncio.run(run_config(single, args.tasks))
+    routed = asyncio.run(run_config(tiered, args.tasks))
+    print_result("全部使用大模型", baseline, args.speed)
+    print_result("分層路由", routed, args.speed)
+    print(f"\n端到端時間節省: {1 - routed['mean_run'] / baseline['mean_run']:.1%}，"
+          f"成本節省: {1 - routed['cost'] / baseline['cost']:.1%}")
+
+
+if __name__ == "__main__":
+    main()
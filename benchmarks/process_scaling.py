@@ -0,0 +1,89 @@
+"""多進程分片批量執行的吞吐量基準測試：比較不同工作進程數下的吞吐量，並驗證運行中調整進程數不會丟失任務
+
+假模型每次調用等待 latency 秒，並返回 response_size 個字符的結果；監督者把研究拆分為 3 個並行子任務，
+每個任務的狀態包含多段大結果，序列化與解析佔用可觀的 CPU 時間。每個工作進程內以 concurrency 個並發任務執行非同步工作流。
+計時包含進程啟動與 agents 預構建的時間。吞吐量能隨進程數增長的上限是可用的 CPU 核心數。
+用法：python -m benchmarks.process_scaling [--tasks 400] [--levels 1,2,4] [--latency 0.005] [--response-size 4000]
+"""
+import argparse
+import functools
+import json
+import os
+import tempfile
+import threading
+from typing import Any, Callable, Dict
+from batch import run_batch, run_sharded_batch
+from benchmarks.fake_llm import FakeChatModel
+from sharding import ShardPool
+from workflow import create_async_workflow
+
+
+def fake_workflow(latency: float, response_size: int) -> Callable[..., Any]:
+    """工作進程內構建的工作流（模組級函數，可被 pickle 傳給工作進程）"""
+    return create_async_workflow(llm=FakeChatModel(latency=latency, response_size=response_size, fan_out=3))
+
+
+def write_tasks(path: str, count: int) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(count):
+            f.write(json.dumps({"id": f"t{i}", "task": f"分析第 {i} 家咖啡店的每日營運成本"}, ensure_ascii=False) + "\n")
+
+
+def count_output(path: str) -> int:
+    with open(path, encoding="utf-8") as f:
+        return len({json.loads(line)["task_id"] for line in f})
+
+
+def run_sharded(input_path: str, output_path: str, workers: int, args: argparse.Namespace,
+                resize_to: int = 0) -> Dict[str, Any]:
+    factory = functools.partial(fake_workflow, args.latency, args.response_size)
+    with ShardPool(workers, args.concurrency, factory) as pool:
+        if resize_to:
+            # 運行一段時間後從另一個線程調整進程數，已提交的分片繼續在舊進程中完成
+            threading.Timer(args.resize_after, pool.resize, (resize_to,)).start()
+        stats = run_sharded_batch(input_path, output_path, pool, args.shard_size)
+    stats["unique_outputs"] = count_output(output_path)
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="多進程分片批量執行吞吐量基準測試")
+    parser.add_argument("--tasks", type=int, default=400, help="任務數")
+    parser.add_argument("--levels", default="1,2,4", help="工作進程數，以逗號分隔")
+    parser.add_argument("--concurrency", type=int, default=16, help="每個工作進程內的並發任務數")
+    parser.add_argument("--shard-size", type=int, default=16, help="每個分片的任務數")
+    parser.add_argument("--latency", type=float, default=0.005, help="假模型每次調用的延遲（秒）")
+    parser.add_argument("--response-size", type=int, default=4000, help="假模型每次回應的字符數")
+    parser.add_argument("--resize-after", type=float, default=1.0, help="調整進程數測試中，開始後多少秒調整")
+    args = parser.parse_args()
+
+    levels = [int(x) for x in args.levels.split(",")]
+    print(f"CPU 核心數: {os.cpu_count()}，任務數: {args.tasks}，每進程並發: {args.concurrency}\n")
+    print(f"{'模式':<16}{'進程':>6}{'完成':>8}{'耗時(秒)':>12}{'任務/秒':>12}{'加速比':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        input_path = os.path.join(tmp, "tasks.jsonl")
+        write_tasks(input_path, args.tasks)
+
+        # 基線：單進程線程池（每個線程執行同步工作流）
+        llm = FakeChatModel(latency=args.latency, response_size=args.response_size, fan_out=3)
+        stats = run_batch(input_path, os.path.join(tmp, "threads.jsonl"), args.concurrency, llm=llm)
+        print(f"{'threads':<16}{1:>6}{stats['completed']:>8}{stats['elapsed']:>12.2f}{stats['throughput']:>12.2f}{'':>10}")
+
+        base = None
+        for workers in levels:
+            stats = run_sharded(input_path, os.path.join(tmp, f"sharded-{workers}.jsonl"), workers, args)
+            base = base or stats["throughput"]
+            print(f"{'sharded':<16}{workers:>6}{stats['completed']:>8}{stats['elapsed']:>12.2f}"
+                  f"{stats['throughput']:>12.2f}{stats['throughput'] / base:>9.2f}x")
+
+        # 從 1 個進程開始，運行中擴展到最大進程數
+        stats = run_sharded(input_path, os.path.join(tmp, "resized.jsonl"), 1, args, resize_to=max(levels))
+        print(f"{'sharded+resize':<16}{f'1->{max(levels)}':>6}{stats['completed']:>8}{stats['elapsed']:>12.2f}"
+              f"{stats['throughput']:>12.2f}{stats['throughput'] / base:>9.2f}x")
+        lost = args.tasks - stats["unique_outputs"]
+        print(f"\n調整進程數: {stats['processes']['resizes']} 次，使用過 {stats['processes']['used']} 個進程，"
+              f"失敗 {stats['failed']} 個，丟失 {lost} 個任務")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""提示前綴穩定性基準測試：比較舊的輸入佈局與「原始任務 → 只追加的歷史 → 本次任務」佈局的可快取前綴
+
+以假模型執行一次長工作流，再按 agent_sequence 重建每次調用時的狀態，分別以兩種佈局渲染提示，
+用 PrefixTracker 估計每次調用可命中服務商提示快取（OpenAI 規則：至少 1024 tokens，按 128 tokens 對齊）的 token 數。
+未快取的 token 需要完整預填充，決定了首個 token 的延遲。
+用法：python -m benchmarks.prompt_prefix [--iterations 40] [--response-size 800]
+"""
+import argparse
+import json
+from typing import Any, Callable, Dict, List, Tuple
+from agents.context import ContextManager
+from agents.tokens import PrefixTracker, count_tokens
+from benchmarks.fake_llm import FakeChatModel
+from workflow import create_initial_state, create_workflow
+
+
+def legacy_input(agent: str, context: ContextManager, state: Dict[str, Any]) -> str:
+    # 舊佈局：變化的任務描述在最前，各歷史列表分開且會在中間增長，摘要逐條進行
+    if agent == "supervisor":
+        data = {
+            "current_task": state["current_task"],
+            "task_assignments": context.build(state["task_assignments"]),
+            "research_results": context.build(state["research_results"]),
+            "analysis_results": context.build(state["analysis_results"])
+        }
+    elif agent == "researcher":
+        data = {"task": state["current_task"], "previous_research": context.build(state["research_results"])}
+    else:
+        data = {
+            "task": state["current_task"],
+            "research_results": context.build(state["research_results"]),
+            "previous_analysis": context.build(state["analysis_results"])
+        }
+    return json.dumps(data, ensure_ascii=False)
+
+
+def call_states(final_state: Dict[str, Any]) -> List[Tuple[str, Dict[str, Any]]]:
+    """按 agent_sequence 重建每次調用時看到的狀態（第 p 個節點執行時的迭代編號為 p + 1）"""
+    calls = []
+    assignments = final_state["task_assignments"]
+    decided = 0
+    for position, agent in enumerate(final_state["agent_sequence"]):
+        state = {
+            **final_state,
+            "task_assignments": assignments[:decided],
+            "research_results": [r for r in final_state["research_results"] if r.iteration <= position],
+            "analysis_results": [r for r in final_state["analysis_results"] if r.iteration <= position],
+            "current_task": assignments[decided - 1]["task"] if decided else final_state["original_task"]
+        }
+        calls.append((agent, state))
+        if agent == "supervisor":
+            decided += 1
+    return calls
+
+
+def render(agent: Any, inputs: str) -> str:
+    # 與 TokenUsageHandler 記錄前綴時的渲染方式一致
+    chain = agent.text_chain if hasattr(agent, "text_chain") else agent.chain
+    return "".join(f"<{m.type}>{m.content}" for m in chain.first.format_messages(input=inputs))
+
+
+def measure(calls: List[Tuple[str, Dict[str, Any]]], agents: Dict[str, Any],
+            build: Callable[[str, Any, Dict[str, Any]], str]) -> Dict[str, Dict[str, int]]:
+    tracker = PrefixTracker()
+    totals: Dict[str, Dict[str, int]] = {}
+    for name, state in calls:
+        prompt = render(agents[name], build(name, agents[name], state))
+        _, cacheable = tracker.observe(name, prompt)
+        role = totals.setdefault(name, {"calls": 0, "prompt_tokens": 0, "prefix_tokens": 0})
+        role["calls"] += 1
+        role["prompt_tokens"] += count_tokens(prompt)
+        role["prefix_tokens"] += cacheable
+    return totals
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="提示前綴穩定性基準測試")
+    parser.add_argument("--iterations", type=int, default=40, help="工作流的迭代次數")
+    parser.add_argument("--response-size", type=int, default=800, help="假模型每次回應的字符數")
+    args = parser.parse_args()
+
+    workflow = create_workflow(llm=FakeChatModel(latency=0, endless=True, response_size=args.response_size))
+    state = create_initial_state("分析一家咖啡店的每日營運成本")
+    state["max_iterations"] = args.iterations
+    calls = call_states(workflow(state))
+    agents = workflow.agents
+
+    legacy_context = ContextManager(prefix_step=1)
+    layouts = {
+        "舊佈局": measure(calls, agents, lambda name, agent, state: legacy_input(name, legacy_context, state)),
+        "穩定前綴": measure(calls, agents, lambda name, agent, state: agent._prepare_input(state)["input"])
+    }
+    print(f"\n調用次數: {len(calls)}（{args.iterations} 次迭代）")
+    print(f"{'佈局':<10}{'角色':<12}{'提示 tokens':>12}{'可快取':>10}{'未快取':>10}{'可快取比例':>12}")
+    for layout, totals in layouts.items():
+        for role, values in sorted(totals.items()):
+            uncached = values["prompt_tokens"] - values["prefix_tokens"]
+            print(f"{layout:<10}{role:<12}{values['prompt_tokens']:>12}{values['prefix_tokens']:>10}{uncached:>10}"
+                  f"{values['prefix_tokens'] / values['prompt_tokens']:>12.1%}")
+    legacy, stable = (sum(v["prompt_tokens"] - v["prefix_tokens"] for v in totals.values()) for totals in layouts.values())
+    print(f"\n需要預填充的未快取 tokens: {legacy} -> {stable}（減少 {1 - stable / legacy:.1%}）")
+
+
+if __name__ == "__main__":
+    main()
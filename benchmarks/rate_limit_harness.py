@@ -0,0 +1,58 @@
+"""限速調度器測試工具：對注入 429/5xx 的本地假服務執行一批任務
+
+比較不使用調度器（錯誤直接寫入結果）與使用 LLMScheduler 時的錯誤數與吞吐量。
+用法：python -m benchmarks.rate_limit_harness [--tasks 40] [--server-rpm 60] [--error-rate 0.05]
+"""
+import argparse
+import asyncio
+import time
+from langchain_openai import ChatOpenAI
+from agents.scheduler import LLMScheduler
+from benchmarks.fake_server import FakeOpenAIServer
+from workflow import create_async_workflow, create_initial_state
+
+
+def count_failed(states) -> int:
+    """未正常完成的任務數：結果中含有錯誤，或監督者未給出最終決策"""
+    failed = 0
+    for state in states:
+        results = state["research_results"] + state["analysis_results"]
+        if any("錯誤" in str(r) for r in results) or state["final_decision"] != "完成":
+            failed += 1
+    return failed
+
+
+async def run(label: str, base_url: str, tasks: int, scheduler=None) -> None:
+    llm = ChatOpenAI(model_name="gpt-4-turbo-preview", temperature=0, api_key="sk-fake",
+                     base_url=base_url, max_retries=0)
+    workflow = create_async_workflow(llm=llm, scheduler=scheduler)
+    start = time.perf_counter()
+    states = await asyncio.gather(*(workflow(create_initial_state(f"任務 {i}")) for i in range(tasks)))
+    elapsed = time.perf_counter() - start
+    print(f"\n[{label}]")
+    print(f"耗時: {elapsed:.2f}秒, 吞吐量: {tasks / elapsed:.2f} 任務/秒, 未正常完成的任務數: {count_failed(states)}/{tasks}")
+    if scheduler is not None:
+        print(f"調度器統計: {scheduler.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="限速調度器測試工具")
+    parser.add_argument("--tasks", type=int, default=40)
+    parser.add_argument("--server-rpm", type=int, default=60,
+                        help="假服務每分鐘允許的請求數，需低於任務產生的請求量才會觸發 429")
+    parser.add_argument("--error-rate", type=float, default=0.05, help="假服務注入 5xx 的比例")
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    for label, make_scheduler in (
+        ("無調度器", lambda: None),
+        ("LLMScheduler", lambda: LLMScheduler(requests_per_minute=args.server_rpm * 0.9, tokens_per_minute=None,
+                                               initial_concurrency=4, backoff_base=0.2, backoff_max=5, max_attempts=8)),
+    ):
+        with FakeOpenAIServer(args.server_rpm, args.error_rate, args.latency) as server:
+            asyncio.run(run(label, server.base_url, args.tasks, make_scheduler()))
+            print(f"服務端狀態碼統計: {dict(server.counts)}")
+
+
+if __name__ == "__main__":
+    main()
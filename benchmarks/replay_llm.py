@@ -0,0 +1,233 @@
+"""錄製/回放聊天模型：把真實（或任意）模型的回應錄製到 fixture 文件，之後離線回放
+
+fixture 為 JSONL，每行一次調用：
+{"role": "supervisor", "prompt": "...", "response": "...", "prompt_tokens": 0, "completion_tokens": 0, "latency": 0.0}
+
+回放時先按 (角色, 提示) 精確匹配，未命中時在同一角色的記錄中選擇提示最相似的一條，
+因此任務描述或時間戳略有不同的運行也能得到合理的回應。
+
+錄製：python -m benchmarks.replay_llm record --output fixtures.jsonl --task "分析一家咖啡店的每日營運成本"
+"""
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+import argparse
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+import xxhash
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, SystemMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+from agents.similarity import MinHasher
+from agents.tokens import count_tokens
+
+DEFAULT_FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "sample_runs.jsonl")
+
+
+def message_role(messages: List[BaseMessage]) -> str:
+    """依據系統提示判斷調用來自哪個 agent"""
+    system = next((m.content for m in messages if isinstance(m, SystemMessage)), "")
+    if "監督者" in system:
+        return "supervisor"
+    if "研究員" in system:
+        return "researcher"
+    return "analyst"
+
+
+def fixture_key(role: str, prompt: str) -> str:
+    return xxhash.xxh3_64_hexdigest(f"{role}\x00{prompt}".encode("utf-8"))
+
+
+class ReplayChatModel(BaseChatModel):
+    """從 fixture 回放回應的假模型，可配置合成延遲與 token 數
+
+    latency 為 None 時使用錄製時的延遲（乘以 latency_scale，可模擬較快的模型）；latency_per_token 按完成 token 數追加延遲；
+    jitter 為延遲的隨機浮動比例（以 seed 初始化，結果可重現）。
+    prompt_tokens / completion_tokens 不為 None 時覆蓋回報的 token 用量。
+    流式輸出時先等待延遲的 first_token_ratio 比例再輸出第一段，其餘延遲平均分攤到各段之間（模擬逐 token 生成），
+    總延遲與非流式調用相同；默認為 1，即等待全部延遲後一次輸出所有段。
+    """
+
+    fixture: str = DEFAULT_FIXTURE
+    latency: Optional[float] = None
+    latency_scale: float = 1.0
+    latency_per_token: float = 0.0
+    jitter: float = 0.0
+    seed: int = 0
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    chunk_size: int = 16
+    first_token_ratio: float = 1.0
+    strict: bool = False  # 為 True 時未精確命中即拋出 KeyError
+    _entries: Dict[str, List[Dict[str, Any]]] = PrivateAttr(default_factory=dict)
+    _exact: Dict[str, Dict[str, Any]] = PrivateAttr(default_factory=dict)
+    _minhash: MinHasher = PrivateAttr(default_factory=MinHasher)
+    _random: random.Random = PrivateAttr(default=None)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _stats: Dict[str, int] = PrivateAttr(default_factory=lambda: {"exact": 0, "nearest": 0})
+
+    def model_post_init(self, __context: Any) -> None:
+        self._random = random.Random(self.seed)
+        with open(self.fixture, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                self._entries.setdefault(entry["role"], []).append(entry)
+                self._exact[fixture_key(entry["role"], entry["prompt"])] = entry
+
+    @property
+    def _llm_type(self) -> str:
+        return "replay-chat"
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+    def _lookup(self, messages: List[BaseMessage]) -> Dict[str, Any]:
+        role = message_role(messages)
+        prompt = messages[-1].content
+        entry = self._exact.get(fixture_key(role, prompt))
+        kind = "exact"
+        if entry is None:
+            if self.strict:
+                raise KeyError(f"fixture 中沒有 {role} 的匹配記錄")
+            candidates = self._entries.get(role)
+            if not candidates:
+                raise KeyError(f"fixture 中沒有 {role} 的記錄")
+            entry = max(candidates, key=lambda e: self._minhash.similarity(prompt, e["prompt"]))
+            kind = "nearest"
+        with self._lock:
+            self._stats[kind] += 1
+        return entry
+
+    def _delay(self, entry: Dict[str, Any], completion_tokens: int) -> float:
+        delay = entry.get("latency", 0.0) * self.latency_scale if self.latency is None else self.latency
+        delay += self.latency_per_token * completion_tokens
+        if self.jitter:
+            with self._lock:
+                delay *= 1 + self._random.uniform(-self.jitter, self.jitter)
+        return max(delay, 0.0)
+
+    def _stream_delays(self, entry: Dict[str, Any], messages: List[BaseMessage]) -> Tuple[float, float]:
+        """返回流式輸出時 (第一段之前的等待, 之後每段之間的等待)"""
+        delay = self._delay(entry, self._usage(entry, messages)["completion_tokens"])
+        chunks = max(-(-len(entry["response"]) // self.chunk_size), 1)
+        first = delay * self.first_token_ratio
+        return first, (delay - first) / max(chunks - 1, 1)
+
+    def _usage(self, entry: Dict[str, Any], messages: List[BaseMessage]) -> Dict[str, int]:
+        prompt = self.prompt_tokens
+        if prompt is None:
+            prompt = entry.get("prompt_tokens") or sum(count_tokens(str(m.content)) for m in messages)
+        completion = self.completion_tokens
+        if completion is None:
+            completion = entry.get("completion_tokens") or count_tokens(entry["response"])
+        return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+    def _result(self, entry: Dict[str, Any], usage: Dict[str, int]) -> ChatResult:
+        message = AIMessage(content=entry["response"], usage_metadata={
+            "input_tokens": usage["prompt_tokens"], "output_tokens": usage["completion_tokens"],
+            "total_tokens": usage["total_tokens"]})
+        return ChatResult(generations=[ChatGeneration(message=message)], llm_output={"token_usage": usage})
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        entry = self._lookup(messages)
+        usage = self._usage(entry, messages)
+        time.sleep(self._delay(entry, usage["completion_tokens"]))
+        return self._result(entry, usage)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        entry = self._lookup(messages)
+        usage = self._usage(entry, messages)
+        await asyncio.sleep(self._delay(entry, usage["completion_tokens"]))
+        return self._result(entry, usage)
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        entry = self._lookup(messages)
+        first, gap = self._stream_delays(entry, messages)
+        time.sleep(first)
+        text = entry["response"]
+        for i in range(0, len(text), self.chunk_size):
+            if i:
+                time.sleep(gap)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=text[i:i + self.chunk_size]))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        entry = self._lookup(messages)
+        first, gap = self._stream_delays(entry, messages)
+        await asyncio.sleep(first)
+        text = entry["response"]
+        for i in range(0, len(text), self.chunk_size):
+            if i:
+                await asyncio.sleep(gap)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=text[i:i + self.chunk_size]))
+
+
+class RecordingChatModel(BaseChatModel):
+    """包裝另一個聊天模型，把每次調用的提示、回應、token 用量與延遲追加到 fixture 文件"""
+
+    inner: BaseChatModel
+    output: str
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    @property
+    def _llm_type(self) -> str:
+        return "recording-chat"
+
+    def _record(self, messages: List[BaseMessage], message: AIMessage, latency: float) -> None:
+        usage = getattr(message, "usage_metadata", None) or {}
+        entry = {
+            "role": message_role(messages),
+            "prompt": messages[-1].content,
+            "response": message.content,
+            "prompt_tokens": usage.get("input_tokens") or sum(count_tokens(str(m.content)) for m in messages),
+            "completion_tokens": usage.get("output_tokens") or count_tokens(str(message.content)),
+            "latency": latency
+        }
+        with self._lock, open(self.output, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        start = time.perf_counter()
+        message = self.inner.invoke(messages, stop=stop)
+        self._record(messages, message, time.perf_counter() - start)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        start = time.perf_counter()
+        message = await self.inner.ainvoke(messages, stop=stop)
+        self._record(messages, message, time.perf_counter() - start)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="錄製工作流的 LLM 調用到 fixture 文件")
+    parser.add_argument("command", choices=["record"])
+    parser.add_argument("--output", required=True, help="fixture 輸出文件（.jsonl，追加寫入）")
+    parser.add_argument("--task", action="append", required=True, help="要錄製的任務，可重複指定")
+    parser.add_argument("--model", default="gpt-4-turbo-preview", help="錄製使用的模型")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    from agents.clients import get_llm
+    from workflow import create_workflow, create_initial_state
+
+    load_dotenv()
+    workflow = create_workflow(llm=RecordingChatModel(inner=get_llm(args.model), output=args.output))
+    for task in args.task:
+        state = workflow(create_initial_state(task))
+        print(f"{task}: {' -> '.join(state['agent_sequence'])}")
+
+
+if __name__ == "__main__":
+    main()
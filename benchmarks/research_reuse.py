@@ -0,0 +1,100 @@
+"""共享研究存儲基準測試：批量執行同類任務時重用相似的研究結果，統計重用率、誤用率與節省的時間
+
+任務來自三個領域（咖啡店成本、雲端遷移、減重計劃），同一領域的任務只有城市、規模等細節不同。
+假模型的監督者把原始任務寫入研究任務，因此研究任務的相似度與原始任務一致。
+「誤用」指重用了其他領域任務的研究結果。先以不同閾值掃描重用率與誤用率，再以合成延遲比較端到端時間。
+用法：python -m benchmarks.research_reuse [--tasks 200] [--latency 0.01] [--threshold 0.8]
+"""
+import argparse
+import itertools
+import json
+import random
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from benchmarks.fake_llm import FakeChatModel
+from research_store import ResearchStore
+from workflow import create_initial_state, create_workflow
+
+CITIES = ["台北", "台中", "高雄", "台南", "新竹", "桃園", "基隆", "嘉義", "花蓮", "宜蘭"]
+TEMPLATES = {
+    "coffee": ["分析{city}一家{size}咖啡店的每日營運成本", ["小型", "中型", "大型", "連鎖"]],
+    "cloud": ["評估{city}一家{size}公司是否應該將業務遷移到雲端", ["零售", "製造", "金融", "物流"]],
+    "fitness": ["為{city}一位{size}上班族規劃為期3個月的減重計劃", ["25歲", "35歲", "45歲", "55歲"]]
+}
+
+
+class ResearchTaskModel(FakeChatModel):
+    """監督者依序分派研究、分析後結束，研究任務包含原始任務；研究結果註明所屬任務"""
+
+    def _respond(self, messages: List[Any]) -> str:
+        system = messages[0].content
+        data = json.loads(messages[-1].content)
+        if "監督者" in system:
+            agents = {item.get("agent") for item in data.get("history") or [] if isinstance(item, dict)}
+            original = data["original_task"]
+            if "researcher" not in agents:
+                decision = {"next_agent": "researcher", "task": f"收集{original}所需的資料與行業數據"}
+            elif "analyst" not in agents:
+                decision = {"next_agent": "analyst", "task": f"根據研究結果{original}"}
+            else:
+                return json.dumps({"next_agent": "end", "task": "完成", "is_complete": True, "final_decision": "完成"},
+                                  ensure_ascii=False)
+            return json.dumps({**decision, "is_complete": False, "final_decision": ""}, ensure_ascii=False)
+        if "研究員" in system:
+            return f"研究結果（{data['original_task']}）：\n" + "\n".join(
+                f"{i}. " + "資" * (self.response_size // 5) for i in range(1, 6))
+        return "分析結果：" + "析" * self.response_size
+
+
+def make_tasks(count: int, seed: int = 0) -> List[Tuple[str, str]]:
+    """返回 (領域, 任務) 列表，各領域輪流出現"""
+    rng = random.Random(seed)
+    tasks = []
+    for domain in itertools.islice(itertools.cycle(TEMPLATES), count):
+        template, sizes = TEMPLATES[domain]
+        tasks.append((domain, template.format(city=rng.choice(CITIES), size=rng.choice(sizes))))
+    return tasks
+
+
+def run(tasks: List[Tuple[str, str]], latency: float, store: Optional[ResearchStore]) -> Dict[str, Any]:
+    workflow = create_workflow(llm=ResearchTaskModel(latency=latency), research_store=store)
+    domains = {task: domain for domain, task in tasks}
+    misused = 0
+    start = time.perf_counter()
+    for domain, task in tasks:
+        state = workflow(create_initial_state(task))
+        for record in state["research_results"]:
+            # 重用的結果第一行註明了來源任務，研究結果的括號中是該任務的原始任務
+            source = record.content.split("（", 2)[-1].split("）", 1)[0] if record.content.startswith("（") else task
+            if domains.get(source, domain) != domain:
+                misused += 1
+    return {"elapsed": time.perf_counter() - start, "misused": misused,
+            "store": store.stats() if store is not None else None}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="共享研究存儲基準測試")
+    parser.add_argument("--tasks", type=int, default=200, help="任務數")
+    parser.add_argument("--latency", type=float, default=0.01, help="假模型每次調用的延遲（秒）")
+    parser.add_argument("--threshold", type=float, default=0.8, help="計時比較時使用的重用閾值")
+    parser.add_argument("--store-size", type=int, default=1000, help="存儲保留的最大結果數")
+    args = parser.parse_args()
+
+    tasks = make_tasks(args.tasks)
+    print(f"任務數: {len(tasks)}（{len(set(task for _, task in tasks))} 個不同任務，{len(TEMPLATES)} 個領域）\n")
+    print(f"{'閾值':>6}{'重用率':>10}{'誤用':>8}{'存儲條數':>10}")
+    for threshold in (0.5, 0.6, 0.7, 0.8, 0.9):
+        result = run(tasks, 0.0, ResearchStore(threshold=threshold, max_entries=args.store_size))
+        store = result["store"]
+        print(f"{threshold:>6.1f}{store['reuse_rate']:>10.1%}{result['misused']:>8}{store['entries']:>10}")
+
+    baseline = run(tasks, args.latency, None)
+    shared = run(tasks, args.latency, ResearchStore(threshold=args.threshold, max_entries=args.store_size))
+    store = shared["store"]
+    print(f"\n閾值 {args.threshold}：研究調用 {store['lookups']} -> {store['misses']} 次，"
+          f"總時間 {baseline['elapsed']:.2f}秒 -> {shared['elapsed']:.2f}秒"
+          f"（節省 {1 - shared['elapsed'] / baseline['elapsed']:.1%}），誤用 {shared['misused']} 次")
+
+
+if __name__ == "__main__":
+    main()
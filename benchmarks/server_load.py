@@ -0,0 +1,79 @@
+"""HTTP 服務負載測試：以假 LLM 啟動服務，並發提交任務並輪詢結果
+
+統計被接受/拒絕（429）的任務數、端到端延遲與吞吐量。
+用法：python -m benchmarks.server_load [--tasks 200] [--clients 32] [--workers 8] [--queue-size 32]
+"""
+import argparse
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+from batch import percentile
+from benchmarks.fake_llm import FakeChatModel
+from server import WorkflowService, create_server
+
+# 服務模組會把日誌級別設為 INFO，這裡關閉 httpx 的逐請求日誌
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+def client(base_url: str, index: int, retry: bool) -> dict:
+    with httpx.Client(base_url=base_url, timeout=120) as http:
+        start = time.perf_counter()
+        rejected = 0
+        while True:
+            response = http.post("/jobs", json={"task": f"任務 {index}"})
+            if response.status_code != 429:
+                break
+            rejected += 1
+            if not retry:
+                return {"accepted": False, "rejected": rejected}
+            time.sleep(float(response.headers.get("Retry-After", 1)) / 10)
+        job_id = response.json()["job_id"]
+        while True:
+            response = http.get(f"/jobs/{job_id}/result", params={"wait": 30})
+            if response.status_code != 202:
+                break
+        return {
+            "accepted": True,
+            "rejected": rejected,
+            "ok": response.status_code == 200,
+            "latency": time.perf_counter() - start
+        }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="HTTP 服務負載測試")
+    parser.add_argument("--tasks", type=int, default=200, help="提交的任務數")
+    parser.add_argument("--clients", type=int, default=32, help="並發客戶端數")
+    parser.add_argument("--workers", type=int, default=8, help="服務端工作線程數")
+    parser.add_argument("--queue-size", type=int, default=32, help="服務端隊列長度")
+    parser.add_argument("--latency", type=float, default=0.05, help="每次 LLM 調用的模擬延遲（秒）")
+    parser.add_argument("--no-retry", action="store_true", help="收到 429 時直接放棄而不重試")
+    args = parser.parse_args()
+
+    service = WorkflowService(workers=args.workers, queue_size=args.queue_size,
+                              llm=FakeChatModel(latency=args.latency))
+    server = create_server(service, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        results = list(pool.map(lambda i: client(base_url, i, not args.no_retry), range(args.tasks)))
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+    server.server_close()
+
+    accepted = [r for r in results if r["accepted"]]
+    latencies = [r["latency"] for r in accepted]
+    print(f"任務數: {args.tasks}，並發客戶端: {args.clients}，工作線程: {args.workers}，隊列長度: {args.queue_size}")
+    print(f"接受: {len(accepted)}，成功: {sum(1 for r in accepted if r['ok'])}，"
+          f"429 次數: {sum(r['rejected'] for r in results)}")
+    print(f"總耗時: {elapsed:.2f}秒，吞吐量: {len(accepted) / elapsed:.2f} 任務/秒")
+    print(f"端到端延遲 p50: {percentile(latencies, 50):.3f}秒，p95: {percentile(latencies, 95):.3f}秒")
+    print(f"服務統計: {service.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""每任務準備開銷基準測試：比較每次新建客戶端、共享客戶端與快取工作流
+
+不會發出任何網絡請求，僅測量構建 LLM 客戶端、agents 與工作流的耗時。
+用法：python -m benchmarks.setup_cost [--tasks 200]
+"""
+import argparse
+import os
+import time
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+from langchain_openai import ChatOpenAI
+from agents.analyst import AnalystAgent
+from agents.researcher import ResearcherAgent
+from agents.supervisor import SupervisorAgent
+from workflow import create_workflow, get_workflow
+
+
+def build_per_task() -> None:
+    # 舊方式：每個任務為每個 agent 各建一個 ChatOpenAI（各自的 HTTP 客戶端）
+    SupervisorAgent(llm=ChatOpenAI(model_name="gpt-4-turbo-preview", temperature=0))
+    ResearcherAgent(llm=ChatOpenAI(model_name="gpt-4-turbo-preview", temperature=0))
+    AnalystAgent(llm=ChatOpenAI(model_name="gpt-4-turbo-preview", temperature=0))
+
+
+def measure(label: str, fn, tasks: int) -> None:
+    start = time.perf_counter()
+    for _ in range(tasks):
+        fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<24}{elapsed / tasks * 1000:>12.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="每任務準備開銷基準測試")
+    parser.add_argument("--tasks", type=int, default=200, help="模擬的任務數")
+    args = parser.parse_args()
+
+    print(f"{'方式':<24}{'毫秒/任務':>12}")
+    measure("每任務新建客戶端", build_per_task, args.tasks)
+    measure("共享客戶端 create_workflow", create_workflow, args.tasks)
+    measure("快取工作流 get_workflow", get_workflow, args.tasks)
+
+
+if __name__ == "__main__":
+    main()
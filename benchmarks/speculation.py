@@ -0,0 +1,72 @@
+"""推測執行基準測試：比較開啟與關閉推測執行時的端到端時間、命中率與額外調用
+
+以回放模型模擬錄製的延遲（按 --speed 加速），流式輸出時第一段在延遲的 --first-token-ratio 比例後到達，
+其餘分攤到各段之間，總延遲與非流式調用相同。同步與非同步工作流各測一次。
+用法：python -m benchmarks.speculation [--tasks 10] [--speed 20] [--budget 0.25] [--first-token-ratio 0.3]
+"""
+import argparse
+import asyncio
+import time
+from typing import Any, Dict, Optional
+from benchmarks.replay_llm import ReplayChatModel
+from speculation import Speculator
+from workflow import create_async_workflow, create_initial_state, create_workflow
+
+TASKS = ["分析一家咖啡店的每日營運成本", "評估公司是否應該將業務遷移到雲端"]
+
+
+def run_sync(speed: float, ratio: float, tasks: int, speculation: Optional[Speculator]) -> Dict[str, Any]:
+    llm = ReplayChatModel(latency_scale=1 / speed, first_token_ratio=ratio)
+    workflow = create_workflow(llm=llm, speculation=speculation)
+    start = time.perf_counter()
+    for i in range(tasks):
+        workflow(create_initial_state(TASKS[i % len(TASKS)]))
+    return {"mean_run": (time.perf_counter() - start) / tasks, "llm_calls": sum(llm.stats().values())}
+
+
+async def run_async(speed: float, ratio: float, tasks: int, speculation: Optional[Speculator]) -> Dict[str, Any]:
+    llm = ReplayChatModel(latency_scale=1 / speed, first_token_ratio=ratio)
+    workflow = create_async_workflow(llm=llm, speculation=speculation)
+    durations = []
+
+    async def run_one(i: int) -> None:
+        start = time.perf_counter()
+        await workflow(create_initial_state(TASKS[i % len(TASKS)]))
+        durations.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(run_one(i) for i in range(tasks)))
+    return {"mean_run": sum(durations) / len(durations), "llm_calls": sum(llm.stats().values())}
+
+
+def report(label: str, baseline: Dict[str, Any], speculative: Dict[str, Any], speculator: Speculator,
+           speed: float) -> None:
+    stats = speculator.stats()
+    print(f"\n【{label}】")
+    print(f"平均端到端時間: {baseline['mean_run'] * speed:.2f}秒 -> {speculative['mean_run'] * speed:.2f}秒 "
+          f"（節省 {1 - speculative['mean_run'] / baseline['mean_run']:.1%}，按錄製延遲換算）")
+    print(f"推測 {stats['speculations']} 次，命中率 {stats['hit_rate']:.1%}，"
+          f"重疊節省 {stats['saved_seconds'] * speed:.2f}秒（累計），跳過（預算）{stats['skipped_budget']} 次")
+    print(f"LLM 調用: {baseline['llm_calls']} -> {speculative['llm_calls']}，"
+          f"浪費 {stats['wasted_calls']} 次（worker 調用的 {stats['waste_ratio']:.1%}）")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="推測執行基準測試")
+    parser.add_argument("--tasks", type=int, default=10, help="任務數")
+    parser.add_argument("--speed", type=float, default=20, help="回放加速倍數（錄製延遲除以此值）")
+    parser.add_argument("--budget", type=float, default=0.25, help="浪費的推測調用佔 worker 調用的上限")
+    parser.add_argument("--first-token-ratio", type=float, default=0.3, help="流式輸出的首段延遲佔總延遲的比例")
+    args = parser.parse_args()
+    ratio = args.first_token_ratio
+
+    sync_speculator = Speculator(budget=args.budget)
+    report("同步工作流", run_sync(args.speed, ratio, args.tasks, None),
+           run_sync(args.speed, ratio, args.tasks, sync_speculator), sync_speculator, args.speed)
+
+    async_speculator = Speculator(budget=args.budget)
+    report("非同步工作流", asyncio.run(run_async(args.speed, ratio, args.tasks, None)),
+           asyncio.run(run_async(args.speed, ratio, args.tasks, async_speculator)), async_speculator, args.speed)
+
+
+if __name__ == "__main__":
+    main()
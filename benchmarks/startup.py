@@ -0,0 +1,115 @@
+"""啟動開銷基準測試：以 python -X importtime 測量各入口模組的導入時間，並與預算比較
+
+每個目標在新的子進程中執行多次，取導入時間（importtime 的累計微秒）與進程總耗時的中位數；
+任一目標的導入時間中位數超過預算時以非零狀態退出，可在 CI 中防止啟動回歸。
+用法：python -m benchmarks.startup [--runs 5] [--budget main=50 batch=250] [--output startup.json] [--top 10]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 目標名稱 -> (執行的代碼, 以 importtime 計時的頂層模組)
+TARGETS: Dict[str, Tuple[str, str]] = {
+    "main": ("import main", "main"),
+    "workflow": ("import workflow", "workflow"),
+    "batch": ("import batch", "batch"),
+    "server": ("import server", "server"),
+    # 首次創建工作流時才加載 langchain 與 agents
+    "create_workflow": ("import workflow; from benchmarks.fake_llm import FakeChatModel; "
+                        "workflow.create_workflow(llm=FakeChatModel(latency=0))", "")
+}
+
+# 導入時間預算（毫秒）
+DEFAULT_BUDGETS = {"main": 50, "workflow": 200, "batch": 250, "server": 250}
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int]]:
+    """解析 -X importtime 的輸出，返回 (模組, 自身微秒, 累計微秒)"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative, name = line[len("import time:"):].split("|", 2)
+        rows.append((name.strip(), int(self_us), int(cumulative)))
+    return rows
+
+
+def run_once(code: str) -> Tuple[float, List[Tuple[str, int, int]]]:
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT,
+                            capture_output=True, text=True, env={**os.environ, "PYTHONPATH": ROOT})
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"執行失敗: {code}\n{result.stderr[-2000:]}")
+    return elapsed, parse_importtime(result.stderr)
+
+
+def measure(code: str, module: str, runs: int, top: int) -> Dict[str, object]:
+    walls, imports = [], []
+    heaviest: Dict[str, List[int]] = {}
+    for _ in range(runs):
+        wall, rows = run_once(code)
+        walls.append(wall * 1000)
+        if module:
+            imports.append(next(cumulative for name, _, cumulative in reversed(rows) if name == module) / 1000)
+        for name, self_us, _ in rows:
+            heaviest.setdefault(name, []).append(self_us)
+    ranked = sorted(((statistics.median(values) / 1000, name) for name, values in heaviest.items()), reverse=True)
+    return {
+        "import_ms": statistics.median(imports) if imports else None,
+        "process_ms": statistics.median(walls),
+        "heaviest": [{"module": name, "self_ms": ms} for ms, name in ranked[:top]]
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="啟動開銷基準測試")
+    parser.add_argument("--runs", type=int, default=5, help="每個目標的執行次數")
+    parser.add_argument("--targets", nargs="+", default=list(TARGETS), choices=list(TARGETS), help="要測量的目標")
+    parser.add_argument("--budget", nargs="*", default=[], help="覆蓋導入時間預算，例如 main=50 batch=250（毫秒）")
+    parser.add_argument("--output", help="結果輸出文件（JSON）")
+    parser.add_argument("--top", type=int, default=5, help="列出自身導入最慢的模組數")
+    args = parser.parse_args()
+
+    budgets = dict(DEFAULT_BUDGETS)
+    for item in args.budget:
+        name, value = item.split("=", 1)
+        budgets[name] = float(value)
+
+    results = {}
+    over_budget = []
+    for name in args.targets:
+        code, module = TARGETS[name]
+        result = measure(code, module, args.runs, args.top)
+        result["budget_ms"] = budgets.get(name)
+        results[name] = result
+        status = ""
+        if result["import_ms"] is not None and result["budget_ms"] is not None:
+            if result["import_ms"] > result["budget_ms"]:
+                over_budget.append(name)
+                status = f"  超出預算 {result['budget_ms']:.0f} 毫秒"
+            else:
+                status = f"  預算 {result['budget_ms']:.0f} 毫秒"
+        imported = f"{result['import_ms']:.1f}" if result["import_ms"] is not None else "-"
+        print(f"{name:<16} 導入 {imported:>8} 毫秒  進程 {result['process_ms']:>8.1f} 毫秒{status}")
+        for item in result["heaviest"]:
+            print(f"    {item['module']:<50} {item['self_ms']:>8.1f} 毫秒")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"python": sys.version.split()[0], "runs": args.runs, "results": results}, f,
+                      ensure_ascii=False, indent=2)
+    if over_budget:
+        print(f"\n超出預算: {', '.join(over_budget)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
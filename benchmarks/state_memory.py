@@ -0,0 +1,102 @@
+"""長時間運行的狀態更新開銷基準測試：比較整份重建狀態與增量 reducer
+
+第一部分只測量狀態更新路徑，第二部分以假 LLM 執行完整的長工作流。
+用法：python -m benchmarks.state_memory [--iterations 200] [--result-size 2000]
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+from agents.records import ResultRecord, StepRecord
+from benchmarks.fake_llm import FakeChatModel
+from convergence import ConvergenceDetector
+from workflow import apply_update, create_initial_state, create_workflow
+
+
+def legacy_step(state: dict, agent: str, content: str) -> dict:
+    # 舊方式：agent 重建整個狀態並串接列表，節點再整份替換
+    field = "research_results" if agent == "researcher" else "analysis_results"
+    new_state = {
+        **state,
+        field: state[field] + [content],
+        "execution_times": state["execution_times"] + [{
+            "iteration": state["iteration"],
+            "agent": agent,
+            "start_time": "00:00:00",
+            "execution_time": "0.01秒"
+        }],
+        "agent_sequence": state["agent_sequence"] + [agent],
+        "iteration": state["iteration"] + 1
+    }
+    return new_state
+
+
+def delta_step(state: dict, agent: str, content: str) -> dict:
+    field = "research_results" if agent == "researcher" else "analysis_results"
+    return apply_update(state, {
+        field: [ResultRecord(agent, state["iteration"], content)],
+        "execution_times": [StepRecord(state["iteration"], agent, "00:00:00", 0.01)],
+        "agent_sequence": [agent],
+        "iteration": state["iteration"] + 1
+    })
+
+
+def measure(step, iterations: int, result_size: int) -> tuple:
+    # 內容字符串預先生成，兩種方式共享，只比較狀態結構本身的開銷
+    contents = [f"{i}" + "資" * result_size for i in range(iterations)]
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    state = create_initial_state("任務")
+    tail_start = None
+    for i in range(iterations):
+        if i == iterations - iterations // 10:
+            tail_start = time.perf_counter()
+        state = step(state, "researcher" if i % 2 == 0 else "analyst", contents[i])
+    end = time.perf_counter()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    tail_steps = iterations // 10 or 1
+    return end - start, (end - tail_start) / tail_steps if tail_start else 0.0, current, peak
+
+
+def run_workflow(iterations: int, result_size: int) -> None:
+    # 假模型的輸出幾乎相同，關閉收斂檢測以跑滿全部迭代
+    workflow = create_workflow(llm=FakeChatModel(latency=0, response_size=result_size, endless=True),
+                               convergence=ConvergenceDetector(threshold=1.1))
+    state = create_initial_state("任務")
+    state["max_iterations"] = iterations
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    state = workflow(state)
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    steps = len(state["agent_sequence"])
+    workers = sum(1 for agent in state["agent_sequence"] if agent != "supervisor")
+    results = len(state["research_results"]) + len(state["analysis_results"])
+    print("\n完整工作流（假 LLM，無延遲）")
+    print(f"步驟數: {steps}，耗時 {elapsed:.3f}秒 ({elapsed / steps * 1000:.3f} 毫秒/步)")
+    print(f"結果條數: {results}（研究/分析步驟 {workers}，{'無' if results == workers else '有'}重複）")
+    print(f"保留內存: {current / 1024:.1f} KiB，峰值: {peak / 1024:.1f} KiB")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="狀態更新開銷基準測試")
+    parser.add_argument("--iterations", type=int, default=200, help="迭代次數")
+    parser.add_argument("--result-size", type=int, default=2000, help="每條結果的字符數")
+    args = parser.parse_args()
+
+    print(f"狀態更新路徑（{args.iterations} 次迭代）")
+    print(f"{'方式':<8}{'總耗時 毫秒':>12}{'末段 微秒/步':>14}{'保留 KiB':>12}{'峰值 KiB':>12}")
+    for label, step in (("整份重建", legacy_step), ("增量", delta_step)):
+        elapsed, tail, current, peak = measure(step, args.iterations, args.result_size)
+        print(f"{label:<8}{elapsed * 1000:>12.3f}{tail * 1e6:>14.2f}{current / 1024:>12.1f}{peak / 1024:>12.1f}")
+
+    run_workflow(args.iterations, args.result_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""離線基準測試套件：以回放模型測量編排開銷、狀態內存增長與不同並發下的吞吐量
+
+結果寫入 JSON（包含 git 提交與環境信息），可用 --baseline 與先前的結果比較以發現回歸。
+用法：python -m benchmarks.suite [-o bench_results.json] [--baseline old.json] [--tolerance 0.2]
+"""
+import argparse
+import asyncio
+import gc
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Any, Dict, List, Tuple
+from batch import percentile
+from benchmarks.fake_llm import FakeChatModel
+from benchmarks.replay_llm import DEFAULT_FIXTURE, ReplayChatModel
+from convergence import ConvergenceDetector
+from workflow import create_async_workflow, create_initial_state, create_workflow
+
+TASKS = ["分析一家咖啡店的每日營運成本", "評估公司是否應該將業務遷移到雲端", "設計一個智能家居系統", "規劃一個為期3個月的減重計劃"]
+
+# 指標名稱 -> 是否越大越好
+DIRECTIONS = {
+    "overhead.ms_per_step": False,
+    "memory.bytes_per_step": False,
+    "memory.peak_bytes": False,
+}
+
+
+def measure_overhead(fixture: str, tasks: int) -> Dict[str, Any]:
+    """零延遲回放下每一步的編排開銷（不含 LLM 時間）"""
+    workflow = create_workflow(llm=ReplayChatModel(fixture=fixture, latency=0))
+    workflow(create_initial_state(TASKS[0]))  # 預熱
+    steps = 0
+    start = time.perf_counter()
+    for i in range(tasks):
+        steps += len(workflow(create_initial_state(TASKS[i % len(TASKS)]))["agent_sequence"])
+    elapsed = time.perf_counter() - start
+    return {"tasks": tasks, "steps": steps, "ms_per_step": elapsed / steps * 1000}
+
+
+def measure_memory(iterations: int, result_size: int) -> Dict[str, Any]:
+    """長運行中狀態保留的內存：使用永不結束的假模型並關閉收斂檢測"""
+    workflow = create_workflow(llm=FakeChatModel(latency=0, response_size=result_size, endless=True),
+                               convergence=ConvergenceDetector(threshold=1.1))
+    state = create_initial_state(TASKS[0])
+    state["max_iterations"] = iterations
+    gc.collect()
+    tracemalloc.start()
+    state = workflow(state)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    steps = len(state["agent_sequence"])
+    return {"iterations": steps, "retained_bytes": current, "peak_bytes": peak, "bytes_per_step": current / steps}
+
+
+async def _run_concurrent(workflow, tasks: int, concurrency: int) -> Tuple[float, List[float]]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def run_one(i: int) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            await workflow(create_initial_state(TASKS[i % len(TASKS)]))
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_one(i) for i in range(tasks)))
+    return time.perf_counter() - start, latencies
+
+
+def measure_throughput(fixture: str, levels: List[int], latency: float) -> Dict[str, Any]:
+    workflow = create_async_workflow(llm=ReplayChatModel(fixture=fixture, latency=latency, jitter=0.2))
+    results = {}
+    for level in levels:
+        tasks = max(level * 2, 10)
+        elapsed, latencies = asyncio.run(_run_concurrent(workflow, tasks, level))
+        results[str(level)] = {
+            "tasks": tasks,
+            "tasks_per_second": tasks / elapsed,
+            "p50_latency": percentile(latencies, 50),
+            "p95_latency": percentile(latencies, 95)
+        }
+        DIRECTIONS[f"throughput.{level}.tasks_per_second"] = True
+    return results
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def _flatten(results: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name + "."))
+        elif isinstance(value, (int, float)):
+            flat[name] = value
+    return flat
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """返回超出容忍範圍的回歸指標描述"""
+    current, previous = _flatten(results), _flatten(baseline)
+    regressions = []
+    print(f"\n與基線 {baseline.get('meta', {}).get('commit', '')} 比較：")
+    for name, higher_is_better in DIRECTIONS.items():
+        if name not in current or not previous.get(name):
+            continue
+        change = (current[name] - previous[name]) / previous[name]
+        regressed = change < -tolerance if higher_is_better else change > tolerance
+        print(f"  {name}: {previous[name]:.4g} -> {current[name]:.4g} ({change:+.1%}){'  <- 回歸' if regressed else ''}")
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="離線基準測試套件")
+    parser.add_argument("-o", "--output", default="bench_results.json", help="結果輸出文件")
+    parser.add_argument("--fixture", default=DEFAULT_FIXTURE, help="回放 fixture 文件")
+    parser.add_argument("--overhead-tasks", type=int, default=50, help="測量編排開銷的任務數")
+    parser.add_argument("--iterations", type=int, default=200, help="內存測試的迭代次數")
+    parser.add_argument("--result-size", type=int, default=2000, help="內存測試中每條結果的字符數")
+    parser.add_argument("--levels", type=str, default="1,10,100", help="吞吐量測試的並發級別")
+    parser.add_argument("--latency", type=float, default=0.05, help="吞吐量測試中每次 LLM 調用的延遲（秒）")
+    parser.add_argument("--baseline", help="用於比較的先前結果文件")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允許的相對退化比例")
+    args = parser.parse_args()
+
+    results = {
+        "overhead": measure_overhead(args.fixture, args.overhead_tasks),
+        "memory": measure_memory(args.iterations, args.result_size),
+        "throughput": measure_throughput(args.fixture, [int(x) for x in args.levels.split(",")], args.latency)
+    }
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "args": vars(args)
+        },
+        "results": results
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print(f"編排開銷: {results['overhead']['ms_per_step']:.3f} 毫秒/步（{results['overhead']['steps']} 步）")
+    print(f"狀態內存: {results['memory']['bytes_per_step'] / 1024:.2f} KiB/步，"
+          f"峰值 {results['memory']['peak_bytes'] / 1024:.1f} KiB（{results['memory']['iterations']} 步）")
+    for level, item in results["throughput"].items():
+        print(f"並發 {level:>4}: {item['tasks_per_second']:.2f} 任務/秒，"
+              f"p50 {item['p50_latency']:.3f}秒，p95 {item['p95_latency']:.3f}秒")
+    print(f"結果已寫入 {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(results, baseline["results"], args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+from typing import Any, ContextManager, Dict, List, Optional
+from contextlib import nullcontext
+from agents.deadline import deadline_scope
+import threading
+import time
+
+# 可以跳過或降級的 worker 節點；監督者沒有可替代的決策
+_WORKERS = ("researcher", "analyst")
+
+class NodeBudgets:
+    """每個節點的軟時間預算（秒），讓慢的 agent 在運行的硬截止時間之前讓路
+
+    節點內的 LLM 調用以 min(運行的截止時間, 節點開始時間 + 預算) 為截止時間。
+    worker 節點超出自己的預算時調用被取消，節點記為跳過，運行繼續由監督者決定下一步；
+    監督者超出預算時與運行超時相同，返回目前最好的部分結果。
+    節點開始前運行的剩餘時間已不足其預算時，配置了降級 agent（路由中的 "researcher.fallback" /
+    "analyst.fallback"）則改用降級 agent，否則直接跳過該節點。
+    """
+
+    def __init__(self, budgets: Dict[str, float]):
+        self.budgets = dict(budgets)
+        self._lock = threading.Lock()
+        self.metrics = {"runs": 0, "downgraded": 0, "skipped": 0, "timeouts": 0}
+
+    @classmethod
+    def parse(cls, specs: List[str]) -> "NodeBudgets":
+        """從 "節點=秒數" 形式的字符串列表創建，例如 ["researcher=60", "analyst=45"]"""
+        budgets = {}
+        for spec in specs:
+            node, _, seconds = spec.partition("=")
+            if not seconds:
+                raise ValueError(f"節點預算格式應為 節點=秒數: {spec}")
+            budgets[node.strip()] = float(seconds)
+        return cls(budgets)
+
+    def _record(self, key: str) -> None:
+        with self._lock:
+            self.metrics[key] += 1
+
+    def plan(self, node: str, remaining: Optional[float], has_fallback: bool) -> str:
+        """決定節點的執行方式："run"、"downgrade"（改用降級 agent）或 "skip"（跳過）"""
+        budget = self.budgets.get(node)
+        if node not in _WORKERS or budget is None or remaining is None or remaining >= budget:
+            self._record("runs")
+            return "run"
+        if has_fallback:
+            self._record("downgraded")
+            return "downgrade"
+        self._record("skipped")
+        return "skip"
+
+    def scope(self, node: str) -> ContextManager[None]:
+        """節點執行期間的截止時間範圍"""
+        budget = self.budgets.get(node)
+        if budget is None:
+            return nullcontext()
+        return deadline_scope(time.time() + budget, node)
+
+    def timed_out(self, node: str) -> bool:
+        """記錄節點超出預算；返回該節點是否可以跳過"""
+        self._record("timeouts")
+        return node in _WORKERS
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self.metrics)
+        stats["budgets"] = dict(self.budgets)
+        return stats
@@ -0,0 +1,84 @@
+from typing import Any, Dict, Optional
+import time
+from agents import tracing
+
+class CheckpointStore:
+    """以 SQLite 保存工作流每一步的狀態，使中斷的運行可以從最後完成的步驟繼續
+
+    狀態使用 langgraph-checkpoint 的序列化器（ormsgpack）編碼。
+    """
+
+    def __init__(self, path: str = "checkpoints.sqlite", keep_history: bool = True):
+        from sqlalchemy import Column, Float, Integer, LargeBinary, MetaData, String, Table, create_engine, event
+        from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+        self.keep_history = keep_history
+        self._serde = JsonPlusSerializer()
+        self._engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False, "timeout": 30})
+
+        @event.listens_for(self._engine, "connect")
+        def _set_pragmas(dbapi_connection, _):
+            # WAL 模式下每步寫入不需要等待讀取，並減少 fsync 次數
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.close()
+
+        metadata = MetaData()
+        self._table = Table(
+            "checkpoints", metadata,
+            Column("run_id", String, primary_key=True),
+            Column("step", Integer, primary_key=True),
+            Column("node", String, nullable=False),
+            Column("elapsed", Float, nullable=False),
+            Column("created_at", Float, nullable=False),
+            Column("type", String, nullable=False),
+            Column("data", LargeBinary, nullable=False)
+        )
+        metadata.create_all(self._engine)
+
+    def save(self, run_id: str, state: Dict[str, Any]) -> None:
+        """保存一個節點執行後的狀態"""
+        from sqlalchemy import delete
+        from sqlalchemy.dialects.sqlite import insert
+
+        type_, data = self._serde.dumps_typed(dict(state))
+        tracing.add("checkpoint_bytes", len(data))
+        values = {
+            "run_id": run_id,
+            "step": state["iteration"],
+            "node": state["agent_sequence"][-1] if state["agent_sequence"] else "",
+            # 保存已消耗的時間而非開始時間，恢復後不會把中斷期間計入執行時間
+            "elapsed": time.time() - state["start_time"],
+            "created_at": time.time(),
+            "type": type_,
+            "data": data
+        }
+        table = self._table
+        with self._engine.begin() as conn:
+            if not self.keep_history:
+                conn.execute(delete(table).where(table.c.run_id == run_id))
+            conn.execute(insert(table).values(**values).on_conflict_do_update(
+                index_elements=[table.c.run_id, table.c.step], set_=values))
+
+    def load(self, run_id: str) -> Optional[Dict[str, Any]]:
+        """讀取最新的檢查點，不存在時返回 None"""
+        from sqlalchemy import select
+
+        table = self._table
+        with self._engine.connect() as conn:
+            row = conn.execute(select(table.c.elapsed, table.c.type, table.c.data)
+                               .where(table.c.run_id == run_id)
+                               .order_by(table.c.step.desc()).limit(1)).first()
+        if row is None:
+            return None
+        state = self._serde.loads_typed((row.type, row.data))
+        state["start_time"] = time.time() - row.elapsed
+        return state
+
+    def delete(self, run_id: str) -> None:
+        """刪除某次運行的所有檢查點"""
+        from sqlalchemy import delete
+
+        with self._engine.begin() as conn:
+            conn.execute(delete(self._table).where(self._table.c.run_id == run_id))
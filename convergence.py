@@ -0,0 +1,66 @@
+from typing import Any, Dict, List, Optional
+from agents.similarity import MinHasher, TfidfIndex
+
+class ConvergenceDetector:
+    """以本地相似度判斷工作流是否已收斂，避免把剩餘的迭代浪費在幾乎相同的輸出上
+
+    最近 patience 對相鄰分析結果的相似度都不低於 threshold，且監督者對同一 agent
+    的最近兩次任務分配也不低於 threshold（沒有可比較的分配時忽略）時視為收斂。
+    method 為 "minhash"（字符 shingle 的 Jaccard 估計）或 "tfidf"（TF-IDF 餘弦）。
+    threshold 大於 1 時永不判定收斂。出錯或被跳過的結果（ResultRecord.ok 為 False）不參與比較，
+    其對應的任務分配也不計入，連續的錯誤不會被當作收斂。
+    """
+
+    def __init__(self, threshold: float = 0.9, patience: int = 1, method: str = "minhash",
+                 num_perm: int = 64, shingle_size: int = 3):
+        if method not in ("minhash", "tfidf"):
+            raise ValueError(f"未知的相似度方法: {method}")
+        self.threshold = threshold
+        self.patience = patience
+        self.method = method
+        self._minhash = MinHasher(num_perm=num_perm, k=shingle_size) if method == "minhash" else None
+
+    def similarity(self, a: str, b: str, corpus: Optional[List[str]] = None) -> float:
+        if self._minhash is not None:
+            return self._minhash.similarity(a, b)
+        # TF-IDF 的文檔頻率取自本次運行已有的結果
+        index = TfidfIndex()
+        for text in corpus or [a, b]:
+            index.add(text)
+        return index.similarity(a, b)
+
+    @staticmethod
+    def _valid(results: List[Any]) -> List[Any]:
+        return [result for result in results if getattr(result, "ok", True)]
+
+    def _decision_similarity(self, state: Dict[str, Any]) -> Optional[float]:
+        # 執行失敗的分配（任務或子任務對應的結果出錯或被跳過）不參與比較，重試相同的任務不算收斂
+        failed = {result.task for result in (state.get("research_results") or []) + (state.get("analysis_results") or [])
+                  if not getattr(result, "ok", True)}
+        assignments = [a for a in state.get("task_assignments") or []
+                       if a.get("task") not in failed and not failed.intersection(a.get("subtasks") or [])]
+        if not assignments:
+            return None
+        latest = assignments[-1]
+        previous = next((a for a in reversed(assignments[:-1]) if a.get("agent") == latest.get("agent")), None)
+        if previous is None:
+            return None
+        return self.similarity(latest.get("task", ""), previous.get("task", ""))
+
+    def check(self, state: Dict[str, Any]) -> Optional[float]:
+        """已收斂時返回最低的相似度分數，否則返回 None"""
+        if self.threshold > 1:
+            return None
+        analyses = [str(result) for result in self._valid(state.get("analysis_results") or [])[-(self.patience + 1):]]
+        if len(analyses) < self.patience + 1:
+            return None
+        corpus = None
+        if self._minhash is None:
+            corpus = [str(result) for result in self._valid(state.get("research_results") or [])] + \
+                     [str(result) for result in self._valid(state.get("analysis_results") or [])]
+        scores = [self.similarity(a, b, corpus) for a, b in zip(analyses, analyses[1:])]
+        decision = self._decision_similarity(state)
+        if decision is not None:
+            scores.append(decision)
+        score = min(scores)
+        return score if score >= self.threshold else None
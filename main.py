@@ -1,24 +1,30 @@
 from typing import Dict, List, Any, TypedDict
+import argparse
 import logging
 from dotenv import load_dotenv
 import time
 from datetime import datetime
 import json
 import os
-from workflow import create_workflow, create_initial_state
 
 # 加載環境變量
 load_dotenv()
 
-# 檢查 API key
-if not os.getenv("OPENAI_API_KEY"):
-    raise ValueError("請在 .env 文件中設置 OPENAI_API_KEY 環境變量")
-
 # 設置日誌
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 def main():
+    parser = argparse.ArgumentParser(description="以互動方式運行多Agent工作流")
+    parser.add_argument("--rpm", type=float, help="每分鐘 LLM 請求數上限，指定任一限額時啟用調度器（限速、退避重試與自適應並發）")
+    parser.add_argument("--tpm", type=float, help="每分鐘 token 數上限")
+    parser.add_argument("--max-concurrency", type=int, help="同時進行的 LLM 請求數上限")
+    args = parser.parse_args()
+
+    # 檢查 API key（放在運行時而非導入時，使其他模組可以導入本文件）
+    if not os.getenv("OPENAI_API_KEY"):
+        raise ValueError("請在 .env 文件中設置 OPENAI_API_KEY 環境變量")
+
     # 獲取用戶輸入的任務
     print("\n=== 多Agent系統 ===")
     print("請輸入您想要分析的任務（輸入 'quit' 退出）：")
@@ -34,8 +40,15 @@ def main():
         print("程序已退出")
         return
     
-    # 創建工作流
-    workflow = create_workflow()
+    # 工作流與 langchain 相關模組在用戶輸入任務後才加載，使提示即時出現
+    from agents.routing import load_router
+    from agents.scheduler import build_scheduler
+    from archive import RunArchive, StepRecorder
+    from workflow import get_workflow, create_initial_state, stream_workflow
+
+    # 創建工作流（設置了 MODEL_ROUTES 時按角色選擇模型，指定了限額時經過調度器）
+    workflow = get_workflow(router=load_router(),
+                            scheduler=build_scheduler(args.rpm, args.tpm, args.max_concurrency))
     
     # 創建初始狀態
     initial_state = create_initial_state(task)
@@ -43,13 +56,31 @@ def main():
     # 執行工作流
     print("\n開始執行工作流...")
     try:
-        # 直接調用工作流函數
-        final_state = workflow(initial_state)
+        # 以流式方式執行工作流，邊生成邊輸出
+        final_state = None
+        recorder = StepRecorder()
+        for event in stream_workflow(workflow, initial_state):
+            recorder(event)
+            if event["type"] == "node_start":
+                print(f"\n\n--- {event['node']}（迭代 {event['iteration']}）---")
+            elif event["type"] == "token":
+                print(event["content"], end="", flush=True)
+            elif event["type"] == "end":
+                final_state = event["state"]
+            elif event["type"] == "error":
+                raise RuntimeError(event["error"])
         
         if final_state is None:
             print("\n工作流執行失敗，未返回最終狀態")
             return
         
+        # 保存本次運行的步驟與最終狀態（RUN_ARCHIVE 設為空字符串時不保存）
+        archive_path = os.getenv("RUN_ARCHIVE", "runs.zst")
+        if archive_path:
+            run_id = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+            RunArchive(archive_path).write_run(run_id, recorder.steps, final_state, {"task": task})
+            print(f"\n運行記錄已保存到 {archive_path}（運行ID: {run_id}）")
+        
         # 整理並顯示最終結果
         print("\n" + "="*50)
         print("最終分析報告".center(50))
@@ -60,7 +91,7 @@ def main():
         print(f"總迭代次數: {len(final_state['agent_sequence'])}")
         print(f"總研究次數: {len(final_state['research_results'])}")
         print(f"總分析次數: {len(final_state['analysis_results'])}")
-        print(f"總執行時間: {sum(float(info['execution_time'].replace('秒', '')) for info in final_state['execution_times']):.2f}秒")
+        print(f"總執行時間: {sum(info.execution_time for info in final_state['execution_times']):.2f}秒")
         
         # 2. 執行順序
         print("\n【執行順序】")
@@ -91,10 +122,12 @@ def main():
         
         print("\n【執行時間記錄】")
         for info in final_state['execution_times']:
-            print(f"\n步驟 {info['iteration']}:")
-            print(f"Agent: {info['agent']}")
-            print(f"開始時間: {info['start_time']}")
-            print(f"執行時間: {info['execution_time']}")
+            print(f"\n步驟 {info.iteration}:")
+            print(f"Agent: {info.agent}")
+            print(f"開始時間: {info.start_time}")
+            print(f"執行時間: {info.execution_time:.2f}秒")
+            for branch in info.branches or []:
+                print(f"  分支 {branch.branch}: {branch.task} ({branch.execution_time:.2f}秒)")
         
         print("\n【研究結果】")
         for i, research in enumerate(final_state['research_results'], 1):
@@ -0,0 +1,219 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from collections import Counter, OrderedDict, defaultdict
+from agents.records import ResultRecord
+from agents.similarity import TfidfIndex, tokenize
+from agents.tracing import get_tracer
+import asyncio
+import itertools
+import math
+import threading
+import time
+
+ResearchFn = Callable[[Dict[str, Any], Optional[Callable[[str], None]]], Dict[str, Any]]
+AsyncResearchFn = Callable[[Dict[str, Any], Optional[Callable[[str], None]]], Awaitable[Dict[str, Any]]]
+
+class _Entry:
+    __slots__ = ("task", "content", "counts", "norm", "run", "created", "paragraphs")
+
+    def __init__(self, task: str, content: str, counts: Counter, run: Tuple[Any, Any]):
+        self.task = task
+        self.content = content
+        # 任務描述的詞頻在寫入時計算一次，查找時只需按當前的 IDF 加權
+        self.counts = counts
+        # (計算時的 IDF 表, 向量長度)，IDF 表不變時直接重用
+        self.norm: Tuple[Any, float] = (None, 0.0)
+        self.run = run
+        self.created = time.time()
+        # 精簡重用時各段落的 (文本, 詞頻)，第一次精簡時計算
+        self.paragraphs: Optional[List[Tuple[str, Counter]]] = None
+
+class ResearchStore:
+    """跨任務共享的研究結果：以分派給研究員的任務描述的 TF-IDF 向量做最近鄰查找
+
+    相似度不低於 threshold 時直接重用之前的研究結果；設置了 condense_threshold 時，
+    相似度介於兩者之間的結果只保留與新任務最相關的段落（不超過 condense_chars 個字符）後重用。
+    兩者都不調用 LLM。候選結果經倒排索引篩選（至少共享一個詞），再以寫入時快取的詞頻計算餘弦相似度。
+    最多保留 max_entries 條結果，按最近使用順序淘汰；設置 ttl（秒）時過期的結果不再重用。
+    同一次運行中的結果默認不重用，監督者再次分派相似的研究通常是需要新的信息。
+    """
+
+    def __init__(self, threshold: float = 0.8, condense_threshold: Optional[float] = None,
+                 max_entries: int = 1000, ttl: Optional[float] = None, condense_chars: int = 1500,
+                 reuse_within_run: bool = False):
+        self.threshold = threshold
+        self.condense_threshold = condense_threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.condense_chars = condense_chars
+        self.reuse_within_run = reuse_within_run
+        self._index = TfidfIndex()
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        # 詞 -> {結果鍵: 該詞在任務描述中的詞頻}
+        self._postings: Dict[str, Dict[int, int]] = defaultdict(dict)
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self.metrics = {"lookups": 0, "reused": 0, "condensed": 0, "misses": 0, "stored": 0, "evicted": 0,
+                        "research_seconds": 0.0, "saved_seconds": 0.0}
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    @staticmethod
+    def _run(state: Dict[str, Any]) -> Tuple[Any, Any]:
+        # 狀態沒有運行ID，以原始任務與開始時間區分不同的運行
+        return state.get("original_task"), state.get("start_time")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.metrics)
+            stats["entries"] = len(self._entries)
+        hits = stats["reused"] + stats["condensed"]
+        stats["reuse_rate"] = hits / stats["lookups"] if stats["lookups"] else 0.0
+        return stats
+
+    # 查找與寫入
+
+    def _remove(self, key: int) -> None:
+        entry = self._entries.pop(key)
+        for term in entry.counts:
+            postings = self._postings[term]
+            postings.pop(key, None)
+            if not postings:
+                del self._postings[term]
+        self._index.remove(entry.task)
+
+    def lookup(self, task: str, state: Optional[Dict[str, Any]] = None) -> Optional[Tuple[_Entry, float]]:
+        """返回最相似的 (結果, 相似度)，低於可重用的閾值時返回 None"""
+        minimum = min(self.threshold, self.condense_threshold if self.condense_threshold is not None else self.threshold)
+        run = self._run(state or {})
+        query = self._index.vector(task)
+        idf, unseen = self._index.idf()
+        # 沿倒排列表累加點積，只有共享詞的候選才會出現
+        dots: Dict[int, float] = defaultdict(float)
+        with self._lock:
+            for term, weight in query.items():
+                weight *= idf.get(term, unseen)
+                for key, count in self._postings.get(term, {}).items():
+                    dots[key] += weight * count
+            entries = [(key, self._entries[key], dot) for key, dot in dots.items()]
+        best, best_key, best_score = None, None, minimum
+        now = time.time()
+        for key, entry, dot in entries:
+            if self.ttl is not None and now - entry.created > self.ttl:
+                continue
+            if not self.reuse_within_run and entry.run == run:
+                continue
+            table, norm = entry.norm
+            if table is not idf:
+                norm = math.sqrt(sum((count * idf.get(term, unseen)) ** 2 for term, count in entry.counts.items()))
+                entry.norm = (idf, norm)
+            score = dot / norm if norm else 0.0
+            if score >= best_score:
+                best, best_key, best_score = entry, key, score
+        if best is None:
+            return None
+        with self._lock:
+            if best_key in self._entries:
+                self._entries.move_to_end(best_key)
+        return best, best_score
+
+    def add(self, task: str, content: str, state: Optional[Dict[str, Any]] = None) -> None:
+        if not task or not content:
+            return
+        counts = Counter(tokenize(task))
+        if not counts:
+            return
+        self._index.add(task)
+        with self._lock:
+            key = next(self._ids)
+            self._entries[key] = _Entry(task, content, counts, self._run(state or {}))
+            for term, count in counts.items():
+                self._postings[term][key] = count
+            self.metrics["stored"] += 1
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.metrics["evicted"] += 1
+
+    def condense(self, entry: _Entry, task: str) -> str:
+        """保留與任務最相關的段落（維持原有順序），總長度不超過 condense_chars"""
+        if entry.paragraphs is None:
+            entry.paragraphs = [(line, Counter(tokenize(line))) for line in entry.content.split("\n") if line.strip()]
+        paragraphs = entry.paragraphs
+        query = self._index.vector(task)
+        ranked = sorted(range(len(paragraphs)),
+                        key=lambda i: self._index.cosine(query, self._index.weigh(paragraphs[i][1])), reverse=True)
+        kept, used = [], 0
+        for index in ranked:
+            if used + len(paragraphs[index][0]) > self.condense_chars and kept:
+                break
+            kept.append(index)
+            used += len(paragraphs[index][0])
+        return "\n".join(paragraphs[index][0] for index in sorted(kept))
+
+    # 包裝研究員
+
+    def _reuse(self, state: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        task = state.get("current_task", "")
+        with get_tracer().span("research_store", "store") as span:
+            match = self.lookup(task, state)
+            with self._lock:
+                self.metrics["lookups"] += 1
+                if match is None:
+                    self.metrics["misses"] += 1
+                    span.attributes["hit"] = False
+                    return None
+                entry, score = match
+                condensed = score < self.threshold
+                self.metrics["condensed" if condensed else "reused"] += 1
+                # 以未命中時研究調用的平均耗時估計節省的時間
+                research_calls = self.metrics["misses"]
+                if research_calls:
+                    self.metrics["saved_seconds"] += self.metrics["research_seconds"] / research_calls
+            span.attributes.update(hit=True, similarity=score, condensed=condensed)
+        if condensed:
+            content = f"（摘自相似任務「{entry.task}」的研究結果，相似度 {score:.2f}）\n{self.condense(entry, task)}"
+        else:
+            content = f"（重用相似任務「{entry.task}」的研究結果，相似度 {score:.2f}）\n{entry.content}"
+        return {
+            "research_results": [ResultRecord("researcher", state.get("iteration", 1), content, task)],
+            "current_agent": "researcher",
+            "next_agent": "supervisor"
+        }
+
+    def _store(self, state: Dict[str, Any], result: Dict[str, Any], elapsed: float) -> None:
+        with self._lock:
+            self.metrics["research_seconds"] += elapsed
+        for record in result.get("research_results") or []:
+            # 出錯或被跳過的結果不存入共享存儲
+            if not record.ok:
+                continue
+            self.add(record.task or state.get("current_task", ""), record.content, state)
+
+    def wrap(self, research: ResearchFn) -> ResearchFn:
+        """包裝 ResearcherAgent.research：先查找可重用的結果，未命中時調用研究員並存儲結果"""
+        def run(state: Dict[str, Any], on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+            reused = self._reuse(state)
+            if reused is not None:
+                if on_token is not None:
+                    on_token(reused["research_results"][0].content)
+                return reused
+            start = time.perf_counter()
+            result = research(state, on_token)
+            self._store(state, result, time.perf_counter() - start)
+            return result
+        return run
+
+    def awrap(self, research: AsyncResearchFn) -> AsyncResearchFn:
+        """wrap 的非同步版本，包裝 ResearcherAgent.aresearch；查找在線程中執行，不阻塞事件循環"""
+        async def run(state: Dict[str, Any], on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+            reused = await asyncio.to_thread(self._reuse, state)
+            if reused is not None:
+                if on_token is not None:
+                    on_token(reused["research_results"][0].content)
+                return reused
+            start = time.perf_counter()
+            result = await research(state, on_token)
+            self._store(state, result, time.perf_counter() - start)
+            return result
+        return run
@@ -0,0 +1,376 @@
+from typing import TYPE_CHECKING, Dict, Any, List, Optional, Tuple
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from agents.cache import ResponseCache, SQLiteCache
+from agents.records import json_default
+from agents.routing import ModelRouter, load_router
+from agents.scheduler import LLMScheduler, build_scheduler
+from archive import RunArchive, StepRecorder
+from budgets import NodeBudgets
+from dotenv import load_dotenv
+import argparse
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from workflow import get_workflow, create_initial_state, run_with_events
+
+if TYPE_CHECKING:
+    from langchain_core.language_models import BaseChatModel
+
+# 加載環境變量
+load_dotenv()
+
+# 設置日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class QueueFullError(Exception):
+    """任務隊列已滿，調用方應稍後重試"""
+
+class Job:
+    """一個提交到服務的工作流任務
+
+    events 只保留節點級事件（node_start、node_end、state_delta），任務結束後仍可回放；
+    token 事件只推送給當前連接的 SSE 訂閱者，沒有訂閱者時 agent 不以流式調用模型。
+    """
+
+    def __init__(self, task: str, timeout: float, max_iterations: Optional[int] = None):
+        self.id = uuid.uuid4().hex
+        self.task = task
+        self.timeout = timeout
+        self.max_iterations = max_iterations
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.state: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.events: List[Dict[str, Any]] = []
+        # 每個訂閱者尚未讀取的事件（包括 token 事件）
+        self._subscribers: List[List[Dict[str, Any]]] = []
+        self._cond = threading.Condition()
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("completed", "failed")
+
+    @property
+    def streaming(self) -> bool:
+        """是否有 SSE 訂閱者需要 token 事件，每次 LLM 調用開始時檢查"""
+        return bool(self._subscribers)
+
+    def add_event(self, event: Dict[str, Any]) -> None:
+        with self._cond:
+            if event["type"] != "token":
+                self.events.append(event)
+            for pending in self._subscribers:
+                pending.append(event)
+            self._cond.notify_all()
+
+    def subscribe(self) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """返回 (已發生的節點事件, 之後的事件緩衝)，讀取結束後以 unsubscribe 釋放緩衝"""
+        with self._cond:
+            pending: List[Dict[str, Any]] = []
+            self._subscribers.append(pending)
+            return list(self.events), pending
+
+    def unsubscribe(self, pending: List[Dict[str, Any]]) -> None:
+        with self._cond:
+            self._subscribers = [p for p in self._subscribers if p is not pending]
+
+    def finish(self, status: str, state: Optional[Dict[str, Any]] = None, error: Optional[str] = None) -> None:
+        with self._cond:
+            self.status = status
+            self.state = state
+            self.error = error
+            self.finished_at = time.time()
+            self._cond.notify_all()
+
+    def wait_events(self, pending: List[Dict[str, Any]], timeout: float) -> Tuple[List[Dict[str, Any]], bool]:
+        """取出訂閱者緩衝中的事件以及任務是否已結束，沒有新事件時最多等待 timeout 秒"""
+        with self._cond:
+            if not pending and not self.done:
+                self._cond.wait(timeout)
+            events = pending[:]
+            pending.clear()
+            return events, self.done
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        with self._cond:
+            return self._cond.wait_for(lambda: self.done, timeout)
+
+    def summary(self) -> Dict[str, Any]:
+        state = self.state or {}
+        now = self.finished_at or time.time()
+        return {
+            "job_id": self.id,
+            "task": self.task,
+            "status": self.status,
+            "created_at": self.created_at,
+            "queue_seconds": (self.started_at or now) - self.created_at,
+            "run_seconds": now - self.started_at if self.started_at else 0.0,
+            "agent_sequence": state.get("agent_sequence", []),
+            "final_decision": state.get("final_decision", ""),
+            "error": self.error
+        }
+
+class WorkflowService:
+    """有界任務隊列與工作線程池，所有任務共用同一個工作流（agents 只構建一次）
+
+    隊列滿時 submit() 拋出 QueueFullError；每個任務的超時映射到狀態的 max_execution_time，
+    超時時進行中的 LLM 調用被取消，任務以部分結果完成。
+    已結束的任務最多保留 max_finished 個，超出時按完成順序淘汰。
+    """
+
+    def __init__(self, workers: int = 4, queue_size: int = 64, default_timeout: float = 600,
+                 max_timeout: float = 3600, max_finished: int = 1000,
+                 llm: Optional["BaseChatModel"] = None, cache: Optional[ResponseCache] = None,
+                 router: Optional[ModelRouter] = None, archive: Optional[RunArchive] = None,
+                 budgets: Optional[NodeBudgets] = None, scheduler: Optional[LLMScheduler] = None):
+        self.router = router
+        self.archive = archive
+        self.budgets = budgets
+        self.scheduler = scheduler
+        self.workflow = get_workflow(llm=llm, cache=cache, scheduler=scheduler, router=router, budgets=budgets)
+        self.default_timeout = default_timeout
+        self.max_timeout = max_timeout
+        self.max_finished = max_finished
+        self._queue: "queue.Queue[Optional[Job]]" = queue.Queue(maxsize=queue_size)
+        self._jobs: Dict[str, Job] = {}
+        self._finished: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.metrics = {"submitted": 0, "rejected": 0, "completed": 0, "failed": 0}
+        self._threads = [threading.Thread(target=self._worker, daemon=True, name=f"workflow-worker-{i}")
+                         for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, task: str, timeout: Optional[float] = None, max_iterations: Optional[int] = None) -> Job:
+        job = Job(task, min(timeout or self.default_timeout, self.max_timeout), max_iterations)
+        with self._lock:
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                self.metrics["rejected"] += 1
+                raise QueueFullError("任務隊列已滿")
+            self._jobs[job.id] = job
+            self.metrics["submitted"] += 1
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _worker(self) -> None:
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            self._run(job)
+
+    def _run(self, job: Job) -> None:
+        job.status = "running"
+        job.started_at = time.time()
+        state = create_initial_state(job.task)
+        # 排隊時間不計入任務的執行時間預算
+        state["max_execution_time"] = job.timeout
+        if job.max_iterations:
+            state["max_iterations"] = job.max_iterations
+        try:
+            if self.archive is None:
+                final_state = run_with_events(self.workflow, state, job.add_event, tokens=lambda: job.streaming)
+            else:
+                recorder = StepRecorder(forward=job.add_event)
+                final_state = run_with_events(self.workflow, state, recorder, tokens=lambda: job.streaming)
+                self.archive.write_run(job.id, recorder.steps, final_state, {"task": job.task})
+            job.finish("completed", final_state)
+        except Exception as e:
+            logger.error(f"任務 {job.id} 執行錯誤: {str(e)}", exc_info=True)
+            job.finish("failed", error=str(e))
+        with self._lock:
+            self.metrics[job.status] += 1
+            self._finished[job.id] = None
+            while len(self._finished) > self.max_finished:
+                evicted, _ = self._finished.popitem(last=False)
+                self._jobs.pop(evicted, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.metrics)
+            stats["queued"] = self._queue.qsize()
+            stats["queue_size"] = self._queue.maxsize
+            stats["running"] = sum(1 for job in self._jobs.values() if job.status == "running")
+            stats["workers"] = len(self._threads)
+        if self.router is not None:
+            stats["routes"] = self.router.stats()
+        if self.archive is not None:
+            stats["archive"] = self.archive.stats()
+        if self.budgets is not None:
+            stats["budgets"] = self.budgets.stats()
+        if self.scheduler is not None:
+            stats["scheduler"] = self.scheduler.stats()
+        return stats
+
+    def shutdown(self) -> None:
+        """等待已排隊的任務完成後停止工作線程"""
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+def _handler(service: WorkflowService, retry_after: int = 5):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format: str, *args: Any) -> None:
+            logger.debug(format, *args)
+
+        def _send_json(self, status: int, payload: Any, headers: Optional[Dict[str, str]] = None) -> None:
+            data = json.dumps(payload, ensure_ascii=False, default=json_default).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _job(self, job_id: str) -> Optional[Job]:
+            job = service.get(job_id)
+            if job is None:
+                self._send_json(404, {"error": f"任務 {job_id} 不存在"})
+            return job
+
+        def do_POST(self) -> None:
+            if urlparse(self.path).path != "/jobs":
+                self._send_json(404, {"error": "未知的路徑"})
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                task = body["task"].strip()
+                if not task:
+                    raise ValueError("task 不能為空")
+                timeout = float(body["timeout"]) if body.get("timeout") is not None else None
+                max_iterations = int(body["max_iterations"]) if body.get("max_iterations") is not None else None
+            except (KeyError, TypeError, ValueError, AttributeError) as e:
+                self._send_json(400, {"error": f"無效的請求: {str(e)}"})
+                return
+            try:
+                job = service.submit(task, timeout, max_iterations)
+            except QueueFullError as e:
+                self._send_json(429, {"error": str(e)}, {"Retry-After": str(retry_after)})
+                return
+            self._send_json(202, {"job_id": job.id, "status": job.status}, {"Location": f"/jobs/{job.id}"})
+
+        def do_GET(self) -> None:
+            url = urlparse(self.path)
+            parts = [part for part in url.path.split("/") if part]
+            if parts == ["health"]:
+                self._send_json(200, service.stats())
+            elif len(parts) == 2 and parts[0] == "jobs":
+                job = self._job(parts[1])
+                if job is not None:
+                    self._send_json(200, job.summary())
+            elif len(parts) == 3 and parts[0] == "jobs" and parts[2] == "result":
+                job = self._job(parts[1])
+                if job is None:
+                    return
+                query = parse_qs(url.query)
+                # 可用 ?wait=秒數 長輪詢等待任務結束
+                if "wait" in query:
+                    job.wait(min(float(query["wait"][0]), 60))
+                if not job.done:
+                    self._send_json(202, job.summary())
+                elif job.status == "failed":
+                    self._send_json(500, job.summary())
+                else:
+                    self._send_json(200, job.state)
+            elif len(parts) == 3 and parts[0] == "jobs" and parts[2] == "events":
+                job = self._job(parts[1])
+                if job is not None:
+                    self._stream_events(job)
+            else:
+                self._send_json(404, {"error": "未知的路徑"})
+
+        def _stream_events(self, job: Job) -> None:
+            """以 Server-Sent Events 推送任務事件，任務結束後發送 end 事件並關閉連接
+
+            先回放已發生的節點事件，之後推送新的節點與 token 事件（連接之前的 token 不保留）。
+            """
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            events, pending = job.subscribe()
+            try:
+                done = False
+                while True:
+                    for event in events:
+                        data = json.dumps(event, ensure_ascii=False, default=json_default)
+                        self.wfile.write(f"event: {event['type']}\ndata: {data}\n\n".encode("utf-8"))
+                    if done:
+                        data = json.dumps(job.summary(), ensure_ascii=False, default=json_default)
+                        self.wfile.write(f"event: end\ndata: {data}\n\n".encode("utf-8"))
+                        return
+                    if not events:
+                        # 保持連接活躍
+                        self.wfile.write(b": keep-alive\n\n")
+                    self.wfile.flush()
+                    events, done = job.wait_events(pending, timeout=15)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                job.unsubscribe(pending)
+
+    return Handler
+
+def create_server(service: WorkflowService, host: str = "127.0.0.1", port: int = 8000) -> ThreadingHTTPServer:
+    """創建 HTTP 服務（尚未開始監聽循環），port 為 0 時使用隨機端口"""
+    return _Server((host, port), _handler(service))
+
+def main():
+    parser = argparse.ArgumentParser(description="以 HTTP 服務方式運行多Agent工作流")
+    parser.add_argument("--host", default="127.0.0.1", help="監聽地址")
+    parser.add_argument("--port", type=int, default=8000, help="監聽端口")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="工作線程數")
+    parser.add_argument("--queue-size", type=int, default=64, help="任務隊列長度，隊列滿時返回 429")
+    parser.add_argument("--timeout", type=float, default=600, help="默認的任務超時（秒）")
+    parser.add_argument("--max-timeout", type=float, default=3600, help="允許請求設置的最大超時（秒）")
+    parser.add_argument("--cache", help="SQLite 回應快取文件路徑，不指定則不使用快取")
+    parser.add_argument("--routes", help="模型路由配置（JSON 文件，或 \"tiered\" 使用內置分層配置），默認讀取 MODEL_ROUTES")
+    parser.add_argument("--archive", help="運行歸檔文件路徑，保存已完成任務的步驟增量與最終狀態")
+    parser.add_argument("--node-budget", action="append", default=[], metavar="節點=秒數",
+                        help="節點的軟時間預算，可重複指定，例如 --node-budget analyst=60")
+    parser.add_argument("--rpm", type=float, help="每分鐘 LLM 請求數上限，指定任一限額時啟用調度器（限速、退避重試與自適應並發）")
+    parser.add_argument("--tpm", type=float, help="每分鐘 token 數上限")
+    parser.add_argument("--max-concurrency", type=int, help="同時進行的 LLM 請求數上限")
+    args = parser.parse_args()
+
+    # 檢查 API key
+    if not os.getenv("OPENAI_API_KEY"):
+        raise ValueError("請在 .env 文件中設置 OPENAI_API_KEY 環境變量")
+
+    service = WorkflowService(args.workers, args.queue_size, args.timeout, args.max_timeout,
+                              cache=SQLiteCache(args.cache) if args.cache else None,
+                              router=load_router(args.routes),
+                              archive=RunArchive(args.archive) if args.archive else None,
+                              budgets=NodeBudgets.parse(args.node_budget) if args.node_budget else None,
+                              scheduler=build_scheduler(args.rpm, args.tpm, args.max_concurrency))
+    server = create_server(service, args.host, args.port)
+    print(f"服務已啟動: http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n正在停止服務...")
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from concurrent.futures import Future, ProcessPoolExecutor
+from agents.records import json_default
+from agents.tracing import get_tracer
+import asyncio
+import json
+import os
+import threading
+import time
+
+Shard = List[Tuple[str, str]]
+WorkflowFactory = Callable[[], Callable[..., Any]]
+
+# 每個工作進程內的工作流與事件循環，由 _init_worker 在進程啟動時創建
+_workflow: Optional[Callable[..., Any]] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_concurrency = 1
+
+def default_workflow_factory() -> Callable[..., Any]:
+    """工作進程默認使用的工作流：默認配置的共享非同步工作流"""
+    from workflow import get_async_workflow
+    return get_async_workflow()
+
+def _init_worker(workflow_factory: WorkflowFactory, concurrency: int) -> None:
+    global _workflow, _loop, _concurrency
+    # 進程啟動時預先構建 agents，之後每個分片都重用同一個工作流與事件循環
+    _workflow = workflow_factory()
+    _loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(_loop)
+    _concurrency = concurrency
+
+def _worker_stats() -> Dict[str, Any]:
+    agents = getattr(_workflow, "agents", None) or {}
+    supervisor = agents.get("supervisor")
+    return {
+        "pid": os.getpid(),
+        "decisions": supervisor.decision_stats() if supervisor is not None else None,
+        "llm_usage": get_tracer().totals("llm")
+    }
+
+def _run_shard(shard: Shard) -> Dict[str, Any]:
+    """在工作進程中以非同步工作流執行一個分片
+
+    最終狀態在工作進程內序列化為輸出行，只把輸出行與少量統計數據傳回主進程。
+    """
+    from workflow import create_initial_state
+    semaphore = asyncio.Semaphore(_concurrency)
+
+    async def run_one(task_id: str, task: str) -> Tuple[str, str, float]:
+        async with semaphore:
+            start = time.perf_counter()
+            # 以任務ID作為運行ID，中斷的任務可從最後完成的步驟繼續
+            state = await _workflow(create_initial_state(task), task_id)
+            latency = time.perf_counter() - start
+        record = {"task_id": task_id, "task": task, "latency": latency, "state": state}
+        return task_id, json.dumps(record, ensure_ascii=False, default=json_default), latency
+
+    async def run_all() -> List[Any]:
+        return await asyncio.gather(*(run_one(task_id, task) for task_id, task in shard), return_exceptions=True)
+
+    records, failed = [], []
+    for (task_id, _), outcome in zip(shard, _loop.run_until_complete(run_all())):
+        if isinstance(outcome, BaseException):
+            failed.append((task_id, f"{type(outcome).__name__}: {outcome}"))
+        else:
+            records.append(outcome)
+    return {"records": records, "failed": failed, **_worker_stats()}
+
+def merge_worker_stats(snapshots: Dict[int, Dict[str, Any]]) -> Dict[str, Any]:
+    """合併各工作進程最新的累計統計（決策統計與 LLM 用量）"""
+    decisions: Dict[str, Any] = {}
+    usage: Dict[str, float] = {}
+    for snapshot in snapshots.values():
+        for key, value in (snapshot.get("decisions") or {}).items():
+            if not key.endswith("_rate"):
+                decisions[key] = decisions.get(key, 0) + value
+        for key, value in (snapshot.get("llm_usage") or {}).items():
+            usage[key] = usage.get(key, 0) + value
+    if decisions:
+        # 比率需要按合併後的計數重新計算
+        decisions["parse_failure_rate"] = decisions["parse_failures"] / decisions["decisions"] if decisions["decisions"] else 0.0
+        decisions["repair_rate"] = decisions["repaired"] / decisions["parse_failures"] if decisions["parse_failures"] else 0.0
+        decisions["escalation_rate"] = decisions["escalations"] / decisions["decisions"] if decisions["decisions"] else 0.0
+    return {"decisions": decisions or None, "llm_usage": usage}
+
+class ShardPool:
+    """把任務分片分發到多個工作進程，每個進程以自己的非同步事件循環執行工作流
+
+    workflow_factory 在每個工作進程啟動時調用一次（必須可被 pickle，例如模組級函數或 functools.partial），
+    每個進程內最多同時執行 concurrency 個任務。resize() 以新的進程池接收之後提交的分片，
+    舊進程池在已提交的分片全部完成後才退出，不會丟失在途任務；request_resize() 則延遲到下一次提交時生效。
+    """
+
+    def __init__(self, workers: int, concurrency: int = 8,
+                 workflow_factory: WorkflowFactory = default_workflow_factory):
+        self.concurrency = concurrency
+        self.workflow_factory = workflow_factory
+        self._lock = threading.Lock()
+        self._workers = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._retired: List[ProcessPoolExecutor] = []
+        self._requested: Optional[int] = None
+        self.metrics = {"shards": 0, "resizes": 0}
+        self.resize(workers)
+
+    @property
+    def workers(self) -> int:
+        return self._workers
+
+    def resize(self, workers: int) -> None:
+        """調整工作進程數；已提交到舊進程池的分片會繼續執行到完成"""
+        workers = max(1, workers)
+        with self._lock:
+            if workers == self._workers:
+                return
+            old = self._executor
+            self._executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                                 initargs=(self.workflow_factory, self.concurrency))
+            self._workers = workers
+            if old is not None:
+                self.metrics["resizes"] += 1
+                old.shutdown(wait=False)
+                self._retired.append(old)
+
+    def request_resize(self, workers: int) -> None:
+        """在下一次提交分片時調整進程數，可在信號處理函數中調用"""
+        self._requested = workers
+
+    def submit(self, shard: Shard) -> "Future[Dict[str, Any]]":
+        requested, self._requested = self._requested, None
+        if requested is not None:
+            self.resize(requested)
+        with self._lock:
+            self.metrics["shards"] += 1
+            return self._executor.submit(_run_shard, shard)
+
+    def close(self) -> None:
+        with self._lock:
+            executors = self._retired + [self._executor]
+            self._retired = []
+        for executor in executors:
+            if executor is not None:
+                executor.shutdown(wait=True)
+
+    def __enter__(self) -> "ShardPool":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
@@ -0,0 +1,230 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import copy_context
+from agents.tracing import get_tracer
+import asyncio
+import json
+import re
+import threading
+import time
+
+_WORKERS = ("researcher", "analyst")
+_RESULT_FIELDS = {"researcher": "research_results", "analyst": "analysis_results"}
+
+# 監督者 JSON 決策中已完整輸出的字段（字符串以未轉義的引號結束後才算完整）
+_NEXT_AGENT = re.compile(r'"next_agent"\s*:\s*"(researcher|analyst|end)"')
+_TASK = re.compile(r'"task"\s*:\s*"((?:[^"\\]|\\.)*)"')
+_SUBTASKS = re.compile(r'"subtasks"\s*:\s*(\[(?:[^\]"]|"(?:[^"\\]|\\.)*")*\])')
+
+def parse_partial_decision(text: str) -> Optional[Tuple[str, str]]:
+    """從監督者尚未輸出完的決策中取出 (next_agent, task)，兩者未完整輸出時返回 None"""
+    agent, task = _NEXT_AGENT.search(text), _TASK.search(text)
+    if agent is None or task is None:
+        return None
+    try:
+        return agent.group(1), json.loads(f'"{task.group(1)}"')
+    except json.JSONDecodeError:
+        return None
+
+def parse_partial_subtasks(text: str) -> Optional[List[str]]:
+    """取出已完整輸出的 subtasks 列表，尚未輸出時返回 None"""
+    match = _SUBTASKS.search(text)
+    if match is None:
+        return None
+    try:
+        return json.loads(match.group(1))
+    except json.JSONDecodeError:
+        return None
+
+class PendingSpeculation:
+    """一次正在執行的推測調用"""
+    __slots__ = ("agent", "task", "handle", "duration")
+
+    def __init__(self, agent: str, task: str):
+        self.agent = agent
+        # 從監督者流式輸出中解析出的任務描述
+        self.task = task
+        self.handle: Any = None
+        self.duration = 0.0
+
+class DecisionWatcher:
+    """作為監督者的 token 回調，決策中的 next_agent 與 task 一輸出完就啟動對應的 worker
+
+    監督者的其餘輸出（is_complete、final_decision、confidence 等）與解析、驗證都和 worker 重疊執行。
+    啟動研究員後繼續監聽：決策把研究拆分為多個子任務時立即放棄推測調用。
+    每次監督者節點只推測一次，決策重試或升級時沿用第一次啟動的調用，由 Speculator.resolve 判斷是否命中。
+    """
+
+    def __init__(self, launch: Callable[[str, str], Optional[PendingSpeculation]],
+                 abandon: Callable[[PendingSpeculation], None]):
+        self._launch = launch
+        self._abandon = abandon
+        self._text = ""
+        self._started = False
+        self._done = False
+        self.pending: Optional[PendingSpeculation] = None
+
+    def __call__(self, chunk: str) -> None:
+        if self._done:
+            return
+        self._text += chunk
+        if not self._started:
+            decision = parse_partial_decision(self._text)
+            if decision is None:
+                return
+            self._started = True
+            agent, task = decision
+            if agent not in _WORKERS:
+                self._done = True
+                return
+            self.pending = self._launch(agent, task)
+            if self.pending is None or agent != "researcher":
+                self._done = True
+                return
+        subtasks = parse_partial_subtasks(self._text)
+        if subtasks is None:
+            return
+        self._done = True
+        if len(subtasks) > 1:
+            self._abandon(self.pending)
+            self.pending = None
+
+class Speculator:
+    """推測執行：監督者流式輸出決策時，在 next_agent 與 task 確定後立即啟動該 worker，決策返回後提交或取消
+
+    推測的 worker 讀取的是加上這次任務分配後的狀態，與監督者節點完成後的輸入相同；
+    決策最終分派的 agent 或任務不同（例如決策驗證失敗後重試或升級）時視為未命中。
+    浪費與進行中的推測調用數之和不超過 budget × worker 調用數（至少允許 1 個）。
+    開啟推測時監督者改為流式調用文本鏈（不使用結構化輸出）。同步工作流的推測調用在 max_workers
+    個線程中執行，已開始的調用無法中斷，只能丟棄結果；非同步工作流會直接取消任務。
+    """
+
+    def __init__(self, budget: float = 0.25, max_workers: int = 8):
+        self.budget = budget
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="speculation")
+        self._lock = threading.Lock()
+        self.metrics = {"speculations": 0, "hits": 0, "misses": 0, "wasted_calls": 0, "skipped_budget": 0,
+                        "worker_calls": 0, "saved_seconds": 0.0}
+        self._in_flight = 0
+
+    def _add(self, key: str, amount: float = 1) -> None:
+        with self._lock:
+            self.metrics[key] += amount
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.metrics)
+        resolved = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / resolved if resolved else 0.0
+        stats["waste_ratio"] = stats["wasted_calls"] / stats["worker_calls"] if stats["worker_calls"] else 0.0
+        return stats
+
+    def _admit(self) -> bool:
+        with self._lock:
+            # 進行中的推測也可能被浪費，計入預算使並發運行時上限仍然有效
+            if self.metrics["wasted_calls"] + self._in_flight >= max(self.budget * self.metrics["worker_calls"], 1):
+                self.metrics["skipped_budget"] += 1
+                return False
+            self.metrics["speculations"] += 1
+            self._in_flight += 1
+        return True
+
+    @staticmethod
+    def _snapshot(state: Dict[str, Any], agent: str, task: str) -> Dict[str, Any]:
+        # 監督者節點會就地追加狀態中的列表，推測調用讀取副本；任務分配與監督者的狀態更新一致
+        snapshot = {key: list(value) if isinstance(value, list) else value for key, value in state.items()}
+        snapshot["task_assignments"].append({"iteration": len(state.get("task_assignments", [])) + 1,
+                                             "agent": agent, "task": task})
+        snapshot.update(current_task=task, next_agent=agent, subtasks=[], final_decision="",
+                        current_agent="supervisor")
+        return snapshot
+
+    def watch(self, state: Dict[str, Any],
+              agents: Dict[str, Callable[[Dict[str, Any]], Dict[str, Any]]]) -> DecisionWatcher:
+        """返回傳給監督者的 token 回調，推測調用在線程池中執行"""
+        def launch(agent: str, task: str) -> Optional[PendingSpeculation]:
+            if not self._admit():
+                return None
+            pending = PendingSpeculation(agent, task)
+            snapshot = self._snapshot(state, agent, task)
+
+            def run() -> Dict[str, Any]:
+                with get_tracer().span(f"speculative_{agent}", "speculation") as span:
+                    result = agents[agent](snapshot)
+                pending.duration = span.duration
+                return result
+
+            pending.handle = self._pool.submit(copy_context().run, run)
+            return pending
+        return DecisionWatcher(launch, self._discard)
+
+    def awatch(self, state: Dict[str, Any],
+               agents: Dict[str, Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]]) -> DecisionWatcher:
+        """watch 的非同步版本，推測調用作為 asyncio 任務執行"""
+        def launch(agent: str, task: str) -> Optional[PendingSpeculation]:
+            if not self._admit():
+                return None
+            pending = PendingSpeculation(agent, task)
+            snapshot = self._snapshot(state, agent, task)
+
+            async def run() -> Dict[str, Any]:
+                with get_tracer().span(f"speculative_{agent}", "speculation") as span:
+                    result = await agents[agent](snapshot)
+                pending.duration = span.duration
+                return result
+
+            pending.handle = asyncio.ensure_future(run())
+            return pending
+        return DecisionWatcher(launch, self._discard)
+
+    def _discard(self, pending: PendingSpeculation) -> None:
+        with self._lock:
+            self._in_flight -= 1
+            self.metrics["misses"] += 1
+        self.cancel(pending)
+
+    def resolve(self, pending: Optional[PendingSpeculation], current: Optional[str],
+                state: Dict[str, Any]) -> Optional[PendingSpeculation]:
+        """監督者決策後調用：命中時返回可提交的推測，否則取消並返回 None"""
+        if current in _WORKERS:
+            self._add("worker_calls")
+        if pending is None:
+            return None
+        if (current == pending.agent and len(state.get("subtasks") or []) < 2
+                and pending.task == state.get("current_task", "")):
+            with self._lock:
+                self._in_flight -= 1
+            return pending
+        self._discard(pending)
+        return None
+
+    def cancel(self, pending: PendingSpeculation) -> None:
+        if isinstance(pending.handle, Future):
+            # 線程池中尚未開始的調用可以直接取消，已開始的調用只能丟棄結果
+            if pending.handle.cancel():
+                return
+        else:
+            pending.handle.cancel()
+        self._add("wasted_calls")
+
+    def _committed(self, pending: PendingSpeculation, result: Dict[str, Any], state: Dict[str, Any],
+                   waited: float) -> Dict[str, Any]:
+        # 推測時的迭代編號比實際執行時早一步
+        for record in result.get(_RESULT_FIELDS[pending.agent]) or []:
+            record.iteration = state["iteration"]
+        with self._lock:
+            self.metrics["hits"] += 1
+            self.metrics["saved_seconds"] += max(pending.duration - waited, 0.0)
+        return result
+
+    def commit(self, pending: PendingSpeculation, state: Dict[str, Any]) -> Dict[str, Any]:
+        """等待推測調用完成並返回其狀態增量"""
+        start = time.perf_counter()
+        result = pending.handle.result()
+        return self._committed(pending, result, state, time.perf_counter() - start)
+
+    async def acommit(self, pending: PendingSpeculation, state: Dict[str, Any]) -> Dict[str, Any]:
+        """commit 的非同步版本"""
+        start = time.perf_counter()
+        result = await pending.handle
+        return self._committed(pending, result, state, time.perf_counter() - start)
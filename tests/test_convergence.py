@@ -0,0 +1,41 @@
+from agents.records import ResultRecord
+from convergence import ConvergenceDetector
+from workflow import create_initial_state
+
+TASK = "分析一家咖啡店的每日營運成本"
+ANALYSIS = "咖啡店每日成本主要來自原料、租金與人工，其中原料約佔四成，租金與人工各佔三成左右。"
+
+
+def state_with(analyses, assignments):
+    state = create_initial_state(TASK)
+    state["analysis_results"] = analyses
+    state["task_assignments"] = assignments
+    return state
+
+
+def assign(iteration, task):
+    return {"iteration": iteration, "agent": "analyst", "task": task}
+
+
+def test_repeated_errors_do_not_converge():
+    error = "分析過程中出現錯誤: Error code: 429 - rate limit exceeded"
+    state = state_with([ResultRecord("analyst", 1, error, task=TASK, status="error"),
+                        ResultRecord("analyst", 2, error, task=TASK, status="error")],
+                       [assign(1, TASK), assign(2, TASK)])
+    assert ConvergenceDetector().check(state) is None
+
+
+def test_skipped_results_are_ignored():
+    skipped = "（已跳過：超出節點預算 3.0 秒）"
+    state = state_with([ResultRecord("analyst", 1, ANALYSIS, task="第一輪分析"),
+                        ResultRecord("analyst", 2, skipped, task=TASK, status="skipped"),
+                        ResultRecord("analyst", 3, skipped, task=TASK, status="skipped")],
+                       [assign(1, "第一輪分析"), assign(2, TASK), assign(3, TASK)])
+    assert ConvergenceDetector().check(state) is None
+
+
+def test_identical_analyses_still_converge():
+    state = state_with([ResultRecord("analyst", 1, ANALYSIS, task=TASK),
+                        ResultRecord("analyst", 2, ANALYSIS, task=TASK)],
+                       [assign(1, TASK), assign(2, TASK)])
+    assert ConvergenceDetector().check(state) == 1.0
@@ -1,238 +1,783 @@
-from typing import Dict, List, Any, TypedDict, Annotated, Sequence
-from langgraph.graph import Graph, END
-from langgraph.prebuilt import ToolNode
-from agents.supervisor import SupervisorAgent
-from agents.researcher import ResearcherAgent
-from agents.analyst import AnalystAgent
-import json
+from typing import TYPE_CHECKING, Dict, List, Any, TypedDict, Annotated, Callable, Optional, Tuple, Iterator, AsyncIterator, Union, get_type_hints
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar, copy_context
+from agents.cache import ResponseCache
+from agents.deadline import DeadlineExceeded, deadline_scope, remaining
+from agents.records import BranchRecord, ResultRecord, StepRecord
+from agents.routing import ModelRouter
+from agents.tracing import get_tracer
+from budgets import NodeBudgets
+from checkpoint import CheckpointStore
+from convergence import ConvergenceDetector
+from research_store import ResearchStore
+from speculation import DecisionWatcher, PendingSpeculation, Speculator
+import asyncio
+import queue
+import threading
 import time
 from datetime import datetime
 
-# 定義狀態類型
+if TYPE_CHECKING:
+    # langchain 與 agents 模組導入較慢，只在創建工作流時才加載
+    from langchain_core.language_models import BaseChatModel
+    from agents.scheduler import LLMScheduler
+
+def extend_list(current: List[Any], update: List[Any]) -> List[Any]:
+    """列表字段的 reducer：就地追加新增項，不複製已有歷史"""
+    current.extend(update)
+    return current
+
+# 定義狀態類型；以 Annotated 標註 reducer 的字段只接受增量
 class AgentState(TypedDict):
-    task_assignments: List[Dict[str, Any]]
-    research_results: List[Dict[str, Any]]
-    analysis_results: List[Dict[str, Any]]
-    execution_times: List[Dict[str, Any]]
-    agent_sequence: List[str]
+    task_assignments: Annotated[List[Dict[str, Any]], extend_list]
+    research_results: Annotated[List[ResultRecord], extend_list]
+    analysis_results: Annotated[List[ResultRecord], extend_list]
+    execution_times: Annotated[List[StepRecord], extend_list]
+    agent_sequence: Annotated[List[str], extend_list]
     current_agent: str
     next_agent: str
     current_task: str
+    original_task: str  # 用戶輸入的原始任務，監督者改寫 current_task 時保持不變
     final_decision: str
     iteration: int
     start_time: float  # 新增：工作流開始時間
     max_iterations: int  # 新增：最大迭代次數
     max_execution_time: float  # 新增：最大執行時間（秒）
+    subtasks: List[str]  # 監督者拆分的並行研究子任務
+    max_fan_out: int  # 並行研究的最大分支數
+
+_REDUCERS: Dict[str, Callable[[Any, Any], Any]] = {
+    name: hint.__metadata__[0]
+    for name, hint in get_type_hints(AgentState, include_extras=True).items()
+    if hasattr(hint, "__metadata__")
+}
+
+def apply_update(state: AgentState, update: Dict[str, Any]) -> AgentState:
+    """把節點返回的增量合併到狀態：有 reducer 的字段交給 reducer，其餘字段直接覆蓋"""
+    for key, value in update.items():
+        reducer = _REDUCERS.get(key)
+        state[key] = reducer(state[key], value) if reducer is not None and key in state else value
+    return state
+
+# 流式模式下的事件接收者，由 stream_workflow / astream_workflow / run_with_events 設置
+_event_sink: ContextVar[Optional[Callable[[Dict[str, Any]], None]]] = ContextVar("workflow_event_sink", default=None)
+# 是否同時發出 token 事件：布爾值，或在每次 LLM 調用開始時檢查的函數。
+# 只有需要 token 時 agent 才以流式調用模型（監督者因此放棄結構化輸出），
+# 只收集節點事件的 sink（例如運行歸檔）不改變模型的調用方式
+_stream_tokens: ContextVar[Union[bool, Callable[[], bool]]] = ContextVar("workflow_stream_tokens", default=False)
+# 開啟推測執行時監督者節點的決策監聽器，從流式輸出的決策中提前啟動 worker
+_decision_watcher: ContextVar[Optional[DecisionWatcher]] = ContextVar("decision_watcher", default=None)
+# 監督者決策後命中的推測調用，由下一個 worker 節點提交
+_committed_speculation: ContextVar[Optional[PendingSpeculation]] = ContextVar("committed_speculation", default=None)
+# 節點預算要求本次 worker 節點改用降級 agent
+_downgraded: ContextVar[bool] = ContextVar("downgraded", default=False)
+
+def _token_callback(node: str, branch: Optional[int] = None) -> Optional[Callable[[str], None]]:
+    """需要 token 事件時返回把 token 轉為事件的回調，否則返回 None"""
+    sink = _event_sink.get()
+    tokens = _stream_tokens.get()
+    if sink is None or not (tokens() if callable(tokens) else tokens):
+        return None
+    def on_token(content: str) -> None:
+        event = {"type": "token", "node": node, "content": content}
+        if branch is not None:
+            event["branch"] = branch
+        sink(event)
+    return on_token
+
+def _supervisor_callback() -> Optional[Callable[[str], None]]:
+    """監督者的 token 回調：需要 token 事件時發出事件，開啟推測執行時同時交給決策監聽器"""
+    on_token = _token_callback("supervisor")
+    watcher = _decision_watcher.get()
+    if watcher is None or on_token is None:
+        return watcher or on_token
+    def both(content: str) -> None:
+        watcher(content)
+        on_token(content)
+    return both
+
+def _take_speculation(agent: str) -> Optional[PendingSpeculation]:
+    pending = _committed_speculation.get()
+    if pending is None or pending.agent != agent:
+        return None
+    _committed_speculation.set(None)
+    return pending
+
+def _emit_speculative_tokens(result: Dict[str, Any], field: str, on_token: Optional[Callable[[str], None]]) -> None:
+    """推測調用不流式輸出，提交時把結果作為一個 token 事件發出"""
+    if on_token is not None:
+        for record in result.get(field) or []:
+            on_token(record.content)
+
+def _snapshot(state: AgentState) -> Dict[str, Any]:
+    return {key: len(value) if isinstance(value, list) else value for key, value in state.items()}
+
+def _state_delta(before: Dict[str, Any], state: AgentState) -> Dict[str, Any]:
+    """計算節點執行前後的狀態變化：列表只返回新增項，其他字段返回新值"""
+    delta = {}
+    for key, value in state.items():
+        if isinstance(value, list):
+            if len(value) > before.get(key, 0):
+                delta[key] = value[before.get(key, 0):]
+        elif before.get(key) != value:
+            delta[key] = value
+    return delta
+
+def _streaming_node(name: str, node: Callable[[AgentState], AgentState]) -> Callable[[AgentState], AgentState]:
+    """包裝節點，記錄節點 span，並在流式模式下發出 node_start / node_end / state_delta 事件"""
+    def wrapper(state: AgentState) -> AgentState:
+        with get_tracer().span(name, "node", iteration=state["iteration"]) as span:
+            sink = _event_sink.get()
+            if sink is None:
+                return node(state)
+            before = _snapshot(state)
+            sink({"type": "node_start", "node": name, "iteration": state["iteration"]})
+            result = node(state)
+            sink({"type": "node_end", "node": name, "execution_time": span.duration})
+            sink({"type": "state_delta", "node": name, "delta": _state_delta(before, result)})
+            return result
+    return wrapper
+
+def _astreaming_node(name: str, node: Callable[[AgentState], Any]) -> Callable[[AgentState], Any]:
+    """_streaming_node 的非同步版本"""
+    async def wrapper(state: AgentState) -> AgentState:
+        with get_tracer().span(name, "node", iteration=state["iteration"]) as span:
+            sink = _event_sink.get()
+            if sink is None:
+                return await node(state)
+            before = _snapshot(state)
+            sink({"type": "node_start", "node": name, "iteration": state["iteration"]})
+            result = await node(state)
+            sink({"type": "node_end", "node": name, "execution_time": span.duration})
+            sink({"type": "state_delta", "node": name, "delta": _state_delta(before, result)})
+            return result
+    return wrapper
+
+def validate_state(state: AgentState) -> bool:
+    """驗證狀態是否有效"""
+    required_fields = [
+        "task_assignments", "research_results", "analysis_results",
+        "execution_times", "agent_sequence", "current_agent",
+        "next_agent", "current_task", "final_decision", "iteration"
+    ]
+    return all(field in state for field in required_fields)
+
+def _record_step(state: AgentState, agent: str, start_time: float, current_time: str,
+                 branches: Optional[List[BranchRecord]] = None) -> AgentState:
+    """更新執行時間和序列，start_time 為 time.perf_counter() 的讀數，執行時間以秒（浮點數）記錄"""
+    record = StepRecord(state["iteration"], agent, current_time, time.perf_counter() - start_time, branches or None)
+    return apply_update(state, {
+        "execution_times": [record],
+        "agent_sequence": [agent],
+        "iteration": state["iteration"] + 1
+    })
+
+def _apply_supervisor_result(state: AgentState, result: Dict[str, Any]) -> None:
+    if result.get("subtasks"):
+        result["subtasks"] = result["subtasks"][:state.get("max_fan_out", 1)]
+        # 任務分配記錄中保存實際執行的子任務，而非模型提出的完整列表
+        if result.get("task_assignments"):
+            result["task_assignments"][-1]["subtasks"] = result["subtasks"]
+    apply_update(state, result)
+
+def _fan_out_subtasks(state: AgentState) -> List[str]:
+    """返回需要並行研究的子任務，少於兩個時返回空列表"""
+    subtasks = state.get("subtasks") or []
+    return subtasks if len(subtasks) > 1 else []
+
+def _branch_state(state: AgentState, subtask: str) -> AgentState:
+    """為單個研究分支建立淺拷貝狀態"""
+    return {**state, "current_task": subtask, "subtasks": []}
+
+def _join_research(state: AgentState, subtasks: List[str],
+                   outcomes: List[Tuple[Dict[str, Any], str, float]]) -> List[BranchRecord]:
+    """合併並行研究分支的結果，返回各分支的執行時間記錄"""
+    records = []
+    branches = []
+    for index, (subtask, (result, branch_start, branch_time)) in enumerate(zip(subtasks, outcomes), 1):
+        research = result.get("research_results") or [ResultRecord("researcher", state["iteration"], "", subtask, "error")]
+        records.append(ResultRecord("researcher", state["iteration"], f"子任務 {index}：{subtask}\n{research[-1].content}",
+                                    subtask, research[-1].status))
+        branches.append(BranchRecord(index, subtask, branch_start, branch_time))
+    apply_update(state, {"research_results": records, "subtasks": [], "next_agent": "supervisor"})
+    return branches
+
+# 狀態轉換表：每個節點執行後允許前往的下一個節點
+_TRANSITIONS = {
+    "supervisor": ("researcher", "analyst", "end"),
+    "researcher": ("supervisor",),
+    "analyst": ("supervisor",)
+}
+
+def _next_node(state: AgentState, current: Optional[str]) -> Optional[str]:
+    """根據 next_agent 決定下一個要執行的節點，結束時返回 None"""
+    target = state["next_agent"]
+    if target == "end":
+        return None
+    if current is not None and target not in _TRANSITIONS[current]:
+        print(f"警告: 無效的狀態轉換 {current} -> {target}，結束工作流")
+        return None
+    return target if target in _TRANSITIONS else None
+
+def _check_stop_conditions(state: AgentState, convergence: Optional[ConvergenceDetector] = None) -> bool:
+    """檢查停止條件，若需要結束則更新狀態並返回 True"""
+    current_time = time.time()
+    execution_time = current_time - state["start_time"]
+
+    # 檢查是否超過最大迭代次數
+    if state["iteration"] > state["max_iterations"]:
+        print(f"\n達到最大迭代次數 {state['max_iterations']}，強制結束工作流")
+        state["final_decision"] = f"達到最大迭代次數 {state['max_iterations']}，工作流強制結束。\n當前決策：{state['final_decision']}"
+        state["next_agent"] = "end"
+        return True
+
+    # 檢查是否超過最大執行時間
+    if execution_time > state["max_execution_time"]:
+        _end_on_deadline(state, "run")
+        return True
+
+    # 最近的分析結果與監督者決策幾乎不再變化時提前結束
+    if convergence is not None:
+        score = convergence.check(state)
+        if score is not None:
+            print(f"\n分析結果已收斂（相似度 {score:.2f}），結束工作流")
+            decision = _best_partial(state)
+            state["final_decision"] = f"分析結果已收斂（相似度 {score:.2f}），工作流結束。\n最終決策：{decision}"
+            state["next_agent"] = "end"
+            return True
+
+    return False
+
+_RESULT_FIELDS = {"researcher": "research_results", "analyst": "analysis_results"}
+# 因時間預算跳過的節點記錄的結果前綴
+_SKIPPED_PREFIX = "（已跳過："
+
+def _best_partial(state: AgentState) -> str:
+    """超時結束時可返回的最好結果：監督者的決策，其次是最新的分析結果，再次是最新的研究結果"""
+    if state["final_decision"]:
+        return state["final_decision"]
+    for field in ("analysis_results", "research_results"):
+        for record in reversed(state[field]):
+            if record.ok and record.content:
+                return record.content
+    return ""
 
-def create_workflow() -> Graph:
+def _end_on_deadline(state: AgentState, scope: str) -> None:
+    """時間預算用完時結束工作流，以目前最好的部分結果作為決策"""
+    if scope == "run":
+        reason = f"超過最大執行時間 {state['max_execution_time']} 秒"
+    else:
+        reason = f"{scope} 超出節點時間預算"
+    print(f"\n{reason}，強制結束工作流")
+    state["final_decision"] = f"{reason}，工作流強制結束。\n當前決策：{_best_partial(state)}"
+    state["next_agent"] = "end"
+
+def _run_deadline(state: AgentState) -> float:
+    return state["start_time"] + state["max_execution_time"]
+
+def _skip_node(state: AgentState, agent: str, reason: str) -> AgentState:
+    """記錄一次被跳過的 worker 節點，結果中註明原因，監督者據此決定下一步"""
+    start_time = time.perf_counter()
+    current_time = datetime.now().strftime("%H:%M:%S")
+    print(f"\n{agent} {reason}，跳過本次任務")
+    note = f"{_SKIPPED_PREFIX}{reason}）{state['current_task']}"
+    apply_update(state, {
+        _RESULT_FIELDS[agent]: [ResultRecord(agent, state["iteration"], note, state["current_task"], "skipped")],
+        "current_agent": agent,
+        "next_agent": "supervisor",
+        "subtasks": []
+    })
+    return _record_step(state, agent, start_time, current_time)
+
+def _budget_reason(budgets: NodeBudgets, name: str) -> str:
+    return f"超出節點預算 {budgets.budgets[name]:.1f} 秒"
+
+def _settle_branches(subtasks: List[str], outcomes: List[Tuple[Optional[Dict[str, Any]], str, float]],
+                     budgets: Optional[NodeBudgets]) -> List[Tuple[Dict[str, Any], str, float]]:
+    """處理超出節點預算的研究分支：全部超時時按整個節點跳過，否則把未完成的分支記為跳過"""
+    timed_out = [subtask for subtask, (result, _, _) in zip(subtasks, outcomes) if result is None]
+    if not timed_out:
+        return outcomes
+    if len(timed_out) == len(outcomes):
+        raise DeadlineExceeded("researcher")
+    budgets.timed_out("researcher")
+    reason = _budget_reason(budgets, "researcher")
+    print(f"\nresearcher {reason}，跳過 {len(timed_out)} 個未完成的分支")
+    return [({"research_results": [ResultRecord("researcher", 0, f"{_SKIPPED_PREFIX}{reason}）{subtask}", subtask, "skipped")]}
+             if result is None else result, branch_time, duration)
+            for subtask, (result, branch_time, duration) in zip(subtasks, outcomes)]
+
+def _budgeted_node(name: str, node: Callable[[AgentState], AgentState], budgets: NodeBudgets,
+                   has_fallback: bool) -> Callable[[AgentState], AgentState]:
+    """按節點預算執行節點：剩餘時間不足時降級或跳過，超出預算時跳過 worker 節點"""
+    def wrapper(state: AgentState) -> AgentState:
+        mode = budgets.plan(name, remaining(), has_fallback)
+        if mode == "skip":
+            return _skip_node(state, name, "剩餘時間不足節點預算")
+        token = _downgraded.set(mode == "downgrade")
+        try:
+            with budgets.scope(name):
+                return node(state)
+        except DeadlineExceeded as e:
+            if e.scope != name or not budgets.timed_out(name):
+                raise
+            return _skip_node(state, name, _budget_reason(budgets, name))
+        finally:
+            _downgraded.reset(token)
+    return wrapper
+
+def _abudgeted_node(name: str, node: Callable[[AgentState], Any], budgets: NodeBudgets,
+                    has_fallback: bool) -> Callable[[AgentState], Any]:
+    """_budgeted_node 的非同步版本"""
+    async def wrapper(state: AgentState) -> AgentState:
+        mode = budgets.plan(name, remaining(), has_fallback)
+        if mode == "skip":
+            return _skip_node(state, name, "剩餘時間不足節點預算")
+        token = _downgraded.set(mode == "downgrade")
+        try:
+            with budgets.scope(name):
+                return await node(state)
+        except DeadlineExceeded as e:
+            if e.scope != name or not budgets.timed_out(name):
+                raise
+            return _skip_node(state, name, _budget_reason(budgets, name))
+        finally:
+            _downgraded.reset(token)
+    return wrapper
+
+def _create_agents(llm: Optional["BaseChatModel"], cache: Optional[ResponseCache],
+                   scheduler: Optional["LLMScheduler"], router: Optional[ModelRouter]) -> Tuple[Any, Any, Any]:
+    from agents.supervisor import SupervisorAgent
+    from agents.researcher import ResearcherAgent
+    from agents.analyst import AnalystAgent
+    return (SupervisorAgent(llm=llm, cache=cache, scheduler=scheduler, router=router),
+            ResearcherAgent(llm=llm, cache=cache, scheduler=scheduler, router=router),
+            AnalystAgent(llm=llm, cache=cache, scheduler=scheduler, router=router))
+
+def _create_fallbacks(cache: Optional[ResponseCache], scheduler: Optional["LLMScheduler"],
+                      router: Optional[ModelRouter]) -> Dict[str, Any]:
+    """按路由中的 "researcher.fallback" / "analyst.fallback" 創建降級 agent"""
+    if router is None:
+        return {}
+    from agents.researcher import ResearcherAgent
+    from agents.analyst import AnalystAgent
+    fallbacks = {}
+    for role, agent_class in (("researcher", ResearcherAgent), ("analyst", AnalystAgent)):
+        route = f"{role}.fallback"
+        if router.has_route(route):
+            fallbacks[role] = agent_class(model_name=router.model_for(route), cache=cache, scheduler=scheduler,
+                                          router=router, llm=router.llm_for(route, max_retries=0 if scheduler else None))
+    return fallbacks
+
+def create_workflow(llm: Optional["BaseChatModel"] = None, cache: Optional[ResponseCache] = None,
+                    checkpointer: Optional[CheckpointStore] = None,
+                    scheduler: Optional["LLMScheduler"] = None,
+                    convergence: Optional[ConvergenceDetector] = None,
+                    router: Optional[ModelRouter] = None,
+                    speculation: Optional[Speculator] = None,
+                    research_store: Optional[ResearchStore] = None,
+                    budgets: Optional[NodeBudgets] = None) -> Callable[[AgentState], AgentState]:
+    """創建同步工作流
+
+    每次運行以 start_time + max_execution_time 為截止時間，節點與 LLM 調用只能使用剩餘的時間，
+    超時的調用被取消，工作流返回目前最好的部分結果；budgets 為各節點設置軟時間預算。
+    """
+    convergence = convergence or ConvergenceDetector()
     # 初始化 agents
-    supervisor = SupervisorAgent()
-    researcher = ResearcherAgent()
-    analyst = AnalystAgent()
-    
-    # 創建工作流圖
-    workflow = Graph()
-    
-    def validate_state(state: AgentState) -> bool:
-        """驗證狀態是否有效"""
-        required_fields = [
-            "task_assignments", "research_results", "analysis_results",
-            "execution_times", "agent_sequence", "current_agent",
-            "next_agent", "current_task", "final_decision", "iteration"
-        ]
-        return all(field in state for field in required_fields)
-    
+    supervisor, researcher, analyst = _create_agents(llm, cache, scheduler, router)
+    # 配置了共享研究存儲時，研究調用先查找其他任務中相似的研究結果
+    research = research_store.wrap(researcher.research) if research_store is not None else researcher.research
+    # 節點預算要求降級時改用的 agent
+    fallbacks = _create_fallbacks(cache, scheduler, router) if budgets is not None else {}
+
     # 定義節點
     def supervisor_node(state: AgentState) -> AgentState:
         if not validate_state(state):
             print("警告: 無效的狀態進入 supervisor_node")
             return state
-            
-        start_time = time.time()
+
+        start_time = time.perf_counter()
         current_time = datetime.now().strftime("%H:%M:%S")
-        
-        result = supervisor.evaluate_and_assign(state)
-        if result.get("task_assignments"):
-            state["task_assignments"].extend(result["task_assignments"])
-        state["next_agent"] = result.get("next_agent", "end")
-        state["current_task"] = result.get("current_task", state["current_task"])
-        state["final_decision"] = result.get("final_decision", "")
-        
-        # 更新執行時間和序列
-        end_time = time.time()
-        execution_time = end_time - start_time
-        state["execution_times"].append({
-            "iteration": state["iteration"],
-            "agent": "supervisor",
-            "start_time": current_time,
-            "execution_time": f"{execution_time:.2f}秒"
-        })
-        state["agent_sequence"].append("supervisor")
-        state["iteration"] += 1
-        
-        return state
-    
+
+        result = supervisor.evaluate_and_assign(state, _supervisor_callback())
+        _apply_supervisor_result(state, result)
+
+        return _record_step(state, "supervisor", start_time, current_time)
+
     def researcher_node(state: AgentState) -> AgentState:
         if not validate_state(state):
             print("警告: 無效的狀態進入 researcher_node")
             return state
-            
-        start_time = time.time()
+
+        start_time = time.perf_counter()
         current_time = datetime.now().strftime("%H:%M:%S")
-        
-        result = researcher.research(state)
-        if result.get("research_results"):
-            state["research_results"].extend(result["research_results"])
-        state["next_agent"] = result.get("next_agent", "supervisor")
-        
-        # 更新執行時間和序列
-        end_time = time.time()
-        execution_time = end_time - start_time
-        state["execution_times"].append({
-            "iteration": state["iteration"],
-            "agent": "researcher",
-            "start_time": current_time,
-            "execution_time": f"{execution_time:.2f}秒"
-        })
-        state["agent_sequence"].append("researcher")
-        state["iteration"] += 1
-        
-        return state
-    
+        research_fn = fallbacks["researcher"].research if _downgraded.get() else research
+
+        subtasks = _fan_out_subtasks(state)
+        if subtasks:
+            def run_branch(index: int, subtask: str) -> Tuple[Dict[str, Any], str, float]:
+                with get_tracer().span("researcher_branch", "branch", branch=index) as span:
+                    branch_time = datetime.now().strftime("%H:%M:%S")
+                    try:
+                        result = research_fn(_branch_state(state, subtask), _token_callback("researcher", index))
+                    except DeadlineExceeded as e:
+                        # 節點預算用完時未完成的分支記為 None，運行超時則向上拋出
+                        if e.scope != "researcher":
+                            raise
+                        result = None
+                return result, branch_time, span.duration
+
+            # 並行執行各研究分支，並在合併後再交回監督者
+            with ThreadPoolExecutor(max_workers=len(subtasks)) as pool:
+                futures = [pool.submit(copy_context().run, run_branch, index, subtask)
+                           for index, subtask in enumerate(subtasks, 1)]
+                outcomes = [future.result() for future in futures]
+            branches = _join_research(state, subtasks, _settle_branches(subtasks, outcomes, budgets))
+            return _record_step(state, "researcher", start_time, current_time, branches)
+
+        pending = _take_speculation("researcher")
+        if pending is not None:
+            result = speculation.commit(pending, state)
+            _emit_speculative_tokens(result, "research_results", _token_callback("researcher"))
+        else:
+            result = research_fn(state, _token_callback("researcher"))
+        apply_update(state, result)
+
+        return _record_step(state, "researcher", start_time, current_time)
+
     def analyst_node(state: AgentState) -> AgentState:
         if not validate_state(state):
             print("警告: 無效的狀態進入 analyst_node")
             return state
-            
-        start_time = time.time()
+
+        start_time = time.perf_counter()
         current_time = datetime.now().strftime("%H:%M:%S")
-        
-        result = analyst.analyze(state)
-        if result.get("analysis_results"):
-            state["analysis_results"].extend(result["analysis_results"])
-        state["next_agent"] = result.get("next_agent", "supervisor")
-        
-        # 更新執行時間和序列
-        end_time = time.time()
-        execution_time = end_time - start_time
-        state["execution_times"].append({
-            "iteration": state["iteration"],
-            "agent": "analyst",
-            "start_time": current_time,
-            "execution_time": f"{execution_time:.2f}秒"
-        })
-        state["agent_sequence"].append("analyst")
-        state["iteration"] += 1
-        
+
+        pending = _take_speculation("analyst")
+        if pending is not None:
+            result = speculation.commit(pending, state)
+            _emit_speculative_tokens(result, "analysis_results", _token_callback("analyst"))
+        else:
+            analyze = fallbacks["analyst"].analyze if _downgraded.get() else analyst.analyze
+            result = analyze(state, _token_callback("analyst"))
+        apply_update(state, result)
+
+        return _record_step(state, "analyst", start_time, current_time)
+
+    if budgets is not None:
+        supervisor_node = _budgeted_node("supervisor", supervisor_node, budgets, False)
+        researcher_node = _budgeted_node("researcher", researcher_node, budgets, "researcher" in fallbacks)
+        analyst_node = _budgeted_node("analyst", analyst_node, budgets, "analyst" in fallbacks)
+    supervisor_node = _streaming_node("supervisor", supervisor_node)
+    researcher_node = _streaming_node("researcher", researcher_node)
+    analyst_node = _streaming_node("analyst", analyst_node)
+
+    nodes = {
+        "supervisor": supervisor_node,
+        "researcher": researcher_node,
+        "analyst": analyst_node
+    }
+    workers = {"researcher": research, "analyst": analyst.analyze}
+
+    # 以顯式的步驟循環執行工作流，每個節點完成後保存檢查點
+    def wrapped_workflow(state: AgentState, run_id: Optional[str] = None) -> AgentState:
+        if checkpointer is not None and run_id is not None:
+            restored = checkpointer.load(run_id)
+            if restored is not None:
+                print(f"\n從檢查點恢復運行 {run_id}（步驟 {restored['iteration']}）")
+                state = restored
+
+        current = state["agent_sequence"][-1] if state["agent_sequence"] else None
+        pending, watcher = None, None
+        # 節點與 LLM 調用都只能使用運行剩餘的時間
+        with get_tracer().span("workflow", "workflow", run_id=run_id or ""), deadline_scope(_run_deadline(state)):
+            try:
+                # 檢查停止條件
+                while not _check_stop_conditions(state, convergence):
+                    current = _next_node(state, current)
+                    if current is None:
+                        break
+                    if speculation is not None:
+                        # 監督者決策後提交或取消上一次推測；監督者流式輸出決策時，任務一確定就推測執行該 worker
+                        _committed_speculation.set(speculation.resolve(pending, current, state))
+                        pending = None
+                        watcher = speculation.watch(state, workers) if current == "supervisor" else None
+                        _decision_watcher.set(watcher)
+                    state = nodes[current](state)
+                    pending = watcher.pending if watcher is not None else None
+                    if checkpointer is not None and run_id is not None:
+                        checkpointer.save(run_id, state)
+            except DeadlineExceeded as e:
+                _end_on_deadline(state, e.scope)
+            except Exception as e:
+                print(f"工作流執行錯誤: {str(e)}")
+            finally:
+                if speculation is not None:
+                    # 監督者節點中途結束時，推測調用只記在監聽器上
+                    pending = pending or (watcher.pending if watcher is not None else None)
+                    if pending is not None:
+                        speculation.resolve(pending, None, state)
+                    _committed_speculation.set(None)
+                    _decision_watcher.set(None)
         return state
-    
-    # 添加節點到工作流
-    workflow.add_node("supervisor", supervisor_node)
-    workflow.add_node("researcher", researcher_node)
-    workflow.add_node("analyst", analyst_node)
-    
-    # 定義條件邊
-    def to_researcher(state: AgentState) -> bool:
-        return state["next_agent"] == "researcher"
-    
-    def to_analyst(state: AgentState) -> bool:
-        return state["next_agent"] == "analyst"
-    
-    def to_end(state: AgentState) -> bool:
-        return state["next_agent"] == "end"
-    
-    def to_supervisor(state: AgentState) -> bool:
-        return state["next_agent"] == "supervisor"
-    
-    # 添加條件邊
-    workflow.add_conditional_edges(
-        "supervisor",
-        {
-            "researcher": to_researcher,
-            "analyst": to_analyst,
-            END: to_end
-        }
-    )
-    
-    workflow.add_conditional_edges(
-        "researcher",
-        {
-            "supervisor": to_supervisor
-        }
-    )
-    
-    workflow.add_conditional_edges(
-        "analyst",
-        {
-            "supervisor": to_supervisor
-        }
-    )
-    
-    # 設置入口點
-    workflow.set_entry_point("supervisor")
-    
-    # 編譯工作流
-    app = workflow.compile()
-    
-    # 包裝工作流以確保返回最終狀態
-    def wrapped_workflow(state: AgentState) -> AgentState:
-        try:
-            # 檢查停止條件
-            current_time = time.time()
-            execution_time = current_time - state["start_time"]
-            
-            # 檢查是否超過最大迭代次數
-            if state["iteration"] > state["max_iterations"]:
-                print(f"\n達到最大迭代次數 {state['max_iterations']}，強制結束工作流")
-                state["final_decision"] = f"達到最大迭代次數 {state['max_iterations']}，工作流強制結束。\n當前決策：{state['final_decision']}"
-                state["next_agent"] = "end"
-                return state
-            
-            # 檢查是否超過最大執行時間
-            if execution_time > state["max_execution_time"]:
-                print(f"\n超過最大執行時間 {state['max_execution_time']} 秒，強制結束工作流")
-                state["final_decision"] = f"超過最大執行時間 {state['max_execution_time']} 秒，工作流強制結束。\n當前決策：{state['final_decision']}"
-                state["next_agent"] = "end"
-                return state
-            
-            # 檢查結果（如果已經有足夠的迭代次數）
-            if state["iteration"] > 3:
-                # 獲取最近三次迭代的結果
-                recent_results = state["analysis_results"][-3:] if state["analysis_results"] else []
-                if len(recent_results) >= 3:
-                    # 如果最近三次結果相似，可以考慮結束
-                    if all(result == recent_results[0] for result in recent_results):
-                        print("\n連續三次迭代結果相同，結束工作流")
-                        state["final_decision"] = f"連續三次迭代結果相同，工作流結束。\n最終決策：{state['final_decision']}"
-                        state["next_agent"] = "end"
-                        return state
-            
-            result = app.invoke(state)
-            
-            # 如果結果為 None，檢查狀態轉換
-            if result is None:
-                # 如果應該轉換到 researcher 但沒有成功，手動更新狀態
-                if state['next_agent'] == 'researcher':
-                    new_state = researcher_node(state)
-                    # 遞歸調用以繼續工作流
-                    return wrapped_workflow(new_state)
-                # 如果應該轉換到 analyst 但沒有成功，手動更新狀態
-                elif state['next_agent'] == 'analyst':
-                    new_state = analyst_node(state)
-                    # 遞歸調用以繼續工作流
-                    return wrapped_workflow(new_state)
-                # 如果應該結束但沒有成功，返回當前狀態
-                elif state['next_agent'] == 'end':
-                    return state
-                
-                return state
-            return result
-        except Exception as e:
-            print(f"工作流執行錯誤: {str(e)}")
+
+    # 暴露 agents 以便調用方讀取統計數據（例如 supervisor.decision_stats()）
+    wrapped_workflow.agents = {"supervisor": supervisor, "researcher": researcher, "analyst": analyst}
+    return wrapped_workflow
+
+def create_async_workflow(llm: Optional["BaseChatModel"] = None, cache: Optional[ResponseCache] = None,
+                          checkpointer: Optional[CheckpointStore] = None,
+                          scheduler: Optional["LLMScheduler"] = None,
+                          convergence: Optional[ConvergenceDetector] = None,
+                          router: Optional[ModelRouter] = None,
+                          speculation: Optional[Speculator] = None,
+                          research_store: Optional[ResearchStore] = None,
+                          budgets: Optional[NodeBudgets] = None) -> Callable[[AgentState], Any]:
+    """創建非同步工作流，所有 LLM 調用均透過 ainvoke 執行
+
+    返回的協程函數可在同一事件循環中並發執行多個任務，
+    例如：await asyncio.gather(*(workflow(s) for s in states))
+    超時的 LLM 調用會被取消（連同進行中的請求）。
+    """
+    convergence = convergence or ConvergenceDetector()
+    # 初始化 agents
+    supervisor, researcher, analyst = _create_agents(llm, cache, scheduler, router)
+    aresearch = research_store.awrap(researcher.aresearch) if research_store is not None else researcher.aresearch
+    fallbacks = _create_fallbacks(cache, scheduler, router) if budgets is not None else {}
+
+    # 定義節點
+    async def supervisor_node(state: AgentState) -> AgentState:
+        if not validate_state(state):
+            print("警告: 無效的狀態進入 supervisor_node")
             return state
-    
+
+        start_time = time.perf_counter()
+        current_time = datetime.now().strftime("%H:%M:%S")
+
+        result = await supervisor.aevaluate_and_assign(state, _supervisor_callback())
+        _apply_supervisor_result(state, result)
+
+        return _record_step(state, "supervisor", start_time, current_time)
+
+    async def researcher_node(state: AgentState) -> AgentState:
+        if not validate_state(state):
+            print("警告: 無效的狀態進入 researcher_node")
+            return state
+
+        start_time = time.perf_counter()
+        current_time = datetime.now().strftime("%H:%M:%S")
+        research_fn = fallbacks["researcher"].aresearch if _downgraded.get() else aresearch
+
+        subtasks = _fan_out_subtasks(state)
+        if subtasks:
+            async def run_branch(index: int, subtask: str) -> Tuple[Dict[str, Any], str, float]:
+                with get_tracer().span("researcher_branch", "branch", branch=index) as span:
+                    branch_time = datetime.now().strftime("%H:%M:%S")
+                    try:
+                        result = await research_fn(_branch_state(state, subtask), _token_callback("researcher", index))
+                    except DeadlineExceeded as e:
+                        # 節點預算用完時未完成的分支記為 None，運行超時則向上拋出
+                        if e.scope != "researcher":
+                            raise
+                        result = None
+                return result, branch_time, span.duration
+
+            outcomes = await asyncio.gather(*(run_branch(index, subtask) for index, subtask in enumerate(subtasks, 1)))
+            branches = _join_research(state, subtasks, _settle_branches(subtasks, list(outcomes), budgets))
+            return _record_step(state, "researcher", start_time, current_time, branches)
+
+        pending = _take_speculation("researcher")
+        if pending is not None:
+            result = await speculation.acommit(pending, state)
+            _emit_speculative_tokens(result, "research_results", _token_callback("researcher"))
+        else:
+            result = await research_fn(state, _token_callback("researcher"))
+        apply_update(state, result)
+
+        return _record_step(state, "researcher", start_time, current_time)
+
+    async def analyst_node(state: AgentState) -> AgentState:
+        if not validate_state(state):
+            print("警告: 無效的狀態進入 analyst_node")
+            return state
+
+        start_time = time.perf_counter()
+        current_time = datetime.now().strftime("%H:%M:%S")
+
+        pending = _take_speculation("analyst")
+        if pending is not None:
+            result = await speculation.acommit(pending, state)
+            _emit_speculative_tokens(result, "analysis_results", _token_callback("analyst"))
+        else:
+            analyze = fallbacks["analyst"].aanalyze if _downgraded.get() else analyst.aanalyze
+            result = await analyze(state, _token_callback("analyst"))
+        apply_update(state, result)
+
+        return _record_step(state, "analyst", start_time, current_time)
+
+    if budgets is not None:
+        supervisor_node = _abudgeted_node("supervisor", supervisor_node, budgets, False)
+        researcher_node = _abudgeted_node("researcher", researcher_node, budgets, "researcher" in fallbacks)
+        analyst_node = _abudgeted_node("analyst", analyst_node, budgets, "analyst" in fallbacks)
+    supervisor_node = _astreaming_node("supervisor", supervisor_node)
+    researcher_node = _astreaming_node("researcher", researcher_node)
+    analyst_node = _astreaming_node("analyst", analyst_node)
+
+    nodes = {
+        "supervisor": supervisor_node,
+        "researcher": researcher_node,
+        "analyst": analyst_node
+    }
+    aworkers = {"researcher": aresearch, "analyst": analyst.aanalyze}
+
+    # 以顯式的步驟循環執行工作流，每個節點完成後保存檢查點
+    async def wrapped_workflow(state: AgentState, run_id: Optional[str] = None) -> AgentState:
+        if checkpointer is not None and run_id is not None:
+            restored = await asyncio.to_thread(checkpointer.load, run_id)
+            if restored is not None:
+                print(f"\n從檢查點恢復運行 {run_id}（步驟 {restored['iteration']}）")
+                state = restored
+
+        current = state["agent_sequence"][-1] if state["agent_sequence"] else None
+        pending, watcher = None, None
+        with get_tracer().span("workflow", "workflow", run_id=run_id or ""), deadline_scope(_run_deadline(state)):
+            try:
+                # 收斂檢查要計算 MinHash/TF-IDF，在線程中執行以免阻塞事件循環上的其他運行
+                while not await asyncio.to_thread(_check_stop_conditions, state, convergence):
+                    current = _next_node(state, current)
+                    if current is None:
+                        break
+                    if speculation is not None:
+                        _committed_speculation.set(speculation.resolve(pending, current, state))
+                        pending = None
+                        watcher = speculation.awatch(state, aworkers) if current == "supervisor" else None
+                        _decision_watcher.set(watcher)
+                    state = await nodes[current](state)
+                    pending = watcher.pending if watcher is not None else None
+                    if checkpointer is not None and run_id is not None:
+                        await asyncio.to_thread(checkpointer.save, run_id, state)
+            except DeadlineExceeded as e:
+                _end_on_deadline(state, e.scope)
+            except Exception as e:
+                print(f"工作流執行錯誤: {str(e)}")
+            finally:
+                if speculation is not None:
+                    # 監督者節點中途結束時，推測調用只記在監聽器上
+                    pending = pending or (watcher.pending if watcher is not None else None)
+                    if pending is not None:
+                        speculation.resolve(pending, None, state)
+                    _committed_speculation.set(None)
+                    _decision_watcher.set(None)
+        return state
+
+    # 暴露 agents 以便調用方讀取統計數據（例如 supervisor.decision_stats()）
+    wrapped_workflow.agents = {"supervisor": supervisor, "researcher": researcher, "analyst": analyst}
     return wrapped_workflow
 
+_workflows: Dict[Tuple[Any, ...], Tuple[Callable, Tuple[Any, ...]]] = {}
+_workflows_lock = threading.Lock()
+
+def _get_cached_workflow(factory: Callable, **components: Any) -> Callable:
+    # 以對象 id 作為鍵，並在值中保留對象引用，確保 id 不會被重用
+    key = (factory.__name__,) + tuple((name, id(value)) for name, value in sorted(components.items()))
+    with _workflows_lock:
+        if key not in _workflows:
+            _workflows[key] = (factory(**components), tuple(components.values()))
+        return _workflows[key][0]
+
+def get_workflow(llm: Optional["BaseChatModel"] = None, cache: Optional[ResponseCache] = None,
+                 checkpointer: Optional[CheckpointStore] = None,
+                 scheduler: Optional["LLMScheduler"] = None,
+                 convergence: Optional[ConvergenceDetector] = None,
+                 router: Optional[ModelRouter] = None,
+                 speculation: Optional[Speculator] = None,
+                 research_store: Optional[ResearchStore] = None,
+                 budgets: Optional[NodeBudgets] = None) -> Callable[[AgentState], AgentState]:
+    """返回共享的同步工作流，相同配置的 agents 與工作流只構建一次
+
+    工作流本身不保存任務狀態，可在多個任務及線程間重用。
+    """
+    return _get_cached_workflow(create_workflow, llm=llm, cache=cache, checkpointer=checkpointer,
+                                scheduler=scheduler, convergence=convergence, router=router,
+                                speculation=speculation, research_store=research_store, budgets=budgets)
+
+def get_async_workflow(llm: Optional["BaseChatModel"] = None, cache: Optional[ResponseCache] = None,
+                       checkpointer: Optional[CheckpointStore] = None,
+                       scheduler: Optional["LLMScheduler"] = None,
+                       convergence: Optional[ConvergenceDetector] = None,
+                       router: Optional[ModelRouter] = None,
+                       speculation: Optional[Speculator] = None,
+                       research_store: Optional[ResearchStore] = None,
+                       budgets: Optional[NodeBudgets] = None) -> Callable[[AgentState], Any]:
+    """get_workflow 的非同步版本"""
+    return _get_cached_workflow(create_async_workflow, llm=llm, cache=cache, checkpointer=checkpointer,
+                                scheduler=scheduler, convergence=convergence, router=router,
+                                speculation=speculation, research_store=research_store, budgets=budgets)
+
+def run_with_events(workflow: Callable[[AgentState], AgentState], state: AgentState,
+                    sink: Callable[[Dict[str, Any]], None], run_id: Optional[str] = None,
+                    tokens: Union[bool, Callable[[], bool]] = False) -> AgentState:
+    """在當前線程執行同步工作流，並把 node_start、node_end、state_delta 事件交給 sink
+
+    tokens 為 True（或為返回 True 的函數）時 agent 以流式調用模型，sink 同時收到 token 事件。
+    """
+    sink_token = _event_sink.set(sink)
+    tokens_token = _stream_tokens.set(tokens)
+    try:
+        return workflow(state, run_id)
+    finally:
+        _stream_tokens.reset(tokens_token)
+        _event_sink.reset(sink_token)
+
+def stream_workflow(workflow: Callable[[AgentState], AgentState], state: AgentState) -> Iterator[Dict[str, Any]]:
+    """以事件流的方式執行 create_workflow() 返回的工作流
+
+    依次產生 node_start、token、node_end、state_delta 事件，
+    最後產生包含最終狀態的 end 事件（出錯時為 error 事件）。
+    """
+    events: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue()
+
+    def run() -> None:
+        try:
+            events.put({"type": "end", "state": run_with_events(workflow, state, events.put, tokens=True)})
+        except Exception as e:
+            events.put({"type": "error", "error": str(e)})
+        finally:
+            events.put(None)
+
+    threading.Thread(target=run, daemon=True).start()
+    while True:
+        event = events.get()
+        if event is None:
+            return
+        yield event
+
+async def astream_workflow(workflow: Callable[[AgentState], Any], state: AgentState) -> AsyncIterator[Dict[str, Any]]:
+    """stream_workflow 的非同步版本，用於 create_async_workflow() 返回的工作流"""
+    events: "asyncio.Queue[Optional[Dict[str, Any]]]" = asyncio.Queue()
+
+    async def run() -> None:
+        _event_sink.set(events.put_nowait)
+        _stream_tokens.set(True)
+        try:
+            events.put_nowait({"type": "end", "state": await workflow(state)})
+        except Exception as e:
+            events.put_nowait({"type": "error", "error": str(e)})
+        finally:
+            events.put_nowait(None)
+
+    task = asyncio.create_task(run())
+    try:
+        while True:
+            event = await events.get()
+            if event is None:
+                return
+            yield event
+    finally:
+        # 消費者提前停止時取消仍在執行的工作流
+        if not task.done():
+            task.cancel()
+
 def create_initial_state(task: str) -> AgentState:
     """創建初始狀態"""
     return {
@@ -244,9 +789,12 @@ def create_initial_state(task: str) -> AgentState:
         "current_agent": "supervisor",
         "next_agent": "supervisor",
         "current_task": task,
+        "original_task": task,
         "final_decision": "",
         "iteration": 1,
         "start_time": time.time(),  # 記錄開始時間
         "max_iterations": 10,  # 設置最大迭代次數
-        "max_execution_time": 600  # 設置最大執行時間（10分鐘）
-    } 
\ No newline at end of file
+        "max_execution_time": 600,  # 設置最大執行時間（10分鐘）
+        "subtasks": [],
+        "max_fan_out": 3  # 並行研究的最大分支數，設為 1 則不拆分
+    }